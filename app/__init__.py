@@ -1,34 +1,109 @@
 import logging, os
 from logging.handlers import SMTPHandler, RotatingFileHandler
-from flask import Flask, request
+from flask import Flask
 from config import Config
-from flask_sqlalchemy import SQLAlchemy
-from flask_migrate import Migrate
 from flask_login import LoginManager
 from flask_mail import Mail
-from flask_bootstrap import Bootstrap
-from flask_moment import Moment
 from flask_babel import Babel
-from flask_babel import lazy_gettext as _l
+from app.database import Database
+from app.lastseen import LastSeenTracker
+from app.usercache import UserCache
+from app.cache import Cache
+from app.groupcommit import GroupCommit
+from app.passwords import PasswordHasher
+from app.metrics import Metrics
+from app.ratelimit import Limiter
+from app.assets import Assets
+from app.i18n import Localization, request_locale, lazy_gettext as _l
 
 
-app = Flask(__name__)
-app.config.from_object(Config)
-db = SQLAlchemy(app)
-migrate = Migrate(app, db)
-login = LoginManager(app)
-login.login_view = 'login'
+metrics = Metrics()
+db = Database()
+login = LoginManager()
+login.login_view = 'auth.login'
 login.login_message = _l('Please log in to access this page!')
 login.needs_refresh_message = _l('Please reauthenticate to access this page!')
-mail = Mail(app)
-bootstrap = Bootstrap(app)
-moment = Moment(app)
-babel = Babel(app)
+mail = Mail()
+babel = Babel()
+localization = Localization(babel)
+last_seen = LastSeenTracker(db=db)
+user_cache = UserCache(db=db)
+cache = Cache(db=db)
+group_commit = GroupCommit(db=db)
+hasher = PasswordHasher()
+limiter = Limiter()
+assets = Assets()
 
 
-from app import routes, models, errors
+def create_app(config_class=Config):
+    """Build an application for ``config_class``.
 
-if not app.debug:
+    Only what every process needs is set up here.  Flask-Migrate, and with
+    it Alembic, is loaded for the ``flask`` command alone, and the page
+    extensions and log handlers are installed by the first request, so
+    workers and CLI commands do not pay for what they never use.
+    """
+    app = Flask(__name__)
+    app.config.from_object(config_class)
+
+    metrics.init_app(app)
+    db.init_app(app)
+    login.init_app(app)
+    mail.init_app(app)
+    babel.init_app(app)
+    localization.init_app(app)
+    last_seen.init_app(app)
+    user_cache.init_app(app)
+    cache.init_app(app)
+    group_commit.init_app(app)
+    hasher.init_app(app)
+    limiter.init_app(app)
+    assets.init_app(app)
+
+    from app.email import dispatcher
+    dispatcher.init_app(app)
+    app.before_first_request(dispatcher.start)
+
+    from app.jobs import jobs
+    jobs.init_app(app)
+
+    from app.tokens import tokens
+    tokens.init_app(app)
+
+    if os.environ.get('FLASK_RUN_FROM_CLI'):
+        from flask_migrate import Migrate
+        Migrate(app, db)
+
+    @app.before_first_request
+    def init_pages():
+        init_templates(app)
+        if not app.debug and not app.testing:
+            init_logging(app)
+
+    from app.errors import bp as errors_bp
+    app.register_blueprint(errors_bp)
+
+    from app.auth import bp as auth_bp
+    app.register_blueprint(auth_bp)
+
+    from app.main import bp as main_bp
+    app.register_blueprint(main_bp)
+
+    from app.api import bp as api_bp
+    app.register_blueprint(api_bp)
+
+    return app
+
+
+def init_templates(app):
+    """Install Bootstrap and Moment, which only rendered pages use."""
+    from flask_bootstrap import Bootstrap
+    from flask_moment import Moment
+    Bootstrap(app)
+    Moment(app)
+
+
+def init_logging(app):
     if app.config['MAIL_SERVER']:
         auth = None
         if app.config['MAIL_USERNAME'] or app.config['MAIL_PASSWORD']:
@@ -67,9 +142,8 @@ if not app.debug:
 
 @babel.localeselector
 def get_locale():
-    retstr = request.accept_languages.best_match(app.config['LANGUAGES'])
-    if retstr in ('zh_cn', 'zh_CN'):
-        return 'zh_Hans'
-    elif retstr in ('zh_tw', 'zh_TW'):
-        return 'zh_Hant_TW'
-    return 'en'
+    # Requests get their locale from Localization before the view runs.
+    return request_locale()
+
+
+from app import models
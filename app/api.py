@@ -0,0 +1,297 @@
+"""Versioned JSON API under ``/api/v1``.
+
+Reads select plain column tuples rather than ORM objects.  Lists are paged
+with the opaque ``cursor`` of the ``next`` link; post lists are newest
+first, user lists are ordered by id.
+
+GET responses carry an ``ETag`` built from ``cache.version``, which changes
+with every commit that writes posts or users, so a matching
+``If-None-Match`` is answered with 304 before any query runs.  Post
+responses also carry ``Last-Modified`` from their newest post.
+
+Requests are authenticated with the session cookie of the web login.
+Writes must send a JSON body, which cross-site forms cannot do, so they do
+not need a CSRF token.
+"""
+from functools import wraps
+from hashlib import md5
+from flask import Blueprint, jsonify, request, url_for, abort, \
+    make_response, current_app
+from flask_login import current_user
+from werkzeug.exceptions import HTTPException
+from app import db, cache, archive, group_commit
+from app.jobs import jobs
+from app.main.forms import PostForm, UpdatePostForm
+from app.models import User, Post, followers, avatar_url
+from app.pagination import decode_cursor, encode_cursor, older_than
+from app.timeline import home_timeline
+from app.writes import add_post
+
+bp = Blueprint('api', __name__, url_prefix='/api/v1')
+
+POST_COLUMNS = (Post.id, Post.title, Post.body, Post.timestamp, Post.user_id)
+USER_COLUMNS = (User.id, User.username, User.avatar_hash)
+
+
+@bp.errorhandler(HTTPException)
+def error_response(error):
+    response = jsonify(error=error.name, message=error.description)
+    response.status_code = error.code
+    response.headers.extend(
+        (name, value) for name, value in error.get_headers()
+        if name != 'Content-Type')
+    return response
+
+
+def login_required(view):
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if not current_user.is_authenticated:
+            abort(401)
+        return view(*args, **kwargs)
+    return wrapper
+
+
+def json_required(view):
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if not request.is_json:
+            abort(415)
+        return view(*args, **kwargs)
+    return wrapper
+
+
+def conditional(view):
+    """Answer a GET with 304 when the client's ETag is still current."""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        version = cache.version
+        if version is None:
+            return view(*args, **kwargs)
+        etag = md5('{}:{}:{}'.format(
+            version, current_user.get_id(),
+            request.full_path).encode('utf-8')).hexdigest()
+        if etag in request.if_none_match:
+            response = current_app.response_class(status=304)
+        else:
+            response = make_response(view(*args, **kwargs))
+        response.set_etag(etag)
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+        return response.make_conditional(request)
+    return wrapper
+
+
+def user_dict(row):
+    return {'id': row.id, 'username': row.username,
+            'avatar': avatar_url(row.avatar_hash, 128)}
+
+
+def post_dict(row, author):
+    return {'id': row.id, 'title': row.title, 'body': row.body,
+            'timestamp': row.timestamp.isoformat() + 'Z',
+            'author': user_dict(author)}
+
+
+def page_size():
+    return max(1, min(request.args.get(
+        'limit', current_app.config['API_POSTS_PER_PAGE'], type=int),
+        current_app.config['API_MAX_PER_PAGE']))
+
+
+def next_url(cursor, limit):
+    return url_for(request.endpoint, cursor=cursor, limit=limit,
+                   **request.view_args)
+
+
+def post_page(query, scope=None):
+    """Return the response for a page of a post query, newest first.
+
+    With an archive ``scope``, pages continue into the archived posts.
+    """
+    limit = page_size()
+    cursor = decode_cursor(request.args.get('cursor'))
+    query = older_than(query.order_by(None).with_entities(*POST_COLUMNS),
+                       cursor)
+    rows = query.order_by(Post.timestamp.desc(),
+                          Post.id.desc()).limit(limit + 1).all()
+    if len(rows) <= limit and scope is not None:
+        rows += archive.older(scope, (rows[-1].timestamp, rows[-1].id)
+                              if rows else cursor, limit + 1 - len(rows))
+    more = len(rows) > limit
+    rows = rows[:limit]
+    authors = {}
+    if rows:
+        authors = {author.id: author for author in db.session.query(
+            *USER_COLUMNS).filter(User.id.in_({row.user_id
+                                               for row in rows}))}
+    response = jsonify(
+        items=[post_dict(row, authors[row.user_id]) for row in rows],
+        next=next_url(encode_cursor(rows[-1]), limit) if more else None)
+    if rows:
+        response.last_modified = rows[0].timestamp
+    return response
+
+
+def user_page(query):
+    """Return the response for a page of a user query, ordered by id."""
+    limit = page_size()
+    cursor = request.args.get('cursor', type=int)
+    if cursor is not None:
+        query = query.filter(User.id > cursor)
+    rows = query.order_by(User.id).limit(limit + 1).all()
+    more = len(rows) > limit
+    rows = rows[:limit]
+    return jsonify(items=[user_dict(row) for row in rows],
+                   next=next_url(rows[-1].id, limit) if more else None)
+
+
+def get_user_id(username):
+    user_id = db.session.query(User.id).filter_by(
+        username=username).scalar()
+    if user_id is None:
+        abort(404)
+    return user_id
+
+
+def validation_error(form):
+    response = jsonify(error='Bad Request',
+                       messages={name: [str(message) for message in messages]
+                                 for name, messages in form.errors.items()})
+    response.status_code = 400
+    return response
+
+
+def post_response(post, status=200):
+    response = jsonify(post_dict(post, post.author))
+    response.status_code = status
+    response.last_modified = post.timestamp
+    return response
+
+
+@bp.route('/timeline')
+@login_required
+@conditional
+def timeline():
+    return post_page(home_timeline(current_user),
+                     archive.followed_by(current_user.id))
+
+
+@bp.route('/posts')
+@login_required
+@db.replica
+@conditional
+def explore():
+    return post_page(Post.query, archive.everyone)
+
+
+@bp.route('/users/<username>')
+@login_required
+@db.replica
+@conditional
+def get_user(username):
+    row = db.session.query(
+        *USER_COLUMNS, User.about_me, User.followers_count,
+        User.following_count).filter_by(username=username).first()
+    if row is None:
+        abort(404)
+    profile = user_dict(row)
+    profile.update(
+        about_me=row.about_me,
+        followers_count=row.followers_count,
+        following_count=row.following_count,
+        posts=url_for('api.user_posts', username=row.username),
+        followers=url_for('api.user_followers', username=row.username),
+        following=url_for('api.user_following', username=row.username))
+    return jsonify(profile)
+
+
+@bp.route('/users/<username>/posts')
+@login_required
+@db.replica
+@conditional
+def user_posts(username):
+    user_id = get_user_id(username)
+    return post_page(Post.query.filter(Post.user_id == user_id),
+                     archive.by_author(user_id))
+
+
+@bp.route('/users/<username>/followers')
+@login_required
+@db.replica
+@conditional
+def user_followers(username):
+    return user_page(db.session.query(*USER_COLUMNS).join(
+        followers, followers.c.follower_id == User.id).filter(
+            followers.c.followed_id == get_user_id(username)))
+
+
+@bp.route('/users/<username>/following')
+@login_required
+@db.replica
+@conditional
+def user_following(username):
+    return user_page(db.session.query(*USER_COLUMNS).join(
+        followers, followers.c.followed_id == User.id).filter(
+            followers.c.follower_id == get_user_id(username)))
+
+
+@bp.route('/posts/<int:id>')
+@login_required
+@conditional
+def get_post(id):
+    row = db.session.query(*POST_COLUMNS).filter(Post.id == id).first()
+    if row is None:
+        row = next(iter(archive.find([id])), None)
+    if row is None:
+        abort(404)
+    author = db.session.query(*USER_COLUMNS).filter(
+        User.id == row.user_id).one()
+    response = jsonify(post_dict(row, author))
+    response.last_modified = row.timestamp
+    return response
+
+
+@bp.route('/posts', methods=['POST'])
+@login_required
+@json_required
+def create_post():
+    form = PostForm(meta={'csrf': False})
+    if not form.validate():
+        return validation_error(form)
+    post = Post.query.get(group_commit.run(
+        add_post, current_user.id, form.title.data, form.body.data))
+    response = post_response(post, 201)
+    response.headers['Location'] = url_for('api.get_post', id=post.id)
+    return response
+
+
+def get_own_post(id):
+    post = Post.query.get_or_404(id)
+    if post.user_id != current_user.id:
+        abort(403)
+    return post
+
+
+@bp.route('/posts/<int:id>', methods=['PUT'])
+@login_required
+@json_required
+def update_post(id):
+    post = get_own_post(id)
+    form = UpdatePostForm(meta={'csrf': False})
+    if not form.validate():
+        return validation_error(form)
+    post.title = form.title.data
+    post.body = form.body.data
+    jobs.emit('post.updated', post_id=post.id)
+    db.session.commit()
+    return post_response(post)
+
+
+@bp.route('/posts/<int:id>', methods=['DELETE'])
+@login_required
+def delete_post(id):
+    db.session.delete(get_own_post(id))
+    jobs.emit('post.deleted', key=str(id), post_id=id)
+    db.session.commit()
+    return '', 204
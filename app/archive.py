@@ -0,0 +1,255 @@
+"""Monthly archive tables for cold posts.
+
+``flask posts archive --older-than DAYS`` moves older posts out of ``post``
+into one ``post_archive_YYYYMM`` table per month, and records the range of
+timestamps and ids of every table in ``post_archive``.  The ``post`` table
+and its indexes then only hold the recent posts almost every page reads.
+
+Post lists fall through to the archive once a page runs past the oldest
+post left in ``post``: ``KeysetPagination`` and the API's post pages take a
+*scope*, a function returning the condition a row of an archive table must
+meet, and read the missing rows month by month, newest first, with the
+same ``(timestamp, id)`` cursor.  The first pages never touch the archive.
+
+Archived posts come back as ``ArchivedPost`` objects, which have the
+attributes templates and the API use, but they are read-only.  They leave
+the home timelines, whose older pages fall through to the posts of
+followed users, and the search index.  ``post`` is an AUTOINCREMENT table
+on SQLite, so archived ids are never handed out again.
+"""
+from sqlalchemy import MetaData, Table, Column, Integer, String, \
+    DateTime, Index, select, and_, or_, true, func, text
+from app import db, cache
+from app.models import Post, PostArchive, User, followers, timeline
+from app.search import unindex_posts
+
+TABLE_PREFIX = 'post_archive_'
+
+# Kept apart from db.metadata, so create_all and Alembic leave them alone.
+metadata = MetaData()
+
+
+def archive_table(month):
+    """Return the archive table of a ``YYYYMM`` month."""
+    name = TABLE_PREFIX + month
+    if name not in metadata.tables:
+        Table(name, metadata,
+              Column('id', Integer, primary_key=True),
+              Column('title', String(64)),
+              Column('body', String(140)),
+              Column('timestamp', DateTime),
+              Column('user_id', Integer),
+              Index(f'ix_{name}_timestamp_id', 'timestamp', 'id'),
+              Index(f'ix_{name}_user_id_timestamp', 'user_id', 'timestamp'))
+    return metadata.tables[name]
+
+
+def month_of(timestamp):
+    return timestamp.strftime('%Y%m')
+
+
+class ArchivedPost(object):
+    """Read-only post loaded from an archive table."""
+
+    archived = True
+
+    def __init__(self, row, author=None):
+        self.id = row.id
+        self.title = row.title
+        self.body = row.body
+        self.timestamp = row.timestamp
+        self.user_id = row.user_id
+        self.author = author
+
+    def __repr__(self):
+        return f'<ArchivedPost {self.title}>'
+
+
+def everyone(table):
+    return true()
+
+
+def by_author(user_id):
+    return lambda table: table.c.user_id == user_id
+
+
+def followed_by(user_id):
+    """Scope of a home timeline: the user's posts and those they follow."""
+    followed = select([followers.c.followed_id]).where(
+        followers.c.follower_id == user_id)
+    return lambda table: or_(table.c.user_id == user_id,
+                             table.c.user_id.in_(followed))
+
+
+def months():
+    """The ``post_archive`` registry, oldest month first.
+
+    It is read every time rather than cached: ``flask posts archive`` runs
+    in a process of its own, whose cache invalidation other processes may
+    not see, and the table has one small row per month.
+    """
+    return db.session.query(
+        PostArchive.month, PostArchive.oldest, PostArchive.newest,
+        PostArchive.min_id, PostArchive.max_id).order_by(
+            PostArchive.month).all()
+
+
+def newest_archived():
+    """Timestamp of the newest archived post, or None."""
+    return max((newest for month, oldest, newest, min_id, max_id
+                in months()), default=None)
+
+
+def older(scope, cursor, limit):
+    """Up to ``limit`` archived rows after ``cursor``, newest first."""
+    rows = []
+    for month, oldest, newest, min_id, max_id in reversed(months()):
+        if cursor is not None and oldest > cursor[0]:
+            continue
+        table = archive_table(month)
+        query = select([table]).where(scope(table))
+        if cursor is not None:
+            timestamp, id = cursor
+            query = query.where(or_(
+                table.c.timestamp < timestamp,
+                and_(table.c.timestamp == timestamp, table.c.id < id)))
+        rows.extend(db.session.execute(query.order_by(
+            table.c.timestamp.desc(), table.c.id.desc()).limit(
+                limit - len(rows))))
+        if len(rows) >= limit:
+            break
+    return rows
+
+
+def newer(scope, cursor, limit):
+    """Up to ``limit`` archived rows before ``cursor``, oldest first."""
+    timestamp, id = cursor
+    rows = []
+    for month, oldest, newest, min_id, max_id in months():
+        if newest < timestamp:
+            continue
+        table = archive_table(month)
+        rows.extend(db.session.execute(select([table]).where(and_(
+            scope(table), or_(table.c.timestamp > timestamp,
+                              and_(table.c.timestamp == timestamp,
+                                   table.c.id > id)))).order_by(
+                table.c.timestamp, table.c.id).limit(limit - len(rows))))
+        if len(rows) >= limit:
+            break
+    return rows
+
+
+def find(ids):
+    """Return the archived rows with the given ids, in any order."""
+    ids = set(ids)
+    if not ids:
+        return []
+    rows = []
+    for month, oldest, newest, min_id, max_id in months():
+        if min_id > max(ids) or max_id < min(ids):
+            continue
+        table = archive_table(month)
+        rows.extend(db.session.execute(
+            select([table]).where(table.c.id.in_(ids))))
+    return rows
+
+
+def load(rows):
+    """Turn archived rows into ``ArchivedPost`` objects with authors."""
+    authors = {user.id: user for user in User.query.filter(
+        User.id.in_({row.user_id for row in rows}))} if rows else {}
+    return [ArchivedPost(row, authors.get(row.user_id)) for row in rows]
+
+
+def archive_posts(before, batch_size=1000):
+    """Move the posts older than ``before`` to the archive tables.
+
+    Every batch is moved in its own transaction; yields the number of
+    posts moved so far.
+    """
+    post = Post.__table__
+    moved = 0
+    while True:
+        rows = db.session.execute(select([post]).where(
+            post.c.timestamp < before).order_by(
+                post.c.timestamp).limit(batch_size)).fetchall()
+        if not rows:
+            return
+        by_month = {}
+        for row in rows:
+            by_month.setdefault(month_of(row.timestamp), []).append(row)
+        connection = db.session.connection()
+        for month, month_rows in by_month.items():
+            table = archive_table(month)
+            table.create(connection, checkfirst=True)
+            connection.execute(table.insert(),
+                               [dict(row) for row in month_rows])
+            record(month, month_rows)
+        ids = [row.id for row in rows]
+        unindex_posts(connection, ids)
+        connection.execute(timeline.delete().where(
+            timeline.c.post_id.in_(ids)))
+        connection.execute(post.delete().where(post.c.id.in_(ids)))
+        db.session.commit()
+        # Core statements do not reach the cache's session hooks.
+        cache.invalidate()
+        moved += len(rows)
+        yield moved
+
+
+def record(month, rows):
+    archive = PostArchive.query.get(month)
+    if archive is None:
+        archive = PostArchive(month=month, rows=0)
+        db.session.add(archive)
+    timestamps = [row.timestamp for row in rows]
+    ids = [row.id for row in rows]
+    archive.rows += len(rows)
+    archive.oldest = min([archive.oldest or timestamps[0]] + timestamps)
+    archive.newest = max([archive.newest or timestamps[0]] + timestamps)
+    archive.min_id = min([archive.min_id or ids[0]] + ids)
+    archive.max_id = max([archive.max_id or ids[0]] + ids)
+
+
+def recount(month):
+    """Rewrite the ``post_archive`` row of a month from its table."""
+    table = archive_table(month)
+    rows, oldest, newest, min_id, max_id = db.session.execute(select([
+        func.count(), func.min(table.c.timestamp),
+        func.max(table.c.timestamp), func.min(table.c.id),
+        func.max(table.c.id)])).first()
+    archive = PostArchive.query.get(month)
+    if not rows:
+        if archive is not None:
+            db.session.delete(archive)
+        return
+    if archive is None:
+        archive = PostArchive(month=month)
+        db.session.add(archive)
+    archive.rows = rows
+    archive.oldest, archive.newest = oldest, newest
+    archive.min_id, archive.max_id = min_id, max_id
+
+
+def reserve_ids():
+    """Start the ``post`` ids above every archived one.
+
+    Only SQLite needs this, for archived ids that were never in ``post``,
+    as after an import.
+    """
+    if db.engine.dialect.name != 'sqlite':
+        return
+    top = db.session.query(func.max(PostArchive.max_id)).scalar()
+    if top is None:
+        return
+    connection = db.session.connection()
+    seq = connection.execute(text(
+        "SELECT seq FROM sqlite_sequence WHERE name = 'post'")).scalar()
+    if seq is None:
+        connection.execute(text(
+            "INSERT INTO sqlite_sequence (name, seq) VALUES ('post', :top)"),
+            top=top)
+    elif seq < top:
+        connection.execute(text(
+            "UPDATE sqlite_sequence SET seq = :top WHERE name = 'post'"),
+            top=top)
@@ -0,0 +1,154 @@
+"""Serve the application from an ASGI server.
+
+    uvicorn asgi:application --port 5000
+
+This is an ASGI front end for the existing synchronous views, not an async
+rewrite of them.  ``WsgiBridge`` runs each view in a pool of
+``ASGI_THREADS`` threads, and database access stays blocking: a slow query
+holds its thread exactly as it would under a threaded WSGI server, and the
+pool caps how many views run at once.  What the event loop takes over is
+the connection handling.  It reads request bodies and writes responses, so
+an idle keep-alive connection or a slow client costs a socket instead of a
+thread.  ``benchmarks/serving.py`` measures that, not async I/O.
+
+Request bodies are read into memory up to ``MAX_CONTENT_LENGTH``; a longer
+one gets a 413 before any view runs.  Response bodies are sent chunk by
+chunk as the view's iterable yields them.
+"""
+import asyncio
+import io
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+TOO_LARGE = b'Request body too large'
+
+
+class WsgiBridge(object):
+    def __init__(self, app, threads=None):
+        self.app = app
+        self.threads = threads or app.config['ASGI_THREADS']
+        self.executor = ThreadPoolExecutor(self.threads,
+                                           thread_name_prefix='asgi')
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            raise ValueError(f'Unsupported ASGI scope {scope["type"]!r}')
+        body = await self._read_body(scope, receive)
+        if body is None:
+            return
+        if body is TOO_LARGE:
+            await send({'type': 'http.response.start', 'status': 413,
+                        'headers': [(b'content-type', b'text/plain'),
+                                    (b'content-length',
+                                     str(len(TOO_LARGE)).encode())]})
+            await send({'type': 'http.response.body', 'body': TOO_LARGE})
+            return
+        loop = asyncio.get_running_loop()
+        status, headers, result, chunks, first = \
+            await loop.run_in_executor(self.executor, self._start,
+                                       environ(scope, body))
+        try:
+            await send({'type': 'http.response.start', 'status': status,
+                        'headers': headers})
+            chunk = first
+            while chunk is not None:
+                await send({'type': 'http.response.body', 'body': chunk,
+                            'more_body': True})
+                chunk = await loop.run_in_executor(self.executor, next,
+                                                   chunks, None)
+            await send({'type': 'http.response.body', 'body': b''})
+        finally:
+            await loop.run_in_executor(self.executor, self._close, result)
+
+    async def _read_body(self, scope, receive):
+        """Return the request body, TOO_LARGE, or None on disconnect."""
+        limit = self.app.config['MAX_CONTENT_LENGTH']
+        for name, value in scope['headers']:
+            if name.lower() == b'content-length' and limit is not None and \
+                    value.isdigit() and int(value) > limit:
+                return TOO_LARGE
+        body = io.BytesIO()
+        more_body = True
+        while more_body:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                return None
+            body.write(message.get('body', b''))
+            if limit is not None and body.tell() > limit:
+                return TOO_LARGE
+            more_body = message.get('more_body', False)
+        body.seek(0)
+        return body
+
+    def _start(self, environ):
+        """Call the app and wait for its first chunk, by which time it has
+        called ``start_response``."""
+        response = []
+
+        def start_response(status, headers, exc_info=None):
+            response[:] = [int(status.split(' ', 1)[0]),
+                           [(name.lower().encode('latin-1'),
+                             value.encode('latin-1'))
+                            for name, value in headers]]
+
+        result = self.app(environ, start_response)
+        try:
+            chunks = iter(result)
+            first = next(chunks, None)
+        except BaseException:
+            self._close(result)
+            raise
+        return response[0], response[1], result, chunks, first
+
+    def _close(self, result):
+        if hasattr(result, 'close'):
+            result.close()
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.executor.shutdown()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+
+def environ(scope, body):
+    """Build the WSGI environ of an ASGI HTTP request."""
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode(
+            'utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': 'HTTP/' + scope['http_version'],
+        'REMOTE_ADDR': client[0],
+        'REMOTE_PORT': str(client[1]),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': body,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope['headers']:
+        name = name.decode('latin-1').upper().replace('-', '_')
+        if name not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            name = 'HTTP_' + name
+        value = value.decode('latin-1')
+        if name in environ:
+            # HTTP/2 clients send every cookie in a header of its own.
+            separator = '; ' if name == 'HTTP_COOKIE' else ','
+            value = environ[name] + separator + value
+        environ[name] = value
+    return environ
@@ -0,0 +1,199 @@
+"""Fingerprinted, precompressed static assets.
+
+``flask assets build`` concatenates and minifies each bundle of
+``ASSETS_BUNDLES``, copies the files of ``ASSETS_FILES``, and writes both
+under ``static/dist`` with the first characters of their SHA-256 in the
+name, next to gzip and, when the ``brotli`` package is installed, brotli
+variants.  ``static/dist/manifest.json`` maps every logical name to its
+fingerprinted file.
+
+Once a manifest exists, ``url_for('static', filename=...)`` returns the
+fingerprinted file for any name in it, and ``asset_urls(bundle)`` returns
+the single bundle file.  Without one, both fall back to the source files,
+so development needs no build step.  Fingerprinted files never change, so
+they are served with ``Cache-Control: immutable`` for ``ASSETS_MAX_AGE``
+seconds, compressed as the client accepts.
+
+``ASSETS_VENDOR`` serves Moment.js from ``static/vendor``, which
+``flask assets vendor`` fills, and leaves out the web font, so pages load
+nothing from a CDN.  Bootstrap, jQuery and Popper already ship with the
+theme under ``static/assets/plugins``.
+"""
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import re
+import shutil
+import urllib.request
+from flask import current_app, request, send_from_directory, url_for
+
+OUTPUT = 'dist'
+MANIFEST = 'manifest.json'
+VENDOR = {
+    'vendor/moment-with-locales.min.js':
+        'https://cdnjs.cloudflare.com/ajax/libs/moment.js/{moment}/'
+        'moment-with-locales.min.js',
+}
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+CSS_COMMENT = re.compile(r'/\*(?!!).*?\*/', re.S)
+CSS_SPACE = re.compile(r'\s*([{};:,>])\s*')
+SOURCE_MAP = re.compile(r'^\s*//# sourceMappingURL=.*$', re.M)
+
+
+def minify_css(source):
+    """Drop comments, except ``/*!`` licenses, and needless whitespace."""
+    source = CSS_COMMENT.sub('', source)
+    source = CSS_SPACE.sub(r'\1', source)
+    return re.sub(r'\s+', ' ', source).replace(';}', '}').strip()
+
+
+def minify_js(source):
+    """Drop source map comments; the sources are minified already."""
+    return SOURCE_MAP.sub('', source).strip()
+
+
+def fingerprint(name, content):
+    """Return ``name`` with the content hash before its extension."""
+    stem, ext = os.path.splitext(name)
+    digest = hashlib.sha256(content).hexdigest()[:12]
+    return f'{stem}.{digest}{ext}'
+
+
+def compress(path, content):
+    """Write the gzip and, if available, brotli variants of a file."""
+    with open(path + '.gz', 'wb') as f:
+        f.write(gzip.compress(content, 9, mtime=0))
+    try:
+        import brotli
+    except ImportError:
+        return
+    with open(path + '.br', 'wb') as f:
+        f.write(brotli.compress(content))
+
+
+class Assets(object):
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('ASSETS_BUNDLES', {})
+        app.config.setdefault('ASSETS_FILES', ())
+        app.config.setdefault('ASSETS_VENDOR', False)
+        app.config.setdefault('ASSETS_MAX_AGE', 365 * 24 * 3600)
+        app.extensions['assets'] = self.read_manifest(app)
+        app.url_defaults(self._url_defaults)
+        app.add_template_global(asset_urls)
+        if app.has_static_folder:
+            app.view_functions['static'] = self._static_view(
+                app.view_functions['static'])
+
+    @staticmethod
+    def read_manifest(app):
+        try:
+            with open(os.path.join(app.static_folder, OUTPUT, MANIFEST)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def build(self, app):
+        """Write every bundle and file with its fingerprint; returns them."""
+        static = app.static_folder
+        output = os.path.join(static, OUTPUT)
+        shutil.rmtree(output, ignore_errors=True)
+        os.makedirs(output)
+        sources = {name: [name] for name in app.config['ASSETS_FILES']}
+        sources.update(app.config['ASSETS_BUNDLES'])
+        if app.config['ASSETS_VENDOR']:
+            sources.update((name, [name]) for name in VENDOR)
+        manifest = {}
+        for name, files in sources.items():
+            content = self._bundle(static, name, files)
+            target = fingerprint(os.path.join(OUTPUT, name), content)
+            path = os.path.join(static, target)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as f:
+                f.write(content)
+            compress(path, content)
+            manifest[name] = target.replace(os.sep, '/')
+        with open(os.path.join(output, MANIFEST), 'w') as f:
+            json.dump(manifest, f, indent=2, sort_keys=True)
+        app.extensions['assets'] = manifest
+        return manifest
+
+    def vendor(self, app):
+        """Download the files ``ASSETS_VENDOR`` serves locally."""
+        from flask_moment import default_moment_version
+        for name, url in VENDOR.items():
+            path = os.path.join(app.static_folder, name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with urllib.request.urlopen(url.format(
+                    moment=default_moment_version)) as response:
+                content = response.read()
+            with open(path, 'wb') as f:
+                f.write(content)
+            yield name
+
+    @staticmethod
+    def _bundle(static, name, files):
+        contents = []
+        for filename in files:
+            with open(os.path.join(static, filename), 'rb') as f:
+                contents.append(f.read())
+        if name.endswith('.css'):
+            return minify_css('\n'.join(
+                c.decode('utf-8') for c in contents)).encode('utf-8')
+        if name.endswith('.js'):
+            return ';\n'.join(minify_js(c.decode('utf-8'))
+                              for c in contents).encode('utf-8')
+        return b''.join(contents)
+
+    def _url_defaults(self, endpoint, values):
+        if endpoint == 'static':
+            manifest = current_app.extensions['assets']
+            filename = values.get('filename')
+            if filename in manifest:
+                values['filename'] = manifest[filename]
+
+    def _static_view(self, view):
+        prefix = OUTPUT + '/'
+
+        def static(filename):
+            if not filename.startswith(prefix):
+                return view(filename=filename)
+            return self._send_fingerprinted(filename)
+        return static
+
+    def _send_fingerprinted(self, filename):
+        app = current_app
+        accepted = request.accept_encodings
+        response = None
+        for encoding, suffix in ENCODINGS:
+            if accepted[encoding] and os.path.isfile(os.path.join(
+                    app.static_folder, filename + suffix)):
+                response = send_from_directory(
+                    app.static_folder, filename + suffix,
+                    mimetype=mimetypes.guess_type(filename)[0],
+                    conditional=True)
+                response.content_encoding = encoding
+                break
+        if response is None:
+            response = send_from_directory(app.static_folder, filename,
+                                           conditional=True)
+        response.vary.add('Accept-Encoding')
+        response.cache_control.public = True
+        response.cache_control.max_age = app.config['ASSETS_MAX_AGE']
+        response.cache_control.immutable = True
+        return response
+
+
+def asset_urls(name):
+    """URLs of a bundle: the fingerprinted file, or its sources."""
+    manifest = current_app.extensions['assets']
+    if name in manifest:
+        return [url_for('static', filename=name)]
+    return [url_for('static', filename=filename)
+            for filename in current_app.config['ASSETS_BUNDLES'][name]]
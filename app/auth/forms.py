@@ -1,11 +1,10 @@
 from flask_wtf import FlaskForm
-from wtforms import PasswordField, BooleanField, SubmitField, TextAreaField
+from wtforms import PasswordField, BooleanField, SubmitField
 from wtforms.fields.core import StringField
 from wtforms.validators import DataRequired, Email, EqualTo, ValidationError, \
     Length
+from app.i18n import lazy_gettext as _l
 from app.models import User
-from flask_babel import lazy_gettext as _l
-
 
 
 class LoginForm(FlaskForm):
@@ -61,68 +60,6 @@ class RegistrationForm(FlaskForm):
             raise ValidationError(_l('Please use a different email address.'))
 
 
-class EditProfileForm(FlaskForm):
-    username = StringField(
-        label=_l('User name'),
-        validators=[
-            DataRequired(message=_l('User name is must')),
-            Length(
-                min=6,
-                max=64,
-                message=_l('Must be at least 6 characters, at most 64 characters.')
-            )
-        ],
-        description=_l('Please input User name between 6 ~ 64 characters.'),
-        render_kw={'placeholder': _l('Please input user name')})
-    about_me = TextAreaField(
-        label=_l('About me'),
-        validators=[Length(max=140, message=_l('Must be at most 140 characters'))],
-        description=_l('Please input post content under 140 length.'),
-        render_kw={'placeholder': _l('Please input self-content')})
-    submit = SubmitField(_l('Submit'))
-
-    def __init__(self, original_username, *args, **kwargs):
-        super(EditProfileForm, self).__init__(*args, **kwargs)
-        self.original_username = original_username
-
-    def validate_username(self, username):
-        if username.data != self.original_username:
-            user = User.query.filter_by(username=username.data).first()
-            if user is not None:
-                raise ValidationError(_l('Please use a different username.'))
-
-
-class PostForm(FlaskForm):
-    title = StringField(label=_l('Post Title'),
-                        validators=[
-                            DataRequired(message=_l('Need Post title.')),
-                            Length(max=64,
-                                   message=_l('Must be at most 64 characters'))
-                        ],
-                        description=_l('Please input post title under 64 length.'),
-                        render_kw={'placeholder': _l('Please input post title')})
-    body = TextAreaField(
-        label=_l('Content'),
-        validators=[Length(max=140, message=_l('Must be at most 140 characters'))],
-        description=_l('Please input post content under 140 length.'),
-        render_kw={'placeholder': _l('Please input post content')})
-    submit = SubmitField(_l('New Post'))
-
-
-class UpdatePostForm(FlaskForm):
-    title = StringField(label=_l('Post Title'),
-                        validators=[DataRequired(message=_l('Need Post title.'))],
-                        description=_l('Please input post title under 64 length.'),
-                        render_kw={'placeholder': _l('Please input post title')})
-    body = TextAreaField(
-        label=_l('Content'),
-        validators=[Length(max=140, message=_l('Must be at most 140 characters'))],
-        description=_l('Please input post content under 140 length.'),
-        render_kw={'placeholder': _l('Please input post content')})
-    submit = SubmitField(_l('Update'))
-    # delete = SubmitField(_l('Delete'))
-
-
 class ResetPasswordRequestForm(FlaskForm):
     email = StringField(
         label=_l('Email'),
@@ -0,0 +1,107 @@
+from flask import render_template, redirect, flash, url_for, request
+from flask_login import current_user, login_user, logout_user
+from flask_babel import _
+from sqlalchemy.exc import IntegrityError
+from werkzeug.urls import url_parse
+from app import db, limiter
+from app.auth import bp
+from app.auth.forms import LoginForm, RegistrationForm
+from app.auth.forms import ResetPasswordRequestForm, ResetPasswordForm
+from app.auth.email import send_password_reset_email
+from app.models import User
+from app.ratelimit import by_form
+from app.tokens import tokens
+
+
+@bp.route('/login', methods=['GET', 'POST'])
+@limiter.limit('20/minute')
+@limiter.limit('5/minute', key=by_form('username'))
+def login():
+    if current_user.is_authenticated:
+        return redirect(url_for('main.index'))
+    form = LoginForm()
+    if form.validate_on_submit():
+        user = User.query.filter_by(username=form.username.data).first()
+        if user is None or not user.check_password(form.password.data):
+            flash(_('Invalid username or password'))
+            return redirect(url_for('auth.login'))
+        if user.password_needs_rehash():
+            user.set_password(form.password.data)
+            db.session.commit()
+        login_user(user, remember=form.remember_me.data)
+        next_page = request.args.get('next')
+        if not next_page or url_parse(next_page).netloc != '':
+            next_page = url_for('main.index')
+        return redirect(next_page)
+    return render_template('auth/login.html', title=_('Sign In'), form=form)
+
+
+@bp.route('/logout')
+def logout():
+    logout_user()
+    return redirect(url_for('main.index'))
+
+
+@bp.route('/register', methods=['GET', 'POST'])
+@limiter.limit('10/hour')
+def register():
+    if current_user.is_authenticated:
+        return redirect(url_for('main.index'))
+    form = RegistrationForm()
+    if form.validate_on_submit():
+        user = User(username=form.username.data, email=form.email.data)
+        user.set_password(form.password.data)
+        db.session.add(user)
+        db.session.commit()
+        flash(_('Congratulations, you are now a registered user!'))
+        return redirect(url_for('auth.login'))
+    return render_template('auth/register.html', title=_('Register'),
+                           form=form)
+
+
+@bp.route('/reset_password_request', methods=['POST', 'GET'])
+@limiter.limit('10/hour')
+@limiter.limit('3/hour', key=by_form('email'))
+def reset_password_request():
+    if current_user.is_authenticated:
+        return redirect(url_for('main.index'))
+    form = ResetPasswordRequestForm()
+    if form.validate_on_submit():
+        user = User.query.filter_by(email=form.email.data).first()
+        if user:
+            send_password_reset_email(user)
+            flash(
+                _('Check your email for the instruction to reset your password'))
+        else:
+            flash(_('There is no user with email, {0}').format(form.email.data))
+        return redirect(url_for('auth.login'))
+    return render_template('auth/reset_password_request.html',
+                           title=_('Reset Password'),
+                           form=form)
+
+
+@bp.route('/reset_password/<token>', methods=['POST', 'GET'])
+def reset_password(token):
+    if current_user.is_authenticated:
+        return redirect(url_for('main.index'))
+    id = tokens.verify(token, 'reset_password')
+    if id is None:
+        return redirect(url_for('main.index'))
+    form = ResetPasswordForm()
+    if form.validate_on_submit():
+        user = User.query.get(id)
+        if user is None:
+            return redirect(url_for('main.index'))
+        user.set_password(form.password.data)
+        tokens.consume(token)
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # Another request used the token first.
+            db.session.rollback()
+            return redirect(url_for('main.index'))
+        flash(_('Your password has been reset.'))
+        return redirect(url_for('auth.login'))
+    return render_template('auth/reset_password.html',
+                           title=_('Reset Your Password'),
+                           form=form)
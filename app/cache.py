@@ -0,0 +1,305 @@
+"""Pluggable cache for page query results and rendered fragments.
+
+``CACHE_TYPE`` selects the backend:
+
+* ``memory`` -- per-process LRU with TTL
+* ``file`` -- pickled entries under ``CACHE_DIR``, shared by local workers
+  (default)
+* ``redis`` -- any client with the redis ``get``/``set``/``delete``/``incr``
+  API, built from ``CACHE_REDIS_URL``
+* ``null`` -- caches nothing
+
+Every key embeds a generation number kept in the backend.  The generation
+is bumped after any commit that wrote a row of a table listed in
+``CACHE_WATCHED_TABLES``, so cached entries are never served after a write.
+The memory backend only sees the writes of its own process, so other
+workers would keep serving stale pages; a warning is logged when it is
+configured outside debug or testing.
+
+``Cache.version`` exposes the generation as a token for HTTP validators.
+Each application keeps its backend in ``app.extensions['cache']``.
+"""
+import os
+import pickle
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from hashlib import md5
+from flask import current_app
+from sqlalchemy import event
+
+
+class NullCache(object):
+    def get(self, key):
+        return None
+
+    def set(self, key, value, timeout=None):
+        pass
+
+    def delete(self, key):
+        pass
+
+    def incr(self, key):
+        return 0
+
+    def counter(self, key):
+        return 0
+
+    def clear(self):
+        pass
+
+
+class MemoryCache(object):
+    """Thread-safe LRU cache whose entries expire after ``timeout``."""
+
+    def __init__(self, threshold=500, default_timeout=300):
+        self.threshold = threshold
+        self.default_timeout = default_timeout
+        self.instance = uuid.uuid4().hex[:8]
+        self._entries = OrderedDict()
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires and expires < time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, timeout=None):
+        timeout = self.default_timeout if timeout is None else timeout
+        expires = time.time() + timeout if timeout else 0
+        with self._lock:
+            self._entries[key] = (expires, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.threshold:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def incr(self, key):
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + 1
+            return self._counters[key]
+
+    def counter(self, key):
+        return self._counters.get(key, 0)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class FileCache(object):
+    """Cache storing one pickle per key in a directory."""
+
+    def __init__(self, directory, default_timeout=300):
+        self.directory = directory
+        self.default_timeout = default_timeout
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory,
+                            md5(key.encode('utf-8')).hexdigest())
+
+    def get(self, key):
+        try:
+            with open(self._path(key), 'rb') as f:
+                expires, value = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+        if expires and expires < time.time():
+            self.delete(key)
+            return None
+        return value
+
+    def set(self, key, value, timeout=None):
+        timeout = self.default_timeout if timeout is None else timeout
+        expires = time.time() + timeout if timeout else 0
+        fd, tmp = tempfile.mkstemp(dir=self.directory)
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump((expires, value), f, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, self._path(key))
+
+    def delete(self, key):
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+    def incr(self, key):
+        with self._lock:
+            value = (self.get(key) or 0) + 1
+            self.set(key, value, 0)
+            return value
+
+    def counter(self, key):
+        return self.get(key) or 0
+
+    def clear(self):
+        for name in os.listdir(self.directory):
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                pass
+
+
+class RedisCache(object):
+    """Cache backed by a redis-compatible client."""
+
+    def __init__(self, client, default_timeout=300, prefix=''):
+        self.client = client
+        self.default_timeout = default_timeout
+        self.prefix = prefix
+
+    def get(self, key):
+        value = self.client.get(key)
+        return None if value is None else pickle.loads(value)
+
+    def set(self, key, value, timeout=None):
+        timeout = self.default_timeout if timeout is None else timeout
+        self.client.set(key, pickle.dumps(value, pickle.HIGHEST_PROTOCOL),
+                        ex=timeout or None)
+
+    def delete(self, key):
+        self.client.delete(key)
+
+    def incr(self, key):
+        return self.client.incr(key)
+
+    def counter(self, key):
+        return int(self.client.get(key) or 0)
+
+    def clear(self):
+        # The database may be shared, e.g. with the rate limiter.
+        for key in self.client.scan_iter(match=self.prefix + '*'):
+            self.client.delete(key)
+
+
+def make_backend(config):
+    cache_type = config['CACHE_TYPE']
+    timeout = config['CACHE_DEFAULT_TIMEOUT']
+    if cache_type == 'null':
+        return NullCache()
+    if cache_type == 'memory':
+        return MemoryCache(config['CACHE_THRESHOLD'], timeout)
+    if cache_type == 'file':
+        return FileCache(config['CACHE_DIR'], timeout)
+    if cache_type == 'redis':
+        import redis
+        return RedisCache(redis.from_url(config['CACHE_REDIS_URL']), timeout,
+                          config['CACHE_KEY_PREFIX'])
+    raise ValueError(f'Unknown CACHE_TYPE {cache_type!r}')
+
+
+class Cache(object):
+    def __init__(self, app=None, db=None):
+        self.db = db
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('CACHE_TYPE', 'file')
+        app.config.setdefault('CACHE_DEFAULT_TIMEOUT', 300)
+        app.config.setdefault('CACHE_THRESHOLD', 500)
+        app.config.setdefault('CACHE_DIR', os.path.join(
+            tempfile.gettempdir(), 'microblog-cache'))
+        app.config.setdefault('CACHE_REDIS_URL', 'redis://localhost:6379/0')
+        app.config.setdefault('CACHE_KEY_PREFIX', 'microblog:cache:')
+        app.config.setdefault('CACHE_WATCHED_TABLES', ('post', 'user'))
+        app.extensions['cache'] = make_backend(app.config)
+        if app.config['CACHE_TYPE'] == 'memory' and \
+                not (app.debug or app.testing):
+            app.logger.warning(
+                'CACHE_TYPE memory is per process: other workers will serve '
+                'stale pages after a write; use file or redis')
+        if self.db is not None and not event.contains(
+                self.db.session, 'after_commit', self._after_commit):
+            event.listen(self.db.session, 'after_flush', self._after_flush)
+            event.listen(self.db.session, 'after_commit', self._after_commit)
+            event.listen(self.db.session, 'after_rollback',
+                         self._after_rollback)
+
+    @property
+    def backend(self):
+        return current_app.extensions['cache']
+
+    @property
+    def prefix(self):
+        return current_app.config['CACHE_KEY_PREFIX']
+
+    @property
+    def generation(self):
+        return self.backend.counter(self.prefix + 'generation')
+
+    @property
+    def version(self):
+        """Token that changes with the generation, or None without a cache.
+
+        Tokens of the memory backend are unique to the process, since other
+        processes count their own generations.
+        """
+        if isinstance(self.backend, NullCache):
+            return None
+        if isinstance(self.backend, MemoryCache):
+            return f'{self.backend.instance}-{self.generation}'
+        return str(self.generation)
+
+    def key(self, parts):
+        return ':'.join([self.prefix + str(self.generation)] +
+                        [str(part) for part in parts])
+
+    def get(self, parts):
+        return self.backend.get(self.key(parts))
+
+    def set(self, parts, value, timeout=None):
+        self.backend.set(self.key(parts), value, timeout)
+
+    def cached(self, parts, builder, timeout=None):
+        """Return the value cached under ``parts``, building it on a miss."""
+        key = self.key(parts)
+        value = self.backend.get(key)
+        if value is None:
+            value = builder()
+            self.backend.set(key, value, timeout)
+        return value
+
+    def invalidate(self):
+        """Make every entry written so far unreachable."""
+        self.backend.incr(self.prefix + 'generation')
+
+    def invalidate_on_commit(self, session):
+        """Invalidate once ``session`` commits.
+
+        For writes made with Core statements, which the session hooks do
+        not see.
+        """
+        session.info['cache_dirty'] = True
+
+    def clear(self):
+        self.backend.clear()
+
+    def _after_flush(self, session, flush_context):
+        watched = current_app.config['CACHE_WATCHED_TABLES']
+        for obj in session.new | session.dirty | session.deleted:
+            if getattr(obj, '__tablename__', None) in watched:
+                session.info['cache_dirty'] = True
+                return
+
+    def _after_commit(self, session):
+        if session.info.pop('cache_dirty', False):
+            self.invalidate()
+
+    def _after_rollback(self, session):
+        session.info.pop('cache_dirty', None)
@@ -1,9 +1,21 @@
-from app import app
+from flask import current_app
+from flask.cli import AppGroup, with_appcontext
+from app import db, cache, assets
+from app.jobs import jobs
+from app.models import DeadJob
 import click
+from datetime import datetime, timedelta
 import os
+import signal
+import time
 
+# The commands import what they run, so that web workers, which register
+# these commands too, do not load modules only the CLI uses.  This must
+# match app.transfer.FORMATS, which the option needs before any import.
+TRANSFER_FORMATS = ('ndjson', 'csv')
 
-@app.cli.group()
+
+@click.group(cls=AppGroup)
 def translate():
     """Translation and localization commands."""
     pass
@@ -36,3 +48,220 @@ def init(lang):
                  lang):
         raise RuntimeError('init command failed')
     os.remove('messages.pot')
+
+
+@click.group(cls=AppGroup)
+def timeline():
+    """Home timeline commands."""
+    pass
+
+
+@timeline.command()
+@click.option('--batch-size', default=500, help='Users per transaction.')
+def backfill(batch_size):
+    """Rebuild follow counters and every home timeline."""
+    from app.timeline import rebuild
+    for done in rebuild(batch_size):
+        click.echo(f'{done} users rebuilt')
+
+
+@click.group(cls=AppGroup)
+def search():
+    """Full-text search commands."""
+    pass
+
+
+@search.command('reindex')
+@click.option('--batch-size', default=1000, help='Posts per transaction.')
+def search_reindex(batch_size):
+    """Rebuild the search index from every post."""
+    from app.search import reindex
+    for done in reindex(batch_size):
+        click.echo(f'{done} posts indexed')
+
+
+def report(label, counts, initial=0):
+    """Echo rows/sec for a generator of running row counts."""
+    start = time.perf_counter()
+    for done in counts:
+        rate = (done - initial) / (time.perf_counter() - start)
+        click.echo(f'{label}: {done} rows ({rate:.0f} rows/sec)')
+        yield done
+
+
+@click.group(cls=AppGroup)
+def data():
+    """Bulk export and import of users, posts and followers."""
+    pass
+
+
+@data.command('export')
+@click.argument('directory')
+@click.option('--format', 'fmt', type=click.Choice(TRANSFER_FORMATS),
+              default='ndjson', help='File format.')
+@click.option('--chunk-size', default=5000, help='Rows per fetch.')
+def data_export(directory, fmt, chunk_size):
+    """Write every user, follow and post, archived ones too, to
+    DIRECTORY."""
+    from app import transfer
+    from app.archive import months as archived_months
+    os.makedirs(directory, exist_ok=True)
+    months = [row.month for row in archived_months()]
+    with db.engine.connect() as connection:
+        for name, table, columns in transfer.tables(months):
+            with open(transfer.path(directory, name, fmt), 'w',
+                      newline='') as f:
+                for done in report(name, transfer.export_table(
+                        connection, table, columns, f, fmt, chunk_size)):
+                    pass
+
+
+@data.command('import')
+@click.argument('directory')
+@click.option('--format', 'fmt', type=click.Choice(TRANSFER_FORMATS),
+              default='ndjson', help='File format.')
+@click.option('--chunk-size', default=5000, help='Rows per transaction.')
+def data_import(directory, fmt, chunk_size):
+    """Load the users, follows and posts exported to DIRECTORY.
+
+    Rows that already exist are skipped, and an interrupted import resumes
+    from the last committed chunk.
+    """
+    from app import transfer
+    from app.search import reindex
+    from app.timeline import rebuild
+    progress = transfer.load_progress(directory)
+    months = transfer.exported_months(directory, fmt)
+    indexes = transfer.deferred_indexes()
+    transfer.drop_indexes(indexes)
+    for name, table, columns in transfer.tables(months):
+        filename = transfer.path(directory, name, fmt)
+        if not os.path.exists(filename):
+            click.echo(f'{filename} not found, skipped')
+            continue
+        initial = progress.get(name, 0)
+        with open(filename, newline='') as f:
+            rows = transfer.read_rows(f, fmt, table, columns)
+            for done in report(name, transfer.import_table(
+                    name, table, rows, chunk_size, initial), initial):
+                progress[name] = done
+                transfer.save_progress(directory, progress)
+    click.echo('Building indexes')
+    transfer.create_indexes(indexes)
+    transfer.register_archive(months)
+    for done in rebuild():
+        click.echo(f'{done} users rebuilt')
+    for done in reindex():
+        click.echo(f'{done} posts indexed')
+    cache.invalidate()
+    transfer.clear_progress(directory)
+
+
+@click.command()
+@click.option('--threads', type=int, help='Jobs to run at once.')
+@click.option('--once', is_flag=True, help='Exit when no job is due.')
+@with_appcontext
+def worker(threads, once):
+    """Run background jobs until interrupted."""
+    signal.signal(signal.SIGTERM, lambda signum, frame: jobs.stop())
+    try:
+        jobs.work(threads, once)
+    except KeyboardInterrupt:
+        jobs.stop()
+
+
+@click.group(cls=AppGroup, name='jobs')
+def jobs_group():
+    """Background job commands."""
+    pass
+
+
+@jobs_group.command('dead')
+def jobs_dead():
+    """List the jobs that ran out of attempts."""
+    for dead in DeadJob.query.order_by(DeadJob.id):
+        click.echo(f'{dead.id} {dead.failed_at:%Y-%m-%d %H:%M:%S} '
+                   f'{dead.key} after {dead.attempts} attempts: '
+                   f'{dead.last_error}')
+
+
+@jobs_group.command('retry')
+@click.argument('ids', nargs=-1, type=int)
+def jobs_retry(ids):
+    """Queue dead jobs again, all of them unless IDS are given."""
+    query = DeadJob.query
+    if ids:
+        query = query.filter(DeadJob.id.in_(ids))
+    count = 0
+    for dead in query.all():
+        jobs.retry(dead)
+        count += 1
+    db.session.commit()
+    click.echo(f'{count} jobs queued')
+
+
+@click.group(cls=AppGroup, name='assets')
+def assets_group():
+    """Static asset commands."""
+    pass
+
+
+@assets_group.command('build')
+def assets_build():
+    """Write fingerprinted and compressed static assets."""
+    for name, target in sorted(assets.build(current_app).items()):
+        click.echo(f'{name} -> {target}')
+
+
+@assets_group.command('vendor')
+def assets_vendor():
+    """Download the files ASSETS_VENDOR serves instead of a CDN."""
+    try:
+        for name in assets.vendor(current_app):
+            click.echo(f'{name} downloaded')
+    except OSError as e:
+        raise click.ClickException(f'Download failed: {e}')
+
+
+@click.group(cls=AppGroup)
+def posts():
+    """Post storage commands."""
+    pass
+
+
+@posts.command('archive')
+@click.option('--older-than', 'days', type=int, required=True,
+              help='Archive posts older than this many days.')
+@click.option('--batch-size', default=1000, help='Posts per transaction.')
+def posts_archive(days, batch_size):
+    """Move old posts to the monthly archive tables."""
+    from app.archive import archive_posts
+    before = datetime.utcnow() - timedelta(days=days)
+    for done in archive_posts(before, batch_size):
+        click.echo(f'{done} posts archived')
+
+
+@click.group(cls=AppGroup)
+def recommend():
+    """Who to follow suggestion commands."""
+    pass
+
+
+@recommend.command('rebuild')
+@click.option('--batch-size', default=1000, help='Users per transaction.')
+def recommend_rebuild(batch_size):
+    """Recompute every user's suggestions from the follow graph."""
+    from app.recommend import FollowGraph, rebuild as rebuild_suggestions
+    start = time.perf_counter()
+    graph = FollowGraph.load(db.session.connection())
+    click.echo(f'{len(graph.targets)} follows loaded in '
+               f'{time.perf_counter() - start:.1f}s, '
+               f'{graph.nbytes / 1024 / 1024:.1f} MB')
+    for done in rebuild_suggestions(batch_size, graph):
+        click.echo(f'{done} users rebuilt')
+
+
+def register(app):
+    for group in (translate, timeline, search, data, worker, jobs_group,
+                  assets_group, posts, recommend):
+        app.cli.add_command(group)
@@ -0,0 +1,94 @@
+"""Engine configuration and read-replica routing.
+
+SQLite connections run the ``SQLITE_PRAGMAS`` as they are opened: by
+default WAL journaling, so readers no longer wait for a writer, and a busy
+timeout instead of immediate "database is locked" errors.  File and server
+databases keep a connection pool sized by ``DATABASE_POOL_SIZE``,
+``DATABASE_MAX_OVERFLOW``, ``DATABASE_POOL_RECYCLE`` and
+``DATABASE_POOL_TIMEOUT``; ``SQLALCHEMY_ENGINE_OPTIONS`` still overrides
+them.
+
+With ``DATABASE_REPLICA_URL`` set, views decorated with ``db.replica`` read
+from that database on GET requests, while flushes and other writes go to
+the primary.  A replica lags behind, so only pages that can show slightly
+stale data should opt in.
+"""
+from functools import wraps
+from flask import request
+from flask_sqlalchemy import SQLAlchemy, SignallingSession, get_state
+from sqlalchemy import event, orm
+from sqlalchemy.pool import QueuePool, StaticPool
+from sqlalchemy.sql.dml import UpdateBase
+
+REPLICA = 'replica'
+
+
+class RoutingSession(SignallingSession):
+    """Session that sends reads to the replica while ``use_replica`` is set
+    in its ``info``."""
+
+    def get_bind(self, mapper=None, clause=None):
+        if self.info.get('use_replica') and not self._flushing and \
+                not isinstance(clause, UpdateBase):
+            return get_state(self.app).db.get_engine(self.app, bind=REPLICA)
+        return super().get_bind(mapper, clause)
+
+
+class Database(SQLAlchemy):
+    def init_app(self, app):
+        app.config.setdefault('SQLITE_PRAGMAS', {})
+        app.config.setdefault('DATABASE_POOL_SIZE', 5)
+        app.config.setdefault('DATABASE_MAX_OVERFLOW', 10)
+        app.config.setdefault('DATABASE_POOL_RECYCLE', 1800)
+        app.config.setdefault('DATABASE_POOL_TIMEOUT', 30)
+        app.config.setdefault('DATABASE_REPLICA_URL', None)
+        if app.config['DATABASE_REPLICA_URL']:
+            binds = dict(app.config.get('SQLALCHEMY_BINDS') or {})
+            binds.setdefault(REPLICA, app.config['DATABASE_REPLICA_URL'])
+            app.config['SQLALCHEMY_BINDS'] = binds
+        super().init_app(app)
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+    def apply_driver_hacks(self, app, sa_url, options):
+        super().apply_driver_hacks(app, sa_url, options)
+        if options.get('poolclass') is StaticPool:
+            # An in-memory SQLite database lives in its single connection.
+            return
+        if sa_url.drivername.startswith('sqlite'):
+            # The pool hands a connection to one thread at a time.
+            options['poolclass'] = QueuePool
+            options.setdefault('connect_args', {})['check_same_thread'] = \
+                False
+        options['pool_size'] = app.config['DATABASE_POOL_SIZE']
+        options['max_overflow'] = app.config['DATABASE_MAX_OVERFLOW']
+        options['pool_recycle'] = app.config['DATABASE_POOL_RECYCLE']
+        options['pool_timeout'] = app.config['DATABASE_POOL_TIMEOUT']
+
+    def create_engine(self, sa_url, engine_opts):
+        engine = super().create_engine(sa_url, engine_opts)
+        pragmas = self.get_app().config['SQLITE_PRAGMAS']
+        if engine.dialect.name == 'sqlite' and pragmas:
+            @event.listens_for(engine, 'connect')
+            def apply_pragmas(dbapi_connection, connection_record):
+                cursor = dbapi_connection.cursor()
+                for name, value in pragmas.items():
+                    cursor.execute(f'PRAGMA {name} = {value}')
+                cursor.close()
+        return engine
+
+    def replica(self, view):
+        """Route the reads of a view to the replica on GET requests."""
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            binds = self.get_app().config.get('SQLALCHEMY_BINDS') or ()
+            if REPLICA not in binds or request.method not in ('GET', 'HEAD'):
+                return view(*args, **kwargs)
+            session = self.session()
+            session.info['use_replica'] = True
+            try:
+                return view(*args, **kwargs)
+            finally:
+                session.info.pop('use_replica', None)
+        return wrapper
@@ -1,32 +1,268 @@
+import atexit
+import queue
+import threading
+import weakref
+from contextlib import nullcontext
+from datetime import datetime, timedelta
 from flask_mail import Message
-from app import mail, app
-from flask import render_template
-from threading import Thread
+from app import mail, db
+from app.jobs import worker_name
+from app.models import Outbox
+from flask import current_app, has_app_context
 
+# Queues whose workers are stopped at interpreter exit.
+_queues = weakref.WeakSet()
 
-def send_async_email(app, msg):
-    with app.app_context():
-        mail.send(msg)
+
+@atexit.register
+def _stop_all():
+    for mail_queue in list(_queues):
+        mail_queue.stop()
+
+
+class MailQueue(object):
+    """Deliver outbox rows from a bounded queue with a fixed worker pool.
+
+    Messages are written to the ``outbox`` table before they are queued, so
+    they survive a restart.  Each worker drains up to ``MAIL_BATCH_SIZE``
+    queued messages and sends them over one SMTP connection.  Failed sends
+    are retried with exponential backoff until ``MAIL_MAX_ATTEMPTS``, and a
+    sweeper re-queues due messages that are not in the queue, including
+    those left over from a previous run or dropped because it was full.
+
+    Every process sweeps the same table, so a batch is leased for
+    ``MAIL_LEASE`` seconds before it is sent, with a conditional update per
+    row that only one sender can win; rows leased elsewhere are skipped.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self._queue = queue.Queue(app.config['MAIL_QUEUE_SIZE'])
+        self._queued = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._threads = []
+        _queues.add(self)
+
+    def enqueue(self, id):
+        """Queue an outbox row for delivery; returns False if it was not."""
+        with self._lock:
+            if id in self._queued:
+                return True
+            try:
+                self._queue.put_nowait(id)
+            except queue.Full:
+                return False
+            self._queued.add(id)
+        self.start()
+        return True
+
+    def start(self):
+        if self._threads or not self.app.config['MAIL_WORKERS']:
+            return
+        with self._lock:
+            if self._threads:
+                return
+            self._stop.clear()
+            self._threads = [
+                threading.Thread(target=self._work, name=f'mail-worker-{i}',
+                                 daemon=True)
+                for i in range(self.app.config['MAIL_WORKERS'])
+            ]
+            self._threads.append(
+                threading.Thread(target=self._sweep, name='mail-sweeper',
+                                 daemon=True))
+            for thread in self._threads:
+                thread.start()
+
+    def stop(self):
+        self._stop.set()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def sweep(self):
+        """Queue every due outbox row that is not queued yet."""
+        with self._app_context():
+            ids = [row.id for row in Outbox.due().with_entities(Outbox.id)]
+        return sum(self.enqueue(id) for id in ids)
+
+    def send_pending(self):
+        """Send every queued message in the calling thread.
+
+        This uses, and commits, the calling thread's session.
+        """
+        sent = 0
+        while True:
+            batch = self._take(block=False)
+            if not batch:
+                return sent
+            sent += self.deliver(batch)
+
+    def deliver(self, ids):
+        """Send a batch of outbox rows over one SMTP connection."""
+        sent = 0
+        with self._app_context():
+            try:
+                claimed = self.claim(ids, worker_name())
+                if not claimed:
+                    return 0
+                rows = Outbox.query.filter(Outbox.id.in_(claimed)).order_by(
+                    Outbox.id).all()
+                if not rows:
+                    return 0
+                # Rows whose send was attempted have already recorded the
+                # outcome; a failure to connect or quit only counts for the
+                # rest.
+                attempted = set()
+                try:
+                    with mail.connect() as connection:
+                        for row in rows:
+                            attempted.add(row.id)
+                            try:
+                                connection.send(outbox_message(row))
+                            except Exception as e:
+                                row.record_failure(
+                                    e, self.app.config['MAIL_RETRY_BACKOFF'],
+                                    self.app.config['MAIL_MAX_ATTEMPTS'])
+                            else:
+                                row.sent_at = datetime.utcnow()
+                                row.locked_until = None
+                                sent += 1
+                            db.session.commit()
+                except Exception as e:
+                    for row in rows:
+                        if row.id not in attempted:
+                            row.record_failure(
+                                e, self.app.config['MAIL_RETRY_BACKOFF'],
+                                self.app.config['MAIL_MAX_ATTEMPTS'])
+                    db.session.commit()
+                    self.app.logger.warning('Mail delivery failed: %s', e)
+            finally:
+                with self._lock:
+                    self._queued.difference_update(ids)
+        return sent
+
+    def claim(self, ids, worker):
+        """Lease the due rows among ``ids`` to ``worker``; returns their ids.
+
+        This commits the calling thread's session.
+        """
+        now = datetime.utcnow()
+        outbox = Outbox.__table__
+        claimed = []
+        for id in ids:
+            result = db.session.execute(outbox.update().where(db.and_(
+                outbox.c.id == id, outbox.c.sent_at.is_(None),
+                outbox.c.failed.is_(False), outbox.c.next_attempt_at <= now,
+                db.or_(outbox.c.locked_until.is_(None),
+                       outbox.c.locked_until < now))).values(
+                           locked_by=worker,
+                           locked_until=now + timedelta(
+                               seconds=self.app.config['MAIL_LEASE'])))
+            if result.rowcount:
+                claimed.append(id)
+        db.session.commit()
+        return claimed
+
+    def _app_context(self):
+        # Popping an app context removes the thread's session, so reuse the
+        # caller's context when there is one.
+        if has_app_context():
+            return nullcontext()
+        return self.app.app_context()
+
+    def _take(self, block=True, timeout=None):
+        try:
+            batch = [self._queue.get(block, timeout)]
+        except queue.Empty:
+            return []
+        while len(batch) < self.app.config['MAIL_BATCH_SIZE']:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _work(self):
+        while not self._stop.is_set():
+            batch = self._take(timeout=1)
+            if batch:
+                try:
+                    self.deliver(batch)
+                except Exception:
+                    self.app.logger.exception('Mail worker failed')
+
+    def _sweep(self):
+        while True:
+            try:
+                self.sweep()
+            except Exception:
+                self.app.logger.exception('Mail sweeper failed')
+            if self._stop.wait(self.app.config['MAIL_SWEEP_INTERVAL']):
+                return
+
+
+class MailDispatcher(object):
+    """Hands messages to the current application's ``MailQueue``."""
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('MAIL_WORKERS', 2)
+        app.config.setdefault('MAIL_QUEUE_SIZE', 100)
+        app.config.setdefault('MAIL_BATCH_SIZE', 20)
+        app.config.setdefault('MAIL_MAX_ATTEMPTS', 5)
+        app.config.setdefault('MAIL_RETRY_BACKOFF', 30)
+        app.config.setdefault('MAIL_SWEEP_INTERVAL', 60)
+        app.config.setdefault('MAIL_LEASE', 300)
+        app.extensions['mail_queue'] = MailQueue(app)
+
+    @property
+    def queue(self):
+        return current_app.extensions['mail_queue']
+
+    def enqueue(self, id):
+        return self.queue.enqueue(id)
+
+    def start(self):
+        self.queue.start()
+
+    def stop(self):
+        self.queue.stop()
+
+    def sweep(self):
+        return self.queue.sweep()
+
+    def send_pending(self):
+        return self.queue.send_pending()
+
+    def deliver(self, ids):
+        return self.queue.deliver(ids)
+
+    def claim(self, ids, worker):
+        return self.queue.claim(ids, worker)
+
+
+dispatcher = MailDispatcher()
+
+
+def outbox_message(row):
+    msg = Message(row.subject, sender=row.sender,
+                  recipients=row.recipients.split(','))
+    msg.body = row.text_body
+    msg.html = row.html_body
+    return msg
 
 
 def send_email(subject, sender, recipients, text_body, html_body):
-    msg = Message(subject, sender=sender, recipients=recipients)
-    msg.body = text_body
-    msg.html = html_body
-    mail.send(msg)
-    Thread(target=send_async_email, args=(app, msg)).start()
-
-
-def send_password_reset_email(user):
-    token = user.get_reset_password_token(expires_in=300)
-    send_email('[Microblog] Reset your password',
-               sender=app.config['ADMINS'][0],
-               recipients=[user.email],
-               text_body=render_template(
-                   'email/reset_password.txt',
-                   user=user,
-                   token=token),
-               html_body=render_template(
-                   'email/reset_password.html',
-                   user=user,
-                   token=token))
+    msg = Outbox(subject=subject,
+                 sender=sender,
+                 recipients=','.join(recipients),
+                 text_body=text_body,
+                 html_body=html_body)
+    db.session.add(msg)
+    db.session.commit()
+    dispatcher.enqueue(msg.id)
@@ -1,18 +1,24 @@
 from flask import render_template
-from app import app, db
+from app import db
+from app.errors import bp
 
 
-@app.errorhandler(404)
+@bp.app_errorhandler(404)
 def not_found_error(error):
     return render_template('404.html'), 404
 
 
-@app.errorhandler(500)
+@bp.app_errorhandler(500)
 def internal_error(error):
     db.session.rollback()
     return render_template('500.html'), 500
 
 
-@app.errorhandler(403)
+@bp.app_errorhandler(429)
+def too_many_requests_error(error):
+    return render_template('429.html'), 429, error.get_headers()
+
+
+@bp.app_errorhandler(403)
 def forbidden_error(error):
     return render_template('403.html'), 403
@@ -0,0 +1,171 @@
+"""Group commit of small writes from concurrent requests.
+
+Views hand their writes to ``group_commit.run(write, *args)``.  By default
+that calls ``write`` and commits in the calling thread, as the views did
+themselves.  With ``GROUP_COMMIT`` on, a committer thread takes every write
+that arrives within ``GROUP_COMMIT_WINDOW`` seconds of the first one, up to
+``GROUP_COMMIT_MAX_BATCH`` of them, runs them in its own session and
+commits them in one transaction, so a burst of posts and follows pays for
+one commit instead of one each.  It only waits while more callers are
+blocked in ``run`` than it has writes, so a lone write is not delayed.
+Every caller waits until its write is committed and gets its own return
+value or exception: when a write in a group fails, the group is rolled back
+and its writes are committed one at a time.
+
+Writes run in another thread's session, so they take plain values such as
+ids rather than objects loaded by the request; see ``app.writes``.  Each
+application has its own ``Committer``, in ``app.extensions['group_commit']``.
+"""
+import atexit
+import queue
+import threading
+import time
+import weakref
+from concurrent.futures import Future
+from flask import current_app
+
+# Committers whose queued writes are committed at interpreter exit.
+_committers = weakref.WeakSet()
+
+
+@atexit.register
+def _stop_all():
+    for committer in list(_committers):
+        committer.stop()
+
+
+class Committer(object):
+    """The write queue and committer thread of one application."""
+
+    def __init__(self, app, db):
+        self.app = app
+        self.db = db
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._waiting = 0
+        _committers.add(self)
+
+    def run(self, write, *args):
+        """Run ``write(*args)`` in a committed transaction; returns its result.
+
+        In group mode the calling thread's session is committed first, which
+        also ends its read transaction, so what the caller reads afterwards
+        includes the write.
+        """
+        if not self.app.config['GROUP_COMMIT']:
+            result = write(*args)
+            self.db.session.commit()
+            return result
+        self.db.session.commit()
+        future = Future()
+        with self._lock:
+            self._waiting += 1
+        try:
+            self._queue.put((future, write, args))
+            self.start()
+            return future.result()
+        finally:
+            with self._lock:
+                self._waiting -= 1
+
+    def start(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._work,
+                                            name='group-commit', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self._thread = None
+
+    def commit(self, group):
+        """Run and commit a group of queued writes, resolving their futures."""
+        session = self.db.session
+        results = []
+        try:
+            for future, write, args in group:
+                results.append(write(*args))
+                session.flush()
+            session.commit()
+        except Exception as e:
+            session.rollback()
+            if len(group) == 1:
+                group[0][0].set_exception(e)
+            else:
+                for write in group:
+                    self.commit([write])
+            return
+        for (future, write, args), result in zip(group, results):
+            future.set_result(result)
+
+    def _take(self):
+        try:
+            group = [self._queue.get(timeout=1)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.app.config['GROUP_COMMIT_WINDOW']
+        # Only wait for writes whose callers are already on their way.
+        while len(group) < min(self._waiting,
+                               self.app.config['GROUP_COMMIT_MAX_BATCH']):
+            try:
+                group.append(self._queue.get(
+                    timeout=max(deadline - time.monotonic(), 0)))
+            except queue.Empty:
+                break
+        return group
+
+    def _work(self):
+        with self.app.app_context():
+            while not self._stop.is_set() or not self._queue.empty():
+                group = self._take()
+                if not group:
+                    continue
+                try:
+                    self.commit(group)
+                except Exception as e:
+                    self.app.logger.exception('Group commit failed')
+                    for future, write, args in group:
+                        if not future.done():
+                            future.set_exception(e)
+                finally:
+                    self.db.session.remove()
+
+
+class GroupCommit(object):
+    """Hands writes to the current application's ``Committer``."""
+
+    def __init__(self, app=None, db=None):
+        self.db = db
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('GROUP_COMMIT', False)
+        app.config.setdefault('GROUP_COMMIT_WINDOW', 0.003)
+        app.config.setdefault('GROUP_COMMIT_MAX_BATCH', 100)
+        app.extensions['group_commit'] = Committer(app, self.db)
+
+    @property
+    def committer(self):
+        return current_app.extensions['group_commit']
+
+    def run(self, write, *args):
+        return self.committer.run(write, *args)
+
+    def start(self):
+        self.committer.start()
+
+    def stop(self):
+        self.committer.stop()
+
+    def commit(self, group):
+        self.committer.commit(group)
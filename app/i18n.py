@@ -0,0 +1,100 @@
+"""Locale negotiation and translation catalogs, cached per process.
+
+Flask-Babel negotiates the locale and reads the ``.mo`` file of every
+translation directory again on each request.  Instead:
+
+* ``negotiate`` maps an ``Accept-Language`` header to a locale once per
+  distinct header, keeping the most recent ``LOCALE_CACHE_SIZE`` headers.
+* ``Localization`` loads the catalog of every supported locale when the
+  application is created and sets the request's locale and catalog before
+  the view runs, so Flask-Babel finds both and loads nothing.
+* ``lazy_gettext`` strings, used for form labels and messages, remember
+  their translation per locale instead of looking it up each time they are
+  rendered.
+"""
+from functools import lru_cache
+from babel import Locale, support
+from flask import request, current_app, _request_ctx_stack
+from flask_babel import gettext
+from flask_babel.speaklater import LazyString
+from werkzeug.datastructures import LanguageAccept
+from werkzeug.http import parse_accept_header
+
+DEFAULT_LOCALE = 'en'
+# Catalog names of the LANGUAGES values that are not the default.
+LOCALE_NAMES = {'zh_cn': 'zh_Hans', 'zh_tw': 'zh_Hant_TW'}
+LOCALE_CACHE_SIZE = 256
+
+
+@lru_cache(maxsize=LOCALE_CACHE_SIZE)
+def negotiate(header, languages):
+    """Return the ``Locale`` for an ``Accept-Language`` header."""
+    match = parse_accept_header(header, LanguageAccept).best_match(languages)
+    return Locale.parse(LOCALE_NAMES.get((match or '').lower(),
+                                         DEFAULT_LOCALE))
+
+
+def request_locale():
+    return negotiate(request.headers.get('Accept-Language', ''),
+                     tuple(current_app.config['LANGUAGES']))
+
+
+def load_catalogs(babel):
+    """Load the merged catalog of every supported locale."""
+    catalogs = {}
+    for name in {DEFAULT_LOCALE} | set(LOCALE_NAMES.values()):
+        locale = Locale.parse(name)
+        translations = support.Translations()
+        for dirname in babel.translation_directories:
+            catalog = support.Translations.load(dirname, [locale],
+                                                babel.domain)
+            translations.merge(catalog)
+            # merge() does not copy the plural forms.
+            if hasattr(catalog, 'plural'):
+                translations.plural = catalog.plural
+        catalogs[locale] = translations
+    return catalogs
+
+
+class Localization(object):
+    def __init__(self, babel, app=None):
+        self.babel = babel
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Warm the catalogs; ``babel`` must be initialized on ``app``."""
+        app.extensions['i18n'] = load_catalogs(self.babel)
+        app.before_request(self._before_request)
+
+    def _before_request(self):
+        # Where Flask-Babel looks for them during a request.
+        locale = request.babel_locale = request_locale()
+        request.babel_translations = current_app.extensions['i18n'][locale]
+
+
+class CachedLazyString(LazyString):
+    """Lazy translation that is looked up once per locale."""
+
+    def __init__(self, string, **variables):
+        super(CachedLazyString, self).__init__(gettext, string, **variables)
+        self._translated = {}
+
+    def __str__(self):
+        # The request's locale, read without going through proxies.
+        ctx = _request_ctx_stack.top
+        locale = getattr(ctx.request, 'babel_locale', None) \
+            if ctx is not None else None
+        try:
+            return self._translated[locale]
+        except KeyError:
+            pass
+        value = str(self._func(*self._args, **self._kwargs))
+        if locale is not None:
+            self._translated[locale] = value
+        return value
+
+
+def lazy_gettext(string, **variables):
+    """Like Flask-Babel's ``lazy_gettext``, translated once per locale."""
+    return CachedLazyString(string, **variables)
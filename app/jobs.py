@@ -0,0 +1,220 @@
+"""Background jobs backed by the ``job`` table.
+
+Handlers subscribe to named events::
+
+    @jobs.subscribe('post.created')
+    def notify(post_id):
+        ...
+
+``jobs.emit('post.created', key=str(post.id), post_id=post.id)`` adds one
+job per subscriber to the caller's session, so the jobs are committed with
+the change that caused them, and vanish if it is rolled back.  A job whose
+idempotency key (subscriber plus event ``key``) was already queued is not
+queued again.
+
+``flask worker`` claims due jobs by leasing them for ``JOBS_LEASE`` seconds
+and runs them in a thread pool.  A job whose worker died is claimed again
+once its lease runs out, so delivery is at least once and handlers must be
+idempotent.  A handler runs in the same transaction that marks its job
+finished, so it must not commit.  Failed jobs are retried with exponential
+backoff; after ``JOBS_MAX_ATTEMPTS`` claims they are moved to the
+``dead_job`` table, from where ``flask jobs retry`` queues them again.
+"""
+import json
+import os
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from datetime import datetime, timedelta
+from uuid import uuid4
+from flask import current_app
+from app import db
+from app.models import Job, DeadJob
+
+
+class JobQueue(object):
+    def __init__(self, app=None):
+        self._handlers = {}
+        self._subscribers = {}
+        self._stop = threading.Event()
+        self._pruned_at = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('JOBS_THREADS', 4)
+        app.config.setdefault('JOBS_LEASE', 300)
+        app.config.setdefault('JOBS_MAX_ATTEMPTS', 5)
+        app.config.setdefault('JOBS_RETRY_BACKOFF', 10)
+        app.config.setdefault('JOBS_POLL_INTERVAL', 1.0)
+        app.config.setdefault('JOBS_RETENTION', 86400)
+
+    def subscribe(self, event, when=None):
+        """Run the decorated function for every ``event``.
+
+        ``when`` is called at emit time; the job is only queued if it
+        returns true.
+        """
+        def decorator(f):
+            name = f'{f.__module__}.{f.__name__}'
+            self._handlers[name] = f
+            self._subscribers.setdefault(event, []).append((name, when))
+            return f
+        return decorator
+
+    def emit(self, event, key=None, **payload):
+        """Queue a job per subscriber of ``event`` in the current session."""
+        key = key or uuid4().hex
+        for name, when in self._subscribers.get(event, ()):
+            if when is not None and not when():
+                continue
+            job_key = f'{name}:{event}:{key}'
+            if db.session.query(Job.id).filter_by(key=job_key).first():
+                continue
+            db.session.add(Job(name=name, key=job_key,
+                               payload=json.dumps(payload)))
+
+    def claim(self, worker, limit):
+        """Lease up to ``limit`` due jobs to ``worker``; returns their ids."""
+        now = datetime.utcnow()
+        config = current_app.config
+        job = Job.__table__
+        claimed = []
+        for row in Job.due(now).with_entities(
+                Job.id, Job.attempts).limit(limit).all():
+            if (row.attempts or 0) >= config['JOBS_MAX_ATTEMPTS']:
+                # Its last worker died while running it.
+                self._bury(Job.query.get(row.id), 'Lease expired')
+                continue
+            result = db.session.execute(job.update().where(db.and_(
+                job.c.id == row.id, job.c.finished_at.is_(None),
+                db.or_(job.c.locked_until.is_(None),
+                       job.c.locked_until < now))).values(
+                           locked_by=worker,
+                           locked_until=now + timedelta(
+                               seconds=config['JOBS_LEASE']),
+                           attempts=job.c.attempts + 1))
+            if result.rowcount:
+                claimed.append(row.id)
+        db.session.commit()
+        return claimed
+
+    def run(self, id, worker):
+        """Run a claimed job in the calling thread's session."""
+        job = Job.query.get(id)
+        if job is None or job.finished_at is not None or \
+                job.locked_by != worker:
+            return False
+        handler = self._handlers.get(job.name)
+        try:
+            if handler is None:
+                raise LookupError(f'No handler for job {job.name}')
+            handler(**json.loads(job.payload))
+            job.finished_at = datetime.utcnow()
+            job.locked_until = None
+            db.session.commit()
+            return True
+        except Exception as e:
+            db.session.rollback()
+            current_app.logger.warning('Job %s failed: %s', id, e)
+            self._record_failure(Job.query.get(id), e)
+            return False
+
+    def run_pending(self, worker=None):
+        """Claim and run every due job in the calling thread."""
+        worker = worker or worker_name()
+        done = 0
+        while True:
+            ids = self.claim(worker, 100)
+            if not ids:
+                return done
+            done += sum(self.run(id, worker) for id in ids)
+
+    def work(self, threads=None, once=False):
+        """Run jobs in a pool of ``threads`` until ``stop`` is called.
+
+        With ``once``, return as soon as no job is due or running.
+        """
+        app = current_app._get_current_object()
+        threads = threads or app.config['JOBS_THREADS']
+        worker = worker_name()
+        self._stop.clear()
+        inflight = set()
+        with ThreadPoolExecutor(threads,
+                                thread_name_prefix='job-worker') as pool:
+            while True:
+                free = threads - len(inflight)
+                ids = self.claim(worker, free) \
+                    if free and not self._stop.is_set() else []
+                inflight.update(pool.submit(self._run_in_context, app, id,
+                                            worker) for id in ids)
+                if not inflight:
+                    self._prune_every(60)
+                    if once or self._stop.wait(
+                            app.config['JOBS_POLL_INTERVAL']):
+                        return
+                elif not ids or len(inflight) >= threads:
+                    inflight = wait(inflight,
+                                    app.config['JOBS_POLL_INTERVAL'],
+                                    FIRST_COMPLETED).not_done
+
+    def stop(self):
+        self._stop.set()
+
+    def prune(self):
+        """Delete jobs that finished more than ``JOBS_RETENTION`` ago."""
+        cutoff = datetime.utcnow() - timedelta(
+            seconds=current_app.config['JOBS_RETENTION'])
+        Job.query.filter(Job.finished_at < cutoff).delete(
+            synchronize_session=False)
+        db.session.commit()
+
+    def retry(self, dead):
+        """Queue a dead-lettered job again."""
+        db.session.add(Job(name=dead.name, key=dead.key,
+                           payload=dead.payload))
+        db.session.delete(dead)
+
+    def _run_in_context(self, app, id, worker):
+        with app.app_context():
+            try:
+                return self.run(id, worker)
+            except Exception:
+                app.logger.exception('Job worker failed')
+
+    def _prune_every(self, seconds):
+        now = time.monotonic()
+        if self._pruned_at is None or now - self._pruned_at >= seconds:
+            self._pruned_at = now
+            self.prune()
+
+    def _record_failure(self, job, error):
+        if job is None:
+            return
+        if job.attempts >= current_app.config['JOBS_MAX_ATTEMPTS']:
+            self._bury(job, error)
+        else:
+            job.last_error = str(error)[:255]
+            job.locked_until = None
+            job.run_at = datetime.utcnow() + timedelta(
+                seconds=current_app.config['JOBS_RETRY_BACKOFF'] *
+                2**(job.attempts - 1))
+        db.session.commit()
+
+    def _bury(self, job, error):
+        db.session.add(DeadJob(name=job.name, key=job.key,
+                               payload=job.payload,
+                               created_at=job.created_at,
+                               attempts=job.attempts,
+                               last_error=str(error)[:255]))
+        db.session.delete(job)
+        db.session.flush()
+
+
+def worker_name():
+    return '{}:{}:{}'.format(socket.gethostname(), os.getpid(),
+                             threading.get_ident())
+
+
+jobs = JobQueue()
@@ -0,0 +1,140 @@
+"""Write-coalescing ``User.last_seen`` tracker.
+
+Requests only record activity in memory.  Each user is recorded at most once
+per ``LAST_SEEN_INTERVAL`` seconds, and a background thread writes all
+pending timestamps with one multi-row UPDATE every interval, so page views
+no longer take the database write lock.  Each application has its own
+``LastSeenBuffer`` in ``app.extensions['last_seen']``, and every buffer is
+flushed at exit.
+"""
+import atexit
+import threading
+import weakref
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import case
+
+# Buffers whose pending timestamps are written at interpreter exit.
+_buffers = weakref.WeakSet()
+
+
+@atexit.register
+def _shutdown():
+    for buffer in list(_buffers):
+        buffer.shutdown()
+
+
+class LastSeenBuffer(object):
+    """The pending timestamps and flusher thread of one application."""
+
+    def __init__(self, app, db):
+        self.app = app
+        self.db = db
+        self._pending = {}
+        self._recorded = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        _buffers.add(self)
+
+    @property
+    def interval(self):
+        return self.app.config['LAST_SEEN_INTERVAL']
+
+    def touch(self, user_id, when=None):
+        """Record activity for a user, throttled to once per interval."""
+        when = when or datetime.utcnow()
+        with self._lock:
+            recorded = self._recorded.get(user_id)
+            if recorded is not None and \
+                    when - recorded < timedelta(seconds=self.interval):
+                return False
+            self._recorded[user_id] = when
+            self._pending[user_id] = when
+        self._start()
+        return True
+
+    def reset(self):
+        """Forget pending and recently recorded activity without writing."""
+        with self._lock:
+            self._pending.clear()
+            self._recorded.clear()
+
+    def flush(self):
+        """Write every pending timestamp in a single UPDATE."""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            expired = datetime.utcnow() - timedelta(seconds=self.interval)
+            self._recorded = {user_id: when for user_id, when
+                              in self._recorded.items() if when > expired}
+        if not pending:
+            return 0
+        user = self.db.metadata.tables['user']
+        try:
+            with self.db.get_engine(self.app).begin() as connection:
+                connection.execute(user.update().where(
+                    user.c.id.in_(list(pending))).values(last_seen=case(
+                        pending, value=user.c.id)))
+        except Exception:
+            with self._lock:
+                for user_id, when in pending.items():
+                    self._pending.setdefault(user_id, when)
+            raise
+        return len(pending)
+
+    def shutdown(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        try:
+            self.flush()
+        except Exception:
+            self.app.logger.exception('Failed to flush last_seen')
+
+    def _start(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._stop.clear()
+                self._thread = threading.Thread(target=self._run,
+                                                name='last-seen-flusher',
+                                                daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.flush()
+            except Exception:
+                self.app.logger.exception('Failed to flush last_seen')
+
+
+class LastSeenTracker(object):
+    """Records activity in the current application's ``LastSeenBuffer``."""
+
+    def __init__(self, app=None, db=None):
+        self.db = db
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('LAST_SEEN_INTERVAL', 60)
+        app.extensions['last_seen'] = LastSeenBuffer(app, self.db)
+
+    @property
+    def buffer(self):
+        return current_app.extensions['last_seen']
+
+    def touch(self, user_id, when=None):
+        return self.buffer.touch(user_id, when)
+
+    def reset(self):
+        self.buffer.reset()
+
+    def flush(self):
+        return self.buffer.flush()
+
+    def shutdown(self):
+        self.buffer.shutdown()
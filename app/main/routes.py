@@ -0,0 +1,207 @@
+from flask import render_template, redirect, flash, url_for, request, \
+    current_app
+from flask_login import current_user, login_required
+from flask_babel import _, get_locale
+from markupsafe import Markup
+from werkzeug.exceptions import abort
+from app import db, last_seen, cache, archive, group_commit
+from app.jobs import jobs
+from app.main import bp
+from app.main.forms import EditProfileForm, PostForm, UpdatePostForm, \
+    SearchForm
+from app.models import User, Post
+from app.pagination import paginate_posts, PageSnapshot
+from app.recommend import suggestions_for
+from app.search import SearchPage
+from app.writes import add_post, add_follow, remove_follow
+
+
+@bp.route('/')
+@bp.route('/index')
+@login_required
+def index():
+    posts = paginate_posts(current_user.followed_posts(), request.args,
+                           current_app.config['POSTS_PER_PAGE'],
+                           archive.followed_by(current_user.id))
+
+    return render_template('index.html',
+                           title=_('Home Page'),
+                           pagination=posts,
+                           posts=posts.items,
+                           suggestions=suggestions_for(current_user.id))
+
+
+@bp.route('/user/<username>')
+@login_required
+@db.replica
+def user(username):
+    user = User.query.filter_by(username=username).first_or_404()
+    posts = cached_page(('user', user.id), lambda: user.posts,
+                        archive.by_author(user.id))
+
+    suggestions = suggestions_for(user.id) if user == current_user else []
+    return render_template('user.html',
+                           user=user,
+                           suggestions=suggestions,
+                           pagination=posts,
+                           posts=posts.ids,
+                           posts_html=render_posts(posts))
+
+
+@bp.before_app_request
+def before_request():
+    # Static files are cached by browsers and proxies, so they must not
+    # look at the session and vary on the cookie.
+    if request.endpoint != 'static' and current_user.is_authenticated:
+        last_seen.touch(current_user.id)
+
+
+@bp.route('/edit_profile', methods=['GET', 'POST'])
+@login_required
+def edit_profile():
+    form = EditProfileForm(current_user.username)
+    if form.validate_on_submit():
+        current_user.username = form.username.data
+        current_user.about_me = form.about_me.data
+        db.session.commit()
+        flash(_('Your changes have been saved.'))
+        return redirect(url_for('main.user', username=current_user.username))
+    elif request.method == 'GET':
+        form.username.data = current_user.username
+        form.about_me.data = current_user.about_me
+    return render_template('edit_profile.html',
+                           title=_('Edit Profile'),
+                           form=form)
+
+
+@bp.route('/create_post', methods=['GET', 'POST'])
+@login_required
+def create_post():
+    form = PostForm()
+    if form.validate_on_submit():
+        group_commit.run(add_post, current_user.id, form.title.data,
+                         form.body.data)
+        flash(_('Congratulations, post is created!'))
+        return redirect(url_for('main.index'))
+    return render_template('post/create_post.html',
+                           title=_('Create Post'),
+                           form=form)
+
+
+@bp.route('/update_post/<int:post_id>', methods=['GET', 'POST'])
+@login_required
+def update_post(post_id):
+    post = get_post(id=post_id)
+    form = UpdatePostForm()
+    if form.validate_on_submit():
+        post.title = form.title.data
+        post.body = form.body.data
+        # post.timestamp = datetime.utcnow()
+        jobs.emit('post.updated', post_id=post.id)
+        db.session.commit()
+        flash(_('Congratulations, post is updated!'))
+        return redirect(url_for('main.index'))
+    elif request.method == 'GET':
+        form.title.data = post.title
+        form.body.data = post.body
+    return render_template('post/update_post.html',
+                           title=_('Edit Post'),
+                           form=form)
+
+
+@bp.route('/delete/<int:post_id>', methods=('POST', ))
+@login_required
+def delete_post(post_id):
+    post = get_post(id=post_id)
+    db.session.delete(post)
+    jobs.emit('post.deleted', key=str(post.id), post_id=post.id)
+    db.session.commit()
+    return redirect(url_for('main.index'))
+
+
+def get_post(id, check_author=True):
+    post = Post.query.filter_by(id=id).first_or_404()
+    if check_author and post.author != current_user:
+        abort(403)
+    return post
+
+
+@bp.route('/follow/<username>')
+@login_required
+def follow(username):
+    user = User.query.filter_by(username=username).first()
+    if user is None:
+        flash(_('User {0} not found.').format(username))
+        return redirect(url_for('main.index'))
+    if user == current_user:
+        flash(_('You cannot follow yourself!'))
+        return redirect(url_for('main.user', username=username))
+    group_commit.run(add_follow, current_user.id, user.id)
+    flash(_('You are following {0}').format(username))
+    return redirect(url_for('main.user', username=username))
+
+
+@bp.route('/unfollow/<username>')
+@login_required
+def unfollow(username):
+    user = User.query.filter_by(username=username).first()
+    if user is None:
+        flash(_('User {0} not found.').format(username))
+        return redirect(url_for('main.index'))
+    if user == current_user:
+        flash(_('You cannot unfollow yourself!'))
+        return redirect(url_for('main.user', username=username))
+    group_commit.run(remove_follow, current_user.id, user.id)
+    flash(_('You are not following {0}').format(username))
+    return redirect(url_for('main.user', username=username))
+
+
+@bp.route('/explore')
+@login_required
+@db.replica
+def explore():
+    posts = cached_page(('explore', ), lambda: Post.query,
+                        archive.everyone)
+
+    return render_template('index.html',
+                           title=_('Explore Page'),
+                           pagination=posts,
+                           posts=posts.ids,
+                           posts_html=render_posts(posts))
+
+
+@bp.route('/search')
+@login_required
+def search():
+    form = SearchForm()
+    posts = None
+    if form.validate():
+        posts = SearchPage(form.q.data, current_app.config['POSTS_PER_PAGE'],
+                           request.args.get('cursor'))
+    return render_template('search.html',
+                           title=_('Search'),
+                           form=form,
+                           pagination=posts,
+                           posts=posts.items if posts else [])
+
+
+def cached_page(name, query, scope=None):
+    """Return the cached ``PageSnapshot`` for the requested cursor."""
+    per_page = current_app.config['POSTS_PER_PAGE']
+    key = name + (per_page, request.args.get('before'),
+                  request.args.get('after'))
+    return cache.cached(
+        key, lambda: PageSnapshot(
+            paginate_posts(query(), request.args, per_page, scope)))
+
+
+def render_posts(page):
+    """Return the cached ``_post.html`` fragment for a page of posts.
+
+    The viewer only becomes part of the key when they wrote one of the
+    posts, since that is the only case where the fragment differs.
+    """
+    viewer = current_user.id if current_user.id in page.author_ids else None
+    key = ('_post.html', get_locale(), viewer) + tuple(page.ids)
+    return Markup(cache.cached(
+        key, lambda: render_template('_post.html', posts=page.load())))
@@ -0,0 +1,187 @@
+"""Opt-in request, SQL and template instrumentation.
+
+With ``METRICS_ENABLED`` set, every request records its latency, the number
+and duration of the SQL statements it ran and the time spent rendering each
+template.  ``/metrics`` exposes p50/p95/p99 summaries in the Prometheus
+text format.
+
+Statements slower than ``METRICS_SLOW_QUERY_MS`` are logged with their
+bound parameters.  With ``METRICS_PROFILE_RATE`` above zero, that fraction
+of requests runs under cProfile, and the profile is written to
+``METRICS_PROFILE_DIR`` when the request took longer than
+``METRICS_PROFILE_THRESHOLD_MS``.
+
+Summaries are kept per application, in ``app.extensions['metrics']``.
+"""
+import cProfile
+import os
+import random
+import threading
+import time
+from collections import deque
+from flask import current_app, g, has_app_context, has_request_context, \
+    request, Response
+from flask import before_render_template, template_rendered
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+class Summary(object):
+    """Count, sum and quantiles over a window of the latest samples."""
+
+    def __init__(self, window=1024):
+        self.count = 0
+        self.sum = 0.0
+        self.samples = deque(maxlen=window)
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        self.samples.append(value)
+
+    def quantile(self, q):
+        if not self.samples:
+            return 0.0
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class Metrics(object):
+    QUANTILES = (0.5, 0.95, 0.99)
+
+    def __init__(self, app=None):
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('METRICS_ENABLED', False)
+        app.config.setdefault('METRICS_WINDOW', 1024)
+        app.config.setdefault('METRICS_SLOW_QUERY_MS', 100)
+        app.config.setdefault('METRICS_PROFILE_RATE', 0.0)
+        app.config.setdefault('METRICS_PROFILE_THRESHOLD_MS', 500)
+        app.config.setdefault('METRICS_PROFILE_DIR', 'profiles')
+        app.extensions['metrics'] = {}
+        if not app.config['METRICS_ENABLED']:
+            return
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.add_url_rule('/metrics', 'metrics', self.render)
+        before_render_template.connect(self._before_render, app)
+        template_rendered.connect(self._after_render, app)
+        if not event.contains(Engine, 'after_cursor_execute',
+                              self._after_cursor_execute):
+            event.listen(Engine, 'before_cursor_execute',
+                         self._before_cursor_execute)
+            event.listen(Engine, 'after_cursor_execute',
+                         self._after_cursor_execute)
+
+    def observe(self, name, labels, value):
+        key = (name, tuple(sorted(labels.items())))
+        summaries = current_app.extensions['metrics']
+        with self._lock:
+            summary = summaries.get(key)
+            if summary is None:
+                summary = summaries[key] = Summary(
+                    current_app.config['METRICS_WINDOW'])
+            summary.observe(value)
+
+    def render(self):
+        """Return every summary in the Prometheus text format."""
+        lines = []
+        seen = set()
+        with self._lock:
+            items = sorted(current_app.extensions['metrics'].items())
+            for (name, labels), summary in items:
+                if name not in seen:
+                    seen.add(name)
+                    lines.append(f'# TYPE {name} summary')
+                for q in self.QUANTILES:
+                    lines.append('{}{} {}'.format(
+                        name, _labels(labels + (('quantile', str(q)), )),
+                        summary.quantile(q)))
+                lines.append(f'{name}_sum{_labels(labels)} {summary.sum}')
+                lines.append(
+                    f'{name}_count{_labels(labels)} {summary.count}')
+        return Response('\n'.join(lines) + '\n',
+                        mimetype='text/plain; version=0.0.4')
+
+    def _before_request(self):
+        g.metrics_queries = 0
+        g.metrics_query_time = 0.0
+        g.metrics_render_start = []
+        g.metrics_profiler = None
+        if random.random() < current_app.config['METRICS_PROFILE_RATE']:
+            g.metrics_profiler = cProfile.Profile()
+            g.metrics_profiler.enable()
+        g.metrics_start = time.perf_counter()
+
+    def _after_request(self, response):
+        start = g.get('metrics_start')
+        if start is None:
+            return response
+        elapsed = time.perf_counter() - start
+        endpoint = request.endpoint or 'unknown'
+        self.observe('microblog_request_seconds',
+                     {'endpoint': endpoint,
+                      'method': request.method}, elapsed)
+        self.observe('microblog_request_queries', {'endpoint': endpoint},
+                     g.metrics_queries)
+        self.observe('microblog_request_query_seconds',
+                     {'endpoint': endpoint}, g.metrics_query_time)
+        profiler = g.metrics_profiler
+        if profiler is not None:
+            profiler.disable()
+            threshold = current_app.config['METRICS_PROFILE_THRESHOLD_MS']
+            if elapsed * 1000 >= threshold:
+                self._dump_profile(profiler, endpoint, elapsed)
+        return response
+
+    def _dump_profile(self, profiler, endpoint, elapsed):
+        directory = current_app.config['METRICS_PROFILE_DIR']
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, '{}-{}-{:.0f}ms.prof'.format(
+            endpoint, int(time.time() * 1000), elapsed * 1000))
+        profiler.dump_stats(path)
+        current_app.logger.info('Wrote profile %s', path)
+
+    def _before_render(self, app, template, context):
+        if has_request_context() and 'metrics_render_start' in g:
+            g.metrics_render_start.append(time.perf_counter())
+
+    def _after_render(self, app, template, context):
+        if has_request_context() and g.get('metrics_render_start'):
+            elapsed = time.perf_counter() - g.metrics_render_start.pop()
+            self.observe('microblog_template_render_seconds',
+                         {'template': template.name or 'string'}, elapsed)
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters,
+                               context, executemany):
+        conn.info.setdefault('metrics_query_start', []).append(
+            time.perf_counter())
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters,
+                              context, executemany):
+        starts = conn.info.get('metrics_query_start')
+        if not starts:
+            return
+        elapsed = time.perf_counter() - starts.pop()
+        if has_request_context() and 'metrics_queries' in g:
+            g.metrics_queries += 1
+            g.metrics_query_time += elapsed
+        # Engine events fire for every application, enabled or not.
+        if not has_app_context() or \
+                not current_app.config.get('METRICS_ENABLED'):
+            return
+        if elapsed * 1000 >= current_app.config['METRICS_SLOW_QUERY_MS']:
+            current_app.logger.warning(
+                'Slow query (%.1f ms): %s; parameters: %r', elapsed * 1000,
+                statement, parameters)
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(
+        name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+        for name, value in labels) + '}'
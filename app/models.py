@@ -1,25 +1,69 @@
-from datetime import datetime
-from app import db, login, app
-from werkzeug.security import generate_password_hash, check_password_hash
+from datetime import datetime, timedelta
+from app import db, login, hasher, user_cache
+from app.passwords import HASH_COLUMN_LENGTH
 from flask_login import UserMixin
 from hashlib import md5
-from time import time
-import jwt
+
+
+def email_digest(email):
+    if email is None:
+        return None
+    return md5(email.lower().encode('utf-8')).hexdigest()
+
+
+def avatar_url(digest, size):
+    return f'https://www.gravatar.com/avatar/{digest}?d=identicon&s={size}'
+
 
 followers = db.Table(
-    'followers', db.Column('follower_id', db.Integer,
-                           db.ForeignKey("user.id")),
-    db.Column('followed_id', db.Integer, db.ForeignKey("user.id")))
+    'followers',
+    db.Column('follower_id', db.Integer, db.ForeignKey("user.id"),
+              primary_key=True),
+    db.Column('followed_id', db.Integer, db.ForeignKey("user.id"),
+              primary_key=True),
+    db.Index('ix_followers_followed_id_follower_id', 'followed_id',
+             'follower_id'))
+
+timeline = db.Table(
+    'timeline',
+    db.Column('user_id', db.Integer, db.ForeignKey("user.id"),
+              primary_key=True),
+    db.Column('post_id', db.Integer, db.ForeignKey("post.id"),
+              primary_key=True),
+    db.Column('timestamp', db.DateTime),
+    db.Index('ix_timeline_user_id_timestamp', 'user_id', 'timestamp'))
+
+# Precomputed "who to follow" suggestions, see app.recommend.
+follow_suggestion = db.Table(
+    'follow_suggestion',
+    db.Column('user_id', db.Integer, db.ForeignKey("user.id"),
+              primary_key=True),
+    db.Column('suggested_id', db.Integer, db.ForeignKey("user.id"),
+              primary_key=True),
+    db.Column('score', db.Float))
+
+search_posting = db.Table(
+    'search_posting',
+    db.Column('term', db.String(64), primary_key=True),
+    db.Column('post_id', db.Integer, db.ForeignKey("post.id"),
+              primary_key=True, index=True),
+    db.Column('weight', db.Integer))
 
 
 class User(UserMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(64), index=True, unique=True)
     email = db.Column(db.String(120), index=True, unique=True)
-    password_hash = db.Column(db.String(128))
+    avatar_hash = db.Column(db.String(32))
+    password_hash = db.Column(db.String(HASH_COLUMN_LENGTH))
     posts = db.relationship('Post', backref='author', lazy='dynamic')
     about_me = db.Column(db.String(140))
     last_seen = db.Column(db.DateTime, default=datetime.utcnow)
+    celebrity = db.Column(db.Boolean, default=False, index=True)
+    followers_count = db.Column(db.Integer, default=0, server_default='0',
+                                nullable=False)
+    following_count = db.Column(db.Integer, default=0, server_default='0',
+                                nullable=False)
 
     followed = db.relationship('User',
                                secondary=followers,
@@ -32,64 +76,179 @@ class User(UserMixin, db.Model):
         return f'<User {self.username}>'
 
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = hasher.hash(password)
 
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        return hasher.verify(self.password_hash, password)
+
+    def password_needs_rehash(self):
+        return hasher.needs_rehash(self.password_hash)
+
+    @db.validates('email')
+    def validate_email(self, key, email):
+        self.avatar_hash = email_digest(email)
+        return email
 
     def avatar(self, size):
-        digest = md5(self.email.lower().encode('utf-8')).hexdigest()
-        return f'https://www.gravatar.com/avatar/{digest}?d=identicon&s={size}'
+        return avatar_url(self.avatar_hash or email_digest(self.email), size)
 
     def follow(self, user):
         if not self.is_following(user):
             self.followed.append(user)
+            self.following_count = User.following_count + 1
+            user.followers_count = User.followers_count + 1
+            if not is_async():
+                add_author(self, user)
 
     def unfollow(self, user):
         if self.is_following(user):
             self.followed.remove(user)
+            self.following_count = User.following_count - 1
+            user.followers_count = User.followers_count - 1
+            if not is_async():
+                remove_author(self, user)
 
     def is_following(self, user):
-        return self.followed.filter(
-            followers.c.followed_id == user.id).count() > 0
+        return db.session.query(
+            db.exists().where(
+                db.and_(followers.c.follower_id == self.id,
+                        followers.c.followed_id == user.id))).scalar()
 
     def followed_posts(self):
-        followed = Post.query.join(
-            followers, (followers.c.followed_id == Post.user_id)).filter(
-                followers.c.follower_id == self.id)
-        own = Post.query.filter_by(user_id=self.id)
-        return followed.union(own).order_by(Post.timestamp.desc())
+        return home_timeline(self)
 
     def get_reset_password_token(self, expires_in=600):
-        return jwt.encode(
-            {
-                'reset_password': self.id,
-                'exp': time() + expires_in
-            },
-            app.config['SECRET_KEY'],
-            algorithm='HS256').decode('utf-8')
+        return tokens.issue('reset_password', self.id, expires_in)
 
     @staticmethod
     def verify_reset_password_token(token):
-        try:
-            id = jwt.decode(token, app.config['SECRET_KEY'],
-                            algorithm='HS256')['reset_password']
-        except:
-            return
-        return User.query.get(id)
+        id = tokens.verify(token, 'reset_password')
+        return User.query.get(id) if id is not None else None
 
 
 class Post(db.Model):
+    # AUTOINCREMENT keeps SQLite from handing out the ids of deleted and
+    # archived posts again.
+    __table_args__ = (db.Index('ix_post_user_id_timestamp', 'user_id',
+                               'timestamp'),
+                      {'sqlite_autoincrement': True})
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(64), index=True)
     body = db.Column(db.String(140))
     timestamp = db.Column(db.DateTime, index=True, default=datetime.utcnow)
     user_id = db.Column(db.Integer, db.ForeignKey("user.id"))
+    # ArchivedPost has the same attributes, with this one true.
+    archived = False
 
     def __repr__(self):
         return f'<Post {self.title}>'
 
 
+class Outbox(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    subject = db.Column(db.String(255))
+    sender = db.Column(db.String(120))
+    recipients = db.Column(db.Text)
+    text_body = db.Column(db.Text)
+    html_body = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    attempts = db.Column(db.Integer, default=0)
+    next_attempt_at = db.Column(db.DateTime, index=True,
+                                default=datetime.utcnow)
+    sent_at = db.Column(db.DateTime, index=True)
+    failed = db.Column(db.Boolean, default=False)
+    last_error = db.Column(db.String(255))
+    locked_by = db.Column(db.String(64))
+    locked_until = db.Column(db.DateTime)
+
+    def __repr__(self):
+        return f'<Outbox {self.subject}>'
+
+    @staticmethod
+    def due(now=None):
+        """Unsent messages that are due and not leased to a sender."""
+        now = now or datetime.utcnow()
+        return Outbox.query.filter(
+            Outbox.sent_at.is_(None), Outbox.failed.is_(False),
+            Outbox.next_attempt_at <= now,
+            db.or_(Outbox.locked_until.is_(None),
+                   Outbox.locked_until < now)).order_by(Outbox.id)
+
+    def record_failure(self, error, backoff, max_attempts):
+        self.attempts = (self.attempts or 0) + 1
+        self.last_error = str(error)[:255]
+        self.locked_until = None
+        if self.attempts >= max_attempts:
+            self.failed = True
+        else:
+            self.next_attempt_at = datetime.utcnow() + timedelta(
+                seconds=backoff * 2**(self.attempts - 1))
+
+
+class Job(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(128))
+    key = db.Column(db.String(255), unique=True)
+    payload = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    run_at = db.Column(db.DateTime, index=True, default=datetime.utcnow)
+    attempts = db.Column(db.Integer, default=0)
+    locked_by = db.Column(db.String(64))
+    locked_until = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime, index=True)
+    last_error = db.Column(db.String(255))
+
+    def __repr__(self):
+        return f'<Job {self.name} {self.key}>'
+
+    @staticmethod
+    def due(now):
+        """Unfinished jobs that are due and not leased to a worker."""
+        return Job.query.filter(
+            Job.finished_at.is_(None), Job.run_at <= now,
+            db.or_(Job.locked_until.is_(None),
+                   Job.locked_until < now)).order_by(Job.id)
+
+
+class DeadJob(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(128))
+    key = db.Column(db.String(255), index=True)
+    payload = db.Column(db.Text)
+    created_at = db.Column(db.DateTime)
+    failed_at = db.Column(db.DateTime, default=datetime.utcnow)
+    attempts = db.Column(db.Integer)
+    last_error = db.Column(db.String(255))
+
+    def __repr__(self):
+        return f'<DeadJob {self.name} {self.key}>'
+
+
+class PostArchive(db.Model):
+    """An archive table of the posts of one month."""
+    month = db.Column(db.String(6), primary_key=True)
+    rows = db.Column(db.Integer)
+    oldest = db.Column(db.DateTime)
+    newest = db.Column(db.DateTime)
+    min_id = db.Column(db.Integer)
+    max_id = db.Column(db.Integer)
+
+    def __repr__(self):
+        return f'<PostArchive {self.month}>'
+
+
+class UsedToken(db.Model):
+    jti = db.Column(db.String(32), primary_key=True)
+    expires_at = db.Column(db.DateTime, index=True)
+
+    def __repr__(self):
+        return f'<UsedToken {self.jti}>'
+
+
 @login.user_loader
 def load_user(id):
-    return User.query.get(int(id))
+    return user_cache.get(int(id))
+
+
+from app.timeline import add_author, remove_author, home_timeline, is_async
+from app.tokens import tokens
@@ -0,0 +1,149 @@
+"""Keyset (cursor) pagination for post lists.
+
+Pages are addressed by the ``(timestamp, id)`` of the post at their edge
+instead of an OFFSET, and no total is counted, so every page costs one
+indexed range read no matter how deep it is.
+"""
+from base64 import urlsafe_b64encode, urlsafe_b64decode
+from datetime import datetime
+from sqlalchemy import and_, or_
+from sqlalchemy.orm import joinedload
+from app import archive
+from app.models import Post
+
+CURSOR_FORMAT = '%Y%m%d%H%M%S%f'
+
+
+def encode_cursor(post):
+    raw = f'{post.timestamp.strftime(CURSOR_FORMAT)}.{post.id}'
+    return urlsafe_b64encode(raw.encode('ascii')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(token):
+    """Return ``(timestamp, id)`` for a cursor, or None if it is invalid."""
+    if not token:
+        return None
+    try:
+        raw = urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        timestamp, id = raw.decode('ascii').split('.')
+        return datetime.strptime(timestamp, CURSOR_FORMAT), int(id)
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+
+def older_than(query, cursor):
+    """Restrict a post query to the posts that come after ``cursor`` when
+    sorted newest first."""
+    if cursor is None:
+        return query
+    timestamp, id = cursor
+    return query.filter(
+        or_(Post.timestamp < timestamp,
+            and_(Post.timestamp == timestamp, Post.id < id)))
+
+
+class KeysetPagination(object):
+    """Drop-in replacement for Flask-SQLAlchemy's ``Pagination``.
+
+    Exposes ``items``, ``has_prev``/``has_next`` and ``prev_args``/
+    ``next_args`` (the query arguments of the neighbouring pages) so the
+    ``bootstrap/pagination.html`` macros can render prev/next links.
+    ``iter_pages`` yields nothing because there is no total count.
+
+    With an archive ``scope`` (see ``app.archive``), pages that run past the
+    posts of the query continue with the archived posts in that scope.
+    """
+
+    def __init__(self, query, per_page, before=None, after=None,
+                 scope=None):
+        self.per_page = per_page
+        self.page = None
+        self.total = None
+        query = query.order_by(None).options(joinedload(Post.author))
+        before = decode_cursor(before)
+        after = decode_cursor(after) if before is None else None
+        if after is not None:
+            rows = []
+            if scope is not None:
+                newest = archive.newest_archived()
+                if newest is not None and after[0] <= newest:
+                    rows = archive.load(
+                        archive.newer(scope, after, per_page + 1))
+            if len(rows) <= per_page:
+                timestamp, id = (rows[-1].timestamp, rows[-1].id) if rows \
+                    else after
+                rows += query.filter(
+                    or_(Post.timestamp > timestamp,
+                        and_(Post.timestamp == timestamp,
+                             Post.id > id))).order_by(
+                                 Post.timestamp.asc(), Post.id.asc()).limit(
+                                     per_page + 1 - len(rows)).all()
+            self.has_prev = len(rows) > per_page
+            self.has_next = True
+            self.items = list(reversed(rows[:per_page]))
+        else:
+            rows = older_than(query, before).order_by(
+                Post.timestamp.desc(), Post.id.desc()).limit(
+                    per_page + 1).all()
+            if len(rows) <= per_page and scope is not None:
+                rows += archive.load(archive.older(
+                    scope, (rows[-1].timestamp, rows[-1].id) if rows
+                    else before, per_page + 1 - len(rows)))
+            self.has_prev = before is not None
+            self.has_next = len(rows) > per_page
+            self.items = rows[:per_page]
+        if not self.items:
+            self.has_prev = self.has_next = False
+
+    @property
+    def prev_args(self):
+        return {'after': encode_cursor(self.items[0]), 'before': None,
+                'page': None}
+
+    @property
+    def next_args(self):
+        return {'before': encode_cursor(self.items[-1]), 'after': None,
+                'page': None}
+
+    def iter_pages(self, *args, **kwargs):
+        return iter(())
+
+
+def paginate_posts(query, args, per_page, scope=None):
+    """Paginate a post query with the ``before``/``after`` request args."""
+    return KeysetPagination(query, per_page,
+                            before=args.get('before'),
+                            after=args.get('after'),
+                            scope=scope)
+
+
+class PageSnapshot(object):
+    """Picklable copy of a pagination that keeps post ids instead of rows.
+
+    Used to cache page query results; ``load`` fetches the posts again by
+    primary key when the rendered page is not cached as well.
+    """
+
+    def __init__(self, pagination):
+        self.ids = [post.id for post in pagination.items]
+        self.archived_ids = {post.id for post in pagination.items
+                             if post.archived}
+        self.author_ids = {post.user_id for post in pagination.items}
+        self.has_prev = pagination.has_prev
+        self.has_next = pagination.has_next
+        if self.has_prev:
+            self.prev_args = pagination.prev_args
+        if self.has_next:
+            self.next_args = pagination.next_args
+
+    def iter_pages(self, *args, **kwargs):
+        return iter(())
+
+    def load(self):
+        posts = Post.query.options(joinedload(Post.author)).filter(
+            Post.id.in_(set(self.ids) - self.archived_ids)).all()
+        # Posts archived since the snapshot was cached are looked up too.
+        missing = set(self.ids) - {post.id for post in posts}
+        posts += archive.load(archive.find(missing))
+        order = {id: index for index, id in enumerate(self.ids)}
+        return sorted(posts, key=lambda post: order[post.id])
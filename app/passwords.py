@@ -0,0 +1,96 @@
+"""Password hashing policy.
+
+Hashes use ``pbkdf2:<PASSWORD_HASH_ALGORITHM>:<PASSWORD_HASH_ITERATIONS>``.
+Stored hashes made under another policy are reported by ``needs_rehash``
+so they can be upgraded after a successful login.  A policy whose hashes
+would not fit in ``User.password_hash`` (``HASH_COLUMN_LENGTH``
+characters) is rejected when the application starts.
+
+With ``PASSWORD_HASH_WORKERS`` above zero, verification runs in a process
+pool, so a login storm no longer holds the GIL of the request workers.
+"""
+import hashlib
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from flask import current_app
+from werkzeug.security import generate_password_hash, check_password_hash
+
+HASH_COLUMN_LENGTH = 256
+
+
+def hash_length(algorithm, iterations, salt_length):
+    """Length of a ``pbkdf2:<algorithm>:<iterations>`` hash.
+
+    Raises ValueError for an algorithm PBKDF2 cannot use.
+    """
+    try:
+        digest = hashlib.pbkdf2_hmac(algorithm, b'', b'', 1)
+    except ValueError:
+        raise ValueError(f'Unsupported PASSWORD_HASH_ALGORITHM {algorithm!r}')
+    return len(f'pbkdf2:{algorithm}:{iterations}$') + salt_length + 1 + \
+        2 * len(digest)
+
+
+class HashPool(object):
+    """A pool of ``workers`` processes, started on first use."""
+
+    def __init__(self, workers):
+        self.workers = workers
+        self._pool = None
+        self._pool_pid = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        if not self.workers:
+            return None
+        # A pool inherited through fork() is unusable, so each process
+        # starts its own on first use.
+        if self._pool_pid != os.getpid():
+            with self._lock:
+                if self._pool_pid != os.getpid():
+                    self._pool = ProcessPoolExecutor(self.workers)
+                    self._pool_pid = os.getpid()
+        return self._pool
+
+
+class PasswordHasher(object):
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('PASSWORD_HASH_ALGORITHM', 'sha256')
+        app.config.setdefault('PASSWORD_HASH_ITERATIONS', 150000)
+        app.config.setdefault('PASSWORD_SALT_LENGTH', 8)
+        app.config.setdefault('PASSWORD_HASH_WORKERS', 0)
+        length = hash_length(app.config['PASSWORD_HASH_ALGORITHM'],
+                             app.config['PASSWORD_HASH_ITERATIONS'],
+                             app.config['PASSWORD_SALT_LENGTH'])
+        if length > HASH_COLUMN_LENGTH:
+            raise ValueError(
+                f'Password hashes of {length} characters do not fit in '
+                f'User.password_hash ({HASH_COLUMN_LENGTH})')
+        app.extensions['hasher'] = HashPool(
+            app.config['PASSWORD_HASH_WORKERS'])
+
+    @property
+    def method(self):
+        return 'pbkdf2:{}:{}'.format(
+            current_app.config['PASSWORD_HASH_ALGORITHM'],
+            current_app.config['PASSWORD_HASH_ITERATIONS'])
+
+    def hash(self, password):
+        return generate_password_hash(
+            password, self.method, current_app.config['PASSWORD_SALT_LENGTH'])
+
+    def verify(self, pwhash, password):
+        if not pwhash:
+            return False
+        pool = current_app.extensions['hasher'].get()
+        if pool is None:
+            return check_password_hash(pwhash, password)
+        return pool.submit(check_password_hash, pwhash, password).result()
+
+    def needs_rehash(self, pwhash):
+        return pwhash.split('$', 1)[0] != self.method
@@ -0,0 +1,184 @@
+"""Rate limits for expensive endpoints.
+
+Limits are declared on views, one decorator per limit::
+
+    @limiter.limit('20/minute')                        # per client IP
+    @limiter.limit('5/minute', key=by_form('username'))  # per account
+
+Each limit is a token bucket checked with the generic cell rate algorithm,
+which keeps a single timestamp per key: the theoretical arrival time of the
+next request.  ``count`` requests may arrive at once, after which one more
+is admitted every ``period / count`` seconds.  A rejected request gets a
+429 response with ``Retry-After``.
+
+``RATELIMIT_STORAGE`` selects where the timestamps live:
+
+* ``memory`` -- an LRU per process holding at most ``RATELIMIT_THRESHOLD``
+  keys.  Once it is full, the least recently used key is forgotten, which
+  at worst lets that client start over with a full bucket.
+* ``redis`` -- shared by every worker and updated atomically by a Lua
+  script on ``RATELIMIT_REDIS_URL``.
+"""
+import re
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from flask import request, current_app
+from werkzeug.exceptions import TooManyRequests
+
+UNITS = {'second': 1, 'minute': 60, 'hour': 3600, 'day': 86400}
+RATE_RE = re.compile(
+    r'^\s*(\d+)\s*(?:/|per)\s*(\d*)\s*(second|minute|hour|day)s?\s*$')
+
+
+def parse_rate(rate):
+    """Return ``(count, period)`` for a rate such as ``'5/minute'``."""
+    match = RATE_RE.match(rate)
+    if match is None:
+        raise ValueError(f'Invalid rate {rate!r}')
+    count, multiple, unit = match.groups()
+    return int(count), int(multiple or 1) * UNITS[unit]
+
+
+class MemoryStore(object):
+    """Per-process arrival times for at most ``threshold`` keys."""
+
+    def __init__(self, threshold=10000):
+        self.threshold = threshold
+        self._tats = OrderedDict()
+        self._lock = threading.Lock()
+
+    def hit(self, key, now, interval, period):
+        """Record a request; returns 0 or the seconds until one is allowed."""
+        with self._lock:
+            tat = max(self._tats.get(key, now), now) + interval
+            if tat - period > now:
+                self._tats.move_to_end(key)
+                return tat - period - now
+            self._tats[key] = tat
+            self._tats.move_to_end(key)
+            if len(self._tats) > self.threshold:
+                self.prune(now)
+            return 0
+
+    def prune(self, now):
+        # A bucket refilled by now is the same as a missing one.  Only the
+        # least recently used end is checked, so each call stays O(1)
+        # amortized; past that the oldest keys are dropped to keep the size.
+        while self._tats:
+            tat = next(iter(self._tats.values()))
+            if tat > now and len(self._tats) <= self.threshold:
+                break
+            self._tats.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._tats.clear()
+
+
+class RedisStore(object):
+    """Arrival times shared through a redis-compatible client."""
+
+    SCRIPT = """
+local now = tonumber(ARGV[1])
+local interval = tonumber(ARGV[2])
+local period = tonumber(ARGV[3])
+local tat = math.max(tonumber(redis.call('GET', KEYS[1]) or now), now)
+tat = tat + interval
+if tat - period > now then
+    return tostring(tat - period - now)
+end
+redis.call('SET', KEYS[1], tostring(tat), 'PX',
+           math.ceil((tat - now) * 1000))
+return '0'
+"""
+
+    def __init__(self, client, prefix):
+        self.client = client
+        self.prefix = prefix
+        self._script = client.register_script(self.SCRIPT)
+
+    def hit(self, key, now, interval, period):
+        return float(self._script(keys=[key], args=[now, interval, period]))
+
+    def clear(self):
+        for key in self.client.scan_iter(match=self.prefix + '*'):
+            self.client.delete(key)
+
+
+def make_store(config):
+    storage = config['RATELIMIT_STORAGE']
+    if storage == 'memory':
+        return MemoryStore(config['RATELIMIT_THRESHOLD'])
+    if storage == 'redis':
+        import redis
+        return RedisStore(redis.from_url(config['RATELIMIT_REDIS_URL']),
+                          config['RATELIMIT_KEY_PREFIX'])
+    raise ValueError(f'Unknown RATELIMIT_STORAGE {storage!r}')
+
+
+def by_ip():
+    return request.remote_addr
+
+
+def by_form(field):
+    """Key requests by a submitted form field, such as the account name."""
+    def key():
+        value = request.form.get(field, '').strip().lower()
+        return value or None
+    key.__name__ = f'by_form_{field}'
+    return key
+
+
+class Limiter(object):
+    """Declares limits on views; each application gets its own store."""
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('RATELIMIT_ENABLED', True)
+        app.config.setdefault('RATELIMIT_STORAGE', 'memory')
+        app.config.setdefault('RATELIMIT_THRESHOLD', 10000)
+        app.config.setdefault('RATELIMIT_REDIS_URL',
+                              'redis://localhost:6379/0')
+        app.config.setdefault('RATELIMIT_KEY_PREFIX', 'microblog:ratelimit:')
+        app.extensions['limiter'] = make_store(app.config)
+
+    def limit(self, rate, key=by_ip, methods=('POST', )):
+        """Limit the decorated view to ``rate`` requests per key.
+
+        Only requests with one of ``methods`` count.  Requests for which
+        ``key`` returns None are not limited.
+        """
+        count, period = parse_rate(rate)
+        interval = period / count
+
+        def decorator(view):
+            name = '{}:{}:{}:'.format(view.__name__, key.__name__,
+                                      rate.replace(' ', ''))
+
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                config = current_app.config
+                if config['RATELIMIT_ENABLED'] and request.method in methods:
+                    ident = key()
+                    if ident is not None:
+                        retry_after = self.store.hit(
+                            config['RATELIMIT_KEY_PREFIX'] + name + ident,
+                            time.time(), interval, period)
+                        if retry_after:
+                            raise TooManyRequests(
+                                retry_after=int(retry_after) + 1)
+                return view(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    @property
+    def store(self):
+        return current_app.extensions['limiter']
+
+    def reset(self):
+        self.store.clear()
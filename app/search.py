@@ -0,0 +1,257 @@
+"""Full-text search over ``Post.title`` and ``Post.body``.
+
+On SQLite builds with FTS5 the posts are indexed in the ``post_fts``
+virtual table and ranked with bm25.  Other databases (or
+``SEARCH_BACKEND = 'postings'``) use the ``search_posting`` table, an
+inverted index built in Python and ranked by tf-idf.
+
+The index follows commits: posts flushed as new, changed or deleted are
+collected per session and re-indexed right after the transaction commits.
+"""
+import math
+import re
+import weakref
+from base64 import urlsafe_b64encode, urlsafe_b64decode
+from sqlalchemy import event, select, func, case, and_, or_, text, DDL
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import joinedload
+from flask import current_app
+from app import db
+from app.models import Post, search_posting
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+TITLE_WEIGHT = 2
+MAX_TERM_LENGTH = 64
+
+_backends = weakref.WeakKeyDictionary()
+
+
+def fts5_available(connection):
+    if connection.dialect.name != 'sqlite':
+        return False
+    try:
+        connection.execute(
+            'CREATE VIRTUAL TABLE IF NOT EXISTS temp.fts5_probe USING fts5(x)')
+        connection.execute('DROP TABLE temp.fts5_probe')
+    except OperationalError:
+        return False
+    return True
+
+
+event.listen(
+    search_posting, 'after_create',
+    DDL('CREATE VIRTUAL TABLE IF NOT EXISTS post_fts USING fts5(title, body)')
+    .execute_if(callable_=lambda ddl, target, bind, **kw:
+                fts5_available(bind)))
+event.listen(
+    search_posting, 'before_drop',
+    DDL('DROP TABLE IF EXISTS post_fts').execute_if(dialect='sqlite'))
+
+
+def backend(connection):
+    """Return ``'fts5'`` or ``'postings'`` for the connection's engine."""
+    configured = current_app.config['SEARCH_BACKEND']
+    if configured != 'auto':
+        return configured
+    engine = connection.engine
+    if engine not in _backends:
+        has_fts = connection.dialect.name == 'sqlite' and connection.execute(
+            text("SELECT 1 FROM sqlite_master WHERE name = 'post_fts'")
+        ).scalar() is not None
+        _backends[engine] = 'fts5' if has_fts else 'postings'
+    return _backends[engine]
+
+
+def tokenize(text):
+    return [term[:MAX_TERM_LENGTH] for term in TOKEN_RE.findall(
+        (text or '').lower())]
+
+
+def index_posts(connection, ids):
+    """(Re)index the posts with the given ids, dropping missing ones."""
+    ids = list(ids)
+    if not ids:
+        return
+    post = Post.__table__
+    rows = connection.execute(
+        select([post.c.id, post.c.title,
+                post.c.body]).where(post.c.id.in_(ids))).fetchall()
+    unindex_posts(connection, ids)
+    if not rows:
+        return
+    if backend(connection) == 'fts5':
+        connection.execute(
+            text('INSERT INTO post_fts (rowid, title, body) '
+                 'VALUES (:id, :title, :body)'),
+            [dict(id=row.id, title=row.title or '', body=row.body or '')
+             for row in rows])
+        return
+    postings = []
+    for row in rows:
+        weights = {}
+        for term in tokenize(row.title):
+            weights[term] = weights.get(term, 0) + TITLE_WEIGHT
+        for term in tokenize(row.body):
+            weights[term] = weights.get(term, 0) + 1
+        postings.extend(dict(term=term, post_id=row.id, weight=weight)
+                        for term, weight in weights.items())
+    if postings:
+        connection.execute(search_posting.insert(), postings)
+
+
+def unindex_posts(connection, ids):
+    ids = list(ids)
+    if backend(connection) == 'fts5':
+        connection.execute(
+            text('DELETE FROM post_fts WHERE rowid IN ({})'.format(
+                ', '.join(str(int(id)) for id in ids))))
+    else:
+        connection.execute(search_posting.delete().where(
+            search_posting.c.post_id.in_(ids)))
+
+
+def reindex(batch_size=1000):
+    """Rebuild the whole index, reading posts in batches of ``batch_size``.
+
+    Yields the number of posts indexed so far.
+    """
+    post = Post.__table__
+    with db.engine.begin() as connection:
+        if backend(connection) == 'fts5':
+            connection.execute(text('DELETE FROM post_fts'))
+        else:
+            connection.execute(search_posting.delete())
+    done = 0
+    last_id = 0
+    while True:
+        with db.engine.begin() as connection:
+            ids = [row.id for row in connection.execute(
+                select([post.c.id]).where(post.c.id > last_id).order_by(
+                    post.c.id).limit(batch_size))]
+            if not ids:
+                break
+            index_posts(connection, ids)
+        done += len(ids)
+        last_id = ids[-1]
+        yield done
+
+
+def encode_cursor(score, id):
+    raw = f'{score!r}|{id}'
+    return urlsafe_b64encode(raw.encode('ascii')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(token):
+    if not token:
+        return None
+    try:
+        raw = urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        score, id = raw.decode('ascii').split('|')
+        return float(score), int(id)
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+
+def _fts5_hits(connection, terms, limit, cursor):
+    # bm25() is lower for better matches, so results are in ascending order.
+    sql = ('SELECT id, score FROM (SELECT rowid AS id, '
+           'bm25(post_fts, :title_weight, 1.0) AS score FROM post_fts '
+           'WHERE post_fts MATCH :match)')
+    params = dict(match=' '.join('"{}"'.format(term) for term in terms),
+                  title_weight=float(TITLE_WEIGHT), limit=limit)
+    if cursor is not None:
+        sql += ' WHERE score > :score OR (score = :score AND id > :id)'
+        params.update(score=cursor[0], id=cursor[1])
+    sql += ' ORDER BY score, id LIMIT :limit'
+    return [(row.id, row.score)
+            for row in connection.execute(text(sql), params)]
+
+
+def _posting_hits(connection, terms, limit, cursor):
+    frequencies = dict(connection.execute(
+        select([search_posting.c.term, func.count()]).where(
+            search_posting.c.term.in_(terms)).group_by(
+                search_posting.c.term)).fetchall())
+    if len(frequencies) < len(terms):
+        return []
+    total = connection.execute(
+        select([func.count()]).select_from(Post.__table__)).scalar()
+    idf = {term: math.log(1 + total / count)
+           for term, count in frequencies.items()}
+    # Scores are negated so both backends rank in ascending order.
+    score = func.round(-func.sum(
+        search_posting.c.weight * case(idf, value=search_posting.c.term)), 9)
+    having = func.count() == len(terms)
+    if cursor is not None:
+        having = and_(having, or_(
+            score > cursor[0],
+            and_(score == cursor[0], search_posting.c.post_id > cursor[1])))
+    query = select([search_posting.c.post_id, score]).where(
+        search_posting.c.term.in_(terms)).group_by(
+            search_posting.c.post_id).having(having).order_by(
+                score, search_posting.c.post_id).limit(limit)
+    return [(row[0], row[1]) for row in connection.execute(query)]
+
+
+class SearchPage(object):
+    """Ranked page of search results, paged forward by ``?cursor=``.
+
+    Provides the attributes read by the ``bootstrap/pagination.html``
+    macros; there is no link back, the browser history covers that.
+    """
+
+    has_prev = False
+
+    def __init__(self, q, per_page, cursor=None):
+        terms = sorted(set(tokenize(q)))
+        hits = []
+        if terms:
+            connection = db.session.connection()
+            find = _fts5_hits if backend(connection) == 'fts5' \
+                else _posting_hits
+            hits = find(connection, terms, per_page + 1,
+                        decode_cursor(cursor))
+        self.has_next = len(hits) > per_page
+        hits = hits[:per_page]
+        if self.has_next:
+            id, score = hits[-1]
+            self.next_args = {'cursor': encode_cursor(score, id)}
+        posts = {}
+        if hits:
+            posts = {post.id: post for post in Post.query.options(
+                joinedload(Post.author)).filter(
+                    Post.id.in_([id for id, score in hits]))}
+        self.items = [posts[id] for id, score in hits if id in posts]
+
+    def iter_pages(self, *args, **kwargs):
+        return iter(())
+
+
+@event.listens_for(db.session, 'before_flush')
+def _unindex_deleted_posts(session, flush_context, instances):
+    # Postings reference their post, so they go before it does.
+    ids = [obj.id for obj in session.deleted
+           if isinstance(obj, Post) and obj.id is not None]
+    if ids:
+        unindex_posts(session.connection(), ids)
+
+
+@event.listens_for(db.session, 'after_flush')
+def _collect_changed_posts(session, flush_context):
+    changed = session.info.setdefault('search_changed', set())
+    for obj in session.new | session.dirty | session.deleted:
+        if isinstance(obj, Post):
+            changed.add(obj.id)
+
+
+@event.listens_for(db.session, 'after_commit')
+def _index_changed_posts(session):
+    changed = session.info.pop('search_changed', None)
+    if changed:
+        with session.get_bind().begin() as connection:
+            index_posts(connection, changed)
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _discard_changed_posts(session):
+    session.info.pop('search_changed', None)
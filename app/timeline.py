@@ -0,0 +1,290 @@
+"""Materialized home timelines.
+
+Each post is copied into the ``timeline`` table of its author and of every
+follower in the same flush that inserts it, so the home feed is an indexed
+range read over ``(user_id, timestamp)`` instead of a UNION over the whole
+follow graph.
+
+Authors with more than ``TIMELINE_FANOUT_LIMIT`` followers are flagged as
+celebrities.  Their posts are only written to their own timeline and are
+pulled in by followers at read time, so one post never turns into millions
+of rows.
+
+With ``TIMELINE_ASYNC`` set, new posts and follows only queue jobs, and
+``flask worker`` writes the timelines shortly after the request.  The jobs
+write with Core statements, so they invalidate the page cache themselves.
+"""
+from sqlalchemy import Column, event, select, func, and_, literal
+from sqlalchemy.sql import visitors
+from flask import current_app
+from app import db, cache
+from app.jobs import jobs
+from app.models import User, Post, followers, timeline
+
+TIMELINE_COLUMNS = ['user_id', 'post_id', 'timestamp']
+
+
+def is_async():
+    return current_app.config['TIMELINE_ASYNC']
+
+
+def is_celebrity(connection, user_id):
+    user = User.__table__
+    count = connection.execute(
+        select([user.c.followers_count]).where(user.c.id == user_id)).scalar()
+    return (count or 0) > current_app.config['TIMELINE_FANOUT_LIMIT']
+
+
+def fan_out(connection, post_id, author_id):
+    """Write a new post to its author's and its followers' timelines."""
+    post = Post.__table__
+    connection.execute(timeline.insert().from_select(
+        TIMELINE_COLUMNS,
+        select([post.c.user_id, post.c.id,
+                post.c.timestamp]).where(post.c.id == post_id)))
+    if is_celebrity(connection, author_id):
+        connection.execute(User.__table__.update().where(
+            User.__table__.c.id == author_id).values(celebrity=True))
+        return
+    connection.execute(timeline.insert().from_select(
+        TIMELINE_COLUMNS,
+        select([followers.c.follower_id, post.c.id,
+                post.c.timestamp]).where(
+                    and_(post.c.id == post_id,
+                         followers.c.followed_id == post.c.user_id))))
+
+
+def retract(connection, post_id):
+    """Remove a post from every timeline it was written to."""
+    connection.execute(
+        timeline.delete().where(timeline.c.post_id == post_id))
+
+
+def add_author(user, author):
+    """Copy the posts of a newly followed author into a timeline.
+
+    Every post still in the ``post`` table is copied, as ``rebuild()``
+    does, so a feed does not depend on how it was built.
+    """
+    if user.id is None or author.id is None or user.id == author.id:
+        return
+    if author.celebrity:
+        return
+    post = Post.__table__
+    db.session.execute(timeline.insert().from_select(
+        TIMELINE_COLUMNS,
+        select([literal(user.id), post.c.id, post.c.timestamp]).where(
+            post.c.user_id == author.id)))
+
+
+def remove_author(user, author):
+    """Drop the posts of an unfollowed author from a timeline."""
+    if user.id is None or author.id is None or user.id == author.id:
+        return
+    post = Post.__table__
+    db.session.execute(timeline.delete().where(
+        and_(timeline.c.user_id == user.id,
+             timeline.c.post_id.in_(
+                 select([post.c.id]).where(post.c.user_id == author.id)))))
+
+
+def substitute(columns, clause):
+    """Return ``clause`` with the ``post`` columns named in ``columns``
+    replaced by their values there."""
+    post = Post.__table__
+
+    def replace(element):
+        if isinstance(element, Column) and element.table is post:
+            return columns.get(element.name)
+    return visitors.replacement_traverse(clause, {}, replace)
+
+
+class TimelineQuery(object):
+    """A UNION of post queries with the parts of the ``Query`` API that
+    the post pages use.
+
+    Filters, and the order with a limit, are applied inside every branch
+    before the UNION, so a page reads at most one page of rows from each
+    branch's index instead of sorting the whole UNION.  Each branch comes
+    with the columns that stand in for ``post`` columns in it.
+    """
+
+    def __init__(self, branches, criteria=(), order=(), limit=None,
+                 entities=None, options=()):
+        self.branches = branches
+        self._criteria = criteria
+        self._order = order
+        self._limit = limit
+        self._entities = entities
+        self._options = options
+
+    def _clone(self, **changes):
+        state = dict(criteria=self._criteria, order=self._order,
+                     limit=self._limit, entities=self._entities,
+                     options=self._options)
+        state.update(changes)
+        return TimelineQuery(self.branches, **state)
+
+    def filter(self, *criteria):
+        return self._clone(criteria=self._criteria + criteria)
+
+    def order_by(self, *order):
+        if order and order[0] is None:
+            return self._clone(order=())
+        return self._clone(order=self._order + order)
+
+    def limit(self, limit):
+        return self._clone(limit=limit)
+
+    def with_entities(self, *entities):
+        return self._clone(entities=entities)
+
+    def options(self, *options):
+        return self._clone(options=self._options + options)
+
+    @property
+    def query(self):
+        """The ``Query`` of the UNION."""
+        branches = []
+        for query, columns in self.branches:
+            query = query.filter(*[substitute(columns, criterion)
+                                   for criterion in self._criteria])
+            if self._limit is not None:
+                # SQLite only takes a LIMIT in a subquery of a UNION.
+                query = query.order_by(*[substitute(columns, clause)
+                                         for clause in self._order]).limit(
+                                             self._limit).from_self()
+            branches.append(query)
+        query = branches[0].union(*branches[1:])
+        if self._entities is not None:
+            query = query.with_entities(*self._entities)
+        return query.options(*self._options).order_by(*self._order).limit(
+            self._limit)
+
+    def all(self):
+        return self.query.all()
+
+    def __iter__(self):
+        return iter(self.all())
+
+
+def home_timeline(user):
+    """Posts on the user's timeline plus those of followed celebrities.
+
+    In the first branch the timeline row's copy of the post's timestamp is
+    used, so pages are range reads of ``ix_timeline_user_id_timestamp``.
+    """
+    fanned = Post.query.join(timeline,
+                             timeline.c.post_id == Post.id).filter(
+                                 timeline.c.user_id == user.id)
+    pulled = Post.query.join(
+        followers, followers.c.followed_id == Post.user_id).join(
+            User, User.id == Post.user_id).filter(
+                followers.c.follower_id == user.id,
+                User.celebrity.is_(True))
+    return TimelineQuery([(fanned, {'timestamp': timeline.c.timestamp,
+                                    'id': timeline.c.post_id}),
+                          (pulled, {})],
+                         order=(Post.timestamp.desc(), ))
+
+
+@jobs.subscribe('post.created', when=is_async)
+def fan_out_post(post_id):
+    """Fan a post out from a job, unless that already happened."""
+    post = Post.__table__
+    connection = db.session.connection()
+    author_id = connection.execute(
+        select([post.c.user_id]).where(post.c.id == post_id)).scalar()
+    if author_id is None:
+        return
+    # fan_out() writes the author's row in the same transaction as the
+    # followers' ones.
+    if connection.execute(select([timeline.c.post_id]).where(
+            and_(timeline.c.user_id == author_id,
+                 timeline.c.post_id == post_id))).first() is None:
+        fan_out(connection, post_id, author_id)
+        cache.invalidate_on_commit(db.session)
+
+
+@jobs.subscribe('user.followed', when=is_async)
+def backfill_author(follower_id, followed_id):
+    user, author = User.query.get(follower_id), User.query.get(followed_id)
+    if user is not None and author is not None and user.is_following(author):
+        remove_author(user, author)
+        add_author(user, author)
+        cache.invalidate_on_commit(db.session)
+
+
+@jobs.subscribe('user.unfollowed', when=is_async)
+def drop_author(follower_id, followed_id):
+    user, author = User.query.get(follower_id), User.query.get(followed_id)
+    if user is not None and author is not None and \
+            not user.is_following(author):
+        remove_author(user, author)
+        cache.invalidate_on_commit(db.session)
+
+
+def rebuild(batch_size=500):
+    """Recompute follow counters, celebrity flags and every timeline.
+
+    Users are processed in batches of ``batch_size`` with one commit per
+    batch.  Yields the number of users rebuilt so far.
+    """
+    user = User.__table__
+    post = Post.__table__
+    followers_count = select([func.count()]).select_from(followers).where(
+        followers.c.followed_id == user.c.id).as_scalar()
+    following_count = select([func.count()]).select_from(followers).where(
+        followers.c.follower_id == user.c.id).as_scalar()
+    db.session.execute(user.update().values(
+        followers_count=followers_count, following_count=following_count))
+    db.session.execute(user.update().values(
+        celebrity=user.c.followers_count >
+        current_app.config['TIMELINE_FANOUT_LIMIT']))
+    db.session.execute(timeline.delete())
+    db.session.commit()
+
+    done = 0
+    last_id = 0
+    while True:
+        ids = [row[0] for row in db.session.execute(
+            select([user.c.id]).where(user.c.id > last_id).order_by(
+                user.c.id).limit(batch_size))]
+        if not ids:
+            break
+        db.session.execute(timeline.insert().from_select(
+            TIMELINE_COLUMNS,
+            select([post.c.user_id, post.c.id,
+                    post.c.timestamp]).where(post.c.user_id.in_(ids))))
+        db.session.execute(timeline.insert().from_select(
+            TIMELINE_COLUMNS,
+            select([followers.c.follower_id, post.c.id,
+                    post.c.timestamp]).select_from(
+                        followers.join(
+                            post,
+                            post.c.user_id == followers.c.followed_id).join(
+                                user, user.c.id == post.c.user_id)).where(
+                                    and_(followers.c.follower_id.in_(ids),
+                                         followers.c.follower_id !=
+                                         followers.c.followed_id,
+                                         user.c.celebrity.isnot(True)))))
+        db.session.commit()
+        done += len(ids)
+        last_id = ids[-1]
+        yield done
+
+
+@event.listens_for(db.session, 'before_flush')
+def _retract_deleted_posts(session, flush_context, instances):
+    for obj in session.deleted:
+        if isinstance(obj, Post) and obj.id is not None:
+            retract(session.connection(), obj.id)
+
+
+@event.listens_for(db.session, 'after_flush')
+def _fan_out_new_posts(session, flush_context):
+    if is_async():
+        return
+    for obj in session.new:
+        if isinstance(obj, Post) and obj.user_id is not None:
+            fan_out(session.connection(), obj.id, obj.user_id)
@@ -0,0 +1,117 @@
+"""Signed, single-use tokens such as password reset links.
+
+Tokens are HS256 JWTs whose ``kid`` header names the key that signed them.
+``TOKEN_KEYS`` maps key ids to secrets: new tokens are signed with the
+first key, and tokens signed with any listed key verify, so a key is
+rotated by putting a new one first and dropping the old one once its
+tokens have expired.
+
+``verify`` does as little as it can:
+
+* Anything that is not three base64url segments of sane length, or whose
+  ``kid`` is unknown, is rejected before any signature is computed.
+* Verified claims are kept in a per-process LRU of ``TOKEN_CACHE_SIZE``
+  entries until the token expires, so repeated requests for the same link
+  skip the signature check.  A cached entry is only used while its key is
+  still in ``TOKEN_KEYS``, so dropping a key revokes cached tokens too.
+* The token id (``jti``) of a consumed token is stored in the
+  ``used_token`` table until the token would have expired, which makes
+  every token single-use across processes.  Expired rows are deleted as
+  new ones are written.
+"""
+import re
+import time
+from datetime import datetime
+from uuid import uuid4
+import jwt
+from flask import current_app
+from app import db
+from app.cache import MemoryCache
+from app.models import UsedToken
+
+ALGORITHM = 'HS256'
+TOKEN_RE = re.compile(r'[A-Za-z0-9_-]+\.[A-Za-z0-9_-]+\.[A-Za-z0-9_-]+')
+
+
+class TokenService(object):
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('TOKEN_KEYS', {'default': app.config[
+            'SECRET_KEY']})
+        app.config.setdefault('TOKEN_CACHE_SIZE', 1000)
+        app.config.setdefault('TOKEN_MAX_LENGTH', 1024)
+        app.extensions['tokens'] = MemoryCache(app.config['TOKEN_CACHE_SIZE'])
+
+    @property
+    def verified(self):
+        return current_app.extensions['tokens']
+
+    def issue(self, purpose, subject, expires_in):
+        """Return a token for ``subject`` that ``verify`` accepts."""
+        kid, key = next(iter(current_app.config['TOKEN_KEYS'].items()))
+        return jwt.encode({purpose: subject, 'jti': uuid4().hex,
+                           'exp': int(time.time() + expires_in)},
+                          key, algorithm=ALGORITHM,
+                          headers={'kid': kid}).decode('utf-8')
+
+    def verify(self, token, purpose):
+        """Return the subject of a valid, unused token, or None."""
+        claims = self.claims(token)
+        if claims is None or purpose not in claims or \
+                self.is_used(claims['jti']):
+            return None
+        return claims[purpose]
+
+    def claims(self, token):
+        """Return the verified claims of ``token``, or None."""
+        if not isinstance(token, str) or \
+                len(token) > current_app.config['TOKEN_MAX_LENGTH'] or \
+                not TOKEN_RE.fullmatch(token):
+            return None
+        keys = current_app.config['TOKEN_KEYS']
+        cached = self.verified.get(token)
+        if cached is not None:
+            kid, key, claims = cached
+            if keys.get(kid) != key:
+                self.verified.delete(token)
+                return None
+            return claims
+        try:
+            kid = jwt.get_unverified_header(token).get('kid')
+            key = keys.get(kid)
+            if key is None:
+                return None
+            claims = jwt.decode(token, key, algorithms=[ALGORITHM])
+        except jwt.InvalidTokenError:
+            return None
+        if not isinstance(claims.get('jti'), str) or \
+                not isinstance(claims.get('exp'), int):
+            return None
+        self.verified.set(token, (kid, key, claims),
+                          claims['exp'] - time.time())
+        return claims
+
+    def is_used(self, jti):
+        return db.session.query(
+            UsedToken.query.filter_by(jti=jti).exists()).scalar()
+
+    def consume(self, token):
+        """Mark a verified token used in the current session.
+
+        Committing fails with an ``IntegrityError`` if another request
+        consumed the token first.
+        """
+        claims = self.claims(token)
+        now = datetime.utcnow()
+        UsedToken.query.filter(UsedToken.expires_at < now).delete(
+            synchronize_session=False)
+        db.session.add(UsedToken(
+            jti=claims['jti'],
+            expires_at=datetime.utcfromtimestamp(claims['exp'])))
+        self.verified.delete(token)
+
+
+tokens = TokenService()
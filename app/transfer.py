@@ -0,0 +1,226 @@
+"""Streaming export and import of users, posts and the follow graph.
+
+Each table is one file, ``<table>.ndjson`` or ``<table>.csv``, read and
+written in chunks of ``chunk_size`` rows, so memory use does not grow with
+the data set.  Exports read through a server-side cursor where the
+database has one.  Imports insert each chunk with one ``executemany`` and
+skip rows whose keys already exist.  Progress is recorded in
+``import-progress.json`` next to the files, so an interrupted import
+continues where it stopped.  Non-unique indexes are dropped for the import
+and built once at the end.
+
+Archived posts are exported from their monthly tables, one file per
+month, ``post_archive_YYYYMM.<format>``.  An import puts them back in the
+same tables and rebuilds the ``post_archive`` registry from them.
+
+Avatar hashes, follow counters, celebrity flags, timelines and the search
+index are derived data: they are not exported and are rebuilt on import.
+"""
+import csv
+import json
+import os
+import re
+from datetime import datetime
+from itertools import islice
+from sqlalchemy import inspect, select, DateTime, Integer, Boolean, \
+    String
+from app import db, archive
+from app.models import User, Post, followers, email_digest
+
+FORMATS = ('ndjson', 'csv')
+# CSV has no null, so NULL is written as this marker, as PostgreSQL's COPY
+# does, and empty strings stay empty strings.
+CSV_NULL = '\\N'
+PROGRESS_FILE = 'import-progress.json'
+
+
+POST_COLUMNS = ('id', 'title', 'body', 'timestamp', 'user_id')
+
+
+def tables(months=()):
+    """Return ``(name, table, columns)`` in an order that satisfies FKs.
+
+    The archive tables of the ``YYYYMM`` months in ``months`` come last.
+    """
+    return [
+        ('user', User.__table__,
+         ('id', 'username', 'email', 'password_hash', 'about_me',
+          'last_seen')),
+        ('followers', followers, ('follower_id', 'followed_id')),
+        ('post', Post.__table__, POST_COLUMNS),
+    ] + [(archive.TABLE_PREFIX + month, archive.archive_table(month),
+          POST_COLUMNS) for month in months]
+
+
+def exported_months(directory, fmt):
+    """Return the months whose archive tables were exported to
+    ``directory``, oldest first."""
+    pattern = re.compile(re.escape(archive.TABLE_PREFIX) + r'(\d{6})\.' +
+                         re.escape(fmt))
+    return sorted(match.group(1) for match in map(pattern.fullmatch,
+                                                  os.listdir(directory))
+                  if match)
+
+
+def path(directory, name, fmt):
+    return os.path.join(directory, f'{name}.{fmt}')
+
+
+def chunks(rows, size):
+    while True:
+        chunk = list(islice(rows, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _dump(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+def _loader(column):
+    if isinstance(column.type, DateTime):
+        return datetime.fromisoformat
+    if isinstance(column.type, Boolean):
+        return lambda value: value in (True, 1, '1', 'true', 'True')
+    if isinstance(column.type, Integer):
+        return int
+    return str
+
+
+def write_rows(f, fmt, columns, rows):
+    """Write ``rows`` (sequences in ``columns`` order) to ``f``."""
+    if fmt == 'csv':
+        writer = csv.writer(f)
+        for row in rows:
+            writer.writerow([CSV_NULL if value is None else _dump(value)
+                             for value in row])
+    else:
+        for row in rows:
+            f.write(json.dumps(dict(zip(columns, map(_dump, row)))) + '\n')
+
+
+def read_rows(f, fmt, table, columns):
+    """Yield the rows in ``f`` as dicts of column values."""
+    loaders = {name: _loader(table.c[name]) for name in columns}
+    if fmt == 'csv':
+        # Empty fields of non-text columns are NULL too, as written by
+        # older exports.
+        text = {name for name in columns
+                if isinstance(table.c[name].type, String)}
+        records = ({name: None if value == CSV_NULL or
+                    (value == '' and name not in text) else value
+                    for name, value in record.items()}
+                   for record in csv.DictReader(f))
+    else:
+        records = (json.loads(line) for line in f if line.strip())
+    for record in records:
+        yield {name: None if record.get(name) is None
+               else loaders[name](record[name]) for name in columns}
+
+
+def export_table(connection, table, columns, f, fmt, chunk_size):
+    """Write ``table`` to ``f``; yields the number of rows written so far."""
+    result = connection.execution_options(stream_results=True).execute(
+        select([table.c[name] for name in columns]).order_by(
+            *table.primary_key.columns))
+    if fmt == 'csv':
+        csv.writer(f).writerow(columns)
+    done = 0
+    while True:
+        rows = result.fetchmany(chunk_size)
+        if not rows:
+            return
+        write_rows(f, fmt, columns, rows)
+        done += len(rows)
+        yield done
+
+
+def _prepare(name, row):
+    if name == 'user':
+        row['avatar_hash'] = email_digest(row['email'])
+    return row
+
+
+def _missing(connection, table, rows):
+    """Return the rows whose primary key is not in ``table`` yet."""
+    keys = list(table.primary_key.columns)
+    query = select(keys)
+    for key in keys:
+        query = query.where(key.in_({row[key.name] for row in rows}))
+    existing = {tuple(row) for row in connection.execute(query)}
+    return [row for row in rows
+            if tuple(row[key.name] for key in keys) not in existing]
+
+
+def import_table(name, table, rows, chunk_size, done=0):
+    """Insert ``rows`` after skipping the first ``done``.
+
+    Each chunk is inserted in its own transaction.  Yields the number of
+    rows processed so far, existing ones included.
+    """
+    if table.metadata is archive.metadata:
+        table.create(db.engine, checkfirst=True)
+    for chunk in chunks(islice(rows, done, None), chunk_size):
+        with db.engine.begin() as connection:
+            fresh = _missing(connection, table,
+                             [_prepare(name, row) for row in chunk])
+            if fresh:
+                connection.execute(table.insert(), fresh)
+        done += len(chunk)
+        yield done
+
+
+def register_archive(months):
+    """Rebuild the ``post_archive`` rows of imported archive tables."""
+    for month in months:
+        archive.recount(month)
+    archive.reserve_ids()
+    db.session.commit()
+
+
+def deferred_indexes():
+    return [index for name, table, columns in tables()
+            for index in table.indexes if not index.unique]
+
+
+def drop_indexes(indexes):
+    inspector = inspect(db.engine)
+    for index in indexes:
+        names = {existing['name']
+                 for existing in inspector.get_indexes(index.table.name)}
+        if index.name in names:
+            index.drop(db.engine)
+
+
+def create_indexes(indexes):
+    inspector = inspect(db.engine)
+    for index in indexes:
+        names = {existing['name']
+                 for existing in inspector.get_indexes(index.table.name)}
+        if index.name not in names:
+            index.create(db.engine)
+
+
+def load_progress(directory):
+    try:
+        with open(os.path.join(directory, PROGRESS_FILE)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def save_progress(directory, progress):
+    target = os.path.join(directory, PROGRESS_FILE)
+    with open(target + '.tmp', 'w') as f:
+        json.dump(progress, f)
+    os.replace(target + '.tmp', target)
+
+
+def clear_progress(directory):
+    try:
+        os.remove(os.path.join(directory, PROGRESS_FILE))
+    except FileNotFoundError:
+        pass
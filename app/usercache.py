@@ -0,0 +1,116 @@
+"""Process-local cache of logged in users.
+
+Flask-Login loads the user of every authenticated request.  ``UserCache``
+keeps a snapshot of the columns pages need (id, username, email digest and
+about_me) in a per-process LRU for ``USER_CACHE_TIMEOUT`` seconds, so most
+requests never read the ``user`` table.  ``current_user`` is then a
+``SessionUser``, which loads the ``User`` row the first time anything else
+is asked of it.  ``load()`` returns that row for code that hands the user to
+the ORM.
+
+A commit that changes a snapshot column or the password evicts the user's
+snapshot.  Other processes keep theirs until it expires.  Each application
+has its own LRU, in ``app.extensions['user_cache']``.
+"""
+from flask import current_app
+from flask_login import UserMixin
+from sqlalchemy import event, inspect
+from app.cache import MemoryCache
+
+SNAPSHOT = ('id', 'username', 'avatar_hash', 'about_me')
+# Columns whose change evicts the snapshot.
+WATCHED = ('username', 'email', 'avatar_hash', 'about_me', 'password_hash')
+
+
+class SessionUser(UserMixin):
+    """The logged in user, backed by a snapshot until more is needed."""
+
+    def __init__(self, snapshot, user=None):
+        self.__dict__.update(snapshot)
+        self._user = user
+
+    def __repr__(self):
+        return f'<User {self.username}>'
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        return getattr(self.load(), name)
+
+    def __setattr__(self, name, value):
+        if name.startswith('_'):
+            object.__setattr__(self, name, value)
+            return
+        setattr(self.load(), name, value)
+        # Read it back from the row from now on.
+        self.__dict__.pop(name, None)
+
+    def avatar(self, size):
+        from app.models import avatar_url
+        return avatar_url(self.avatar_hash, size)
+
+    def load(self):
+        """Return the ``User`` row, querying it on first use."""
+        if self._user is None:
+            from app.models import User
+            self._user = User.query.get(self.id)
+        return self._user
+
+
+class UserCache(object):
+    def __init__(self, app=None, db=None):
+        self.db = db
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('USER_CACHE_TIMEOUT', 300)
+        app.config.setdefault('USER_CACHE_SIZE', 10000)
+        app.extensions['user_cache'] = MemoryCache(
+            app.config['USER_CACHE_SIZE'], app.config['USER_CACHE_TIMEOUT'])
+        if self.db is not None and not event.contains(
+                self.db.session, 'after_commit', self._after_commit):
+            event.listen(self.db.session, 'after_flush', self._after_flush)
+            event.listen(self.db.session, 'after_commit', self._after_commit)
+            event.listen(self.db.session, 'after_rollback',
+                         self._after_rollback)
+
+    @property
+    def backend(self):
+        return current_app.extensions['user_cache']
+
+    def get(self, id):
+        """Return a ``SessionUser`` for ``id``, or None if there is none."""
+        snapshot = self.backend.get(id)
+        if snapshot is not None:
+            return SessionUser(snapshot)
+        from app.models import User, email_digest
+        user = User.query.get(id)
+        if user is None:
+            return None
+        snapshot = {name: getattr(user, name) for name in SNAPSHOT}
+        snapshot['avatar_hash'] = user.avatar_hash or email_digest(user.email)
+        self.backend.set(id, snapshot)
+        return SessionUser(snapshot, user)
+
+    def evict(self, id):
+        self.backend.delete(id)
+
+    def clear(self):
+        self.backend.clear()
+
+    def _after_flush(self, session, flush_context):
+        for obj in session.dirty | session.deleted:
+            if getattr(obj, '__tablename__', None) != 'user':
+                continue
+            attrs = inspect(obj).attrs
+            if obj in session.deleted or any(
+                    attrs[name].history.has_changes() for name in WATCHED):
+                session.info.setdefault('user_cache_evict', set()).add(obj.id)
+
+    def _after_commit(self, session):
+        for id in session.info.pop('user_cache_evict', ()):
+            self.evict(id)
+
+    def _after_rollback(self, session):
+        session.info.pop('user_cache_evict', None)
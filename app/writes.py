@@ -0,0 +1,33 @@
+"""Writes of the post and follow views, for ``group_commit.run``.
+
+They take ids and form values rather than request objects, since in group
+commit mode they run in the committer thread's session.
+"""
+from app import db, recommend
+from app.jobs import jobs
+from app.models import User, Post
+
+
+def add_post(user_id, title, body):
+    """Create a post; returns its id."""
+    post = Post(title=title, body=body, user_id=user_id)
+    db.session.add(post)
+    db.session.flush()
+    jobs.emit('post.created', key=str(post.id), post_id=post.id)
+    return post.id
+
+
+def add_follow(follower_id, followed_id):
+    User.query.get(follower_id).follow(User.query.get(followed_id))
+    jobs.emit('user.followed', follower_id=follower_id,
+              followed_id=followed_id)
+    if not recommend.is_async():
+        recommend.refresh(follower_id)
+
+
+def remove_follow(follower_id, followed_id):
+    User.query.get(follower_id).unfollow(User.query.get(followed_id))
+    jobs.emit('user.unfollowed', follower_id=follower_id,
+              followed_id=followed_id)
+    if not recommend.is_async():
+        recommend.refresh(follower_id)
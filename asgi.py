@@ -0,0 +1,5 @@
+from app import create_app
+from app.asgi import WsgiBridge
+
+app = create_app()
+application = WsgiBridge(app)
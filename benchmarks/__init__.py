@@ -0,0 +1,5 @@
+"""Benchmarks for the microblog application.
+
+Run each one as a module from the project root, e.g.
+``python -m benchmarks.passwords``.
+"""
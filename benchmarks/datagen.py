@@ -0,0 +1,161 @@
+"""Generate a synthetic social graph through the application's models.
+
+    DATABASE_URL=sqlite:///bench.db python -m benchmarks.datagen \\
+        --users 10000 --posts 1000000 --follows 50
+
+Follower counts follow a power law: a few users are followed by a large
+share of everyone, most by a handful.  Post authorship is skewed the same
+way.  Rows are written with Core ``executemany`` in chunks, then the follow
+counters, home timelines, search index and follow suggestions are rebuilt
+from them.
+
+Every user is called ``user<NNNNNN>`` (numbered from 1) and has the password
+``password``.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+from itertools import accumulate
+
+PASSWORD = 'password'
+
+
+def username(i):
+    return f'user{i:06d}'
+
+
+def power_law_weights(n, alpha, rng):
+    """Return ``n`` shuffled weights drawn from a Pareto distribution."""
+    weights = [rng.paretovariate(alpha) for _ in range(n)]
+    rng.shuffle(weights)
+    return weights
+
+
+def chunked(rows, size):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def generate_users(count, pwhash):
+    from app.models import email_digest
+    now = datetime.utcnow()
+    for i in range(1, count + 1):
+        email = f'{username(i)}@example.com'
+        yield dict(id=i, username=username(i), email=email,
+                   avatar_hash=email_digest(email), password_hash=pwhash,
+                   about_me=f'Synthetic user {i}', last_seen=now,
+                   followers_count=0, following_count=0, celebrity=False)
+
+
+def generate_follows(users, follows, weights, rng):
+    ids = list(range(1, users + 1))
+    # choices() would sum the weights again on every call.
+    cum_weights = list(accumulate(weights))
+    for follower in ids:
+        count = min(users - 1, max(1, int(rng.expovariate(1 / follows))))
+        followed = set()
+        for target in rng.choices(ids, cum_weights=cum_weights,
+                                  k=count * 2):
+            if target != follower:
+                followed.add(target)
+            if len(followed) == count:
+                break
+        for target in followed:
+            yield dict(follower_id=follower, followed_id=target)
+
+
+def generate_posts(users, posts, weights, days, rng):
+    ids = list(range(1, users + 1))
+    start = datetime.utcnow() - timedelta(days=days)
+    span = days * 86400
+    cum_weights = list(accumulate(weights))
+    authors = rng.choices(ids, cum_weights=cum_weights, k=posts)
+    for i, author in enumerate(authors, 1):
+        body = ' '.join(rng.choices(WORDS, k=rng.randint(3, 20)))
+        yield dict(id=i, user_id=author, title=f'Post {i}', body=body[:140],
+                   timestamp=start + timedelta(seconds=span * i / posts))
+
+
+WORDS = ('flask python sqlite timeline follow post cache index query page '
+         'cursor search friend coffee garden music travel photo book code '
+         'weekend morning night release bug fix feature deploy').split()
+
+
+def load(table, rows, chunk_size, label):
+    from app import db
+    total = 0
+    start = time.perf_counter()
+    for chunk in chunked(rows, chunk_size):
+        with db.engine.begin() as connection:
+            connection.execute(table.insert(), chunk)
+        total += len(chunk)
+        rate = total / (time.perf_counter() - start)
+        print(f'\r{label}: {total} rows ({rate:.0f} rows/sec)', end='',
+              file=sys.stderr)
+    print(file=sys.stderr)
+    return total
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--posts', type=int, default=20000)
+    parser.add_argument('--follows', type=int, default=20,
+                        help='mean number of users each user follows')
+    parser.add_argument('--alpha', type=float, default=1.2,
+                        help='Pareto shape of the popularity distribution')
+    parser.add_argument('--days', type=int, default=365,
+                        help='period the post timestamps are spread over')
+    parser.add_argument('--chunk-size', type=int, default=5000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--database',
+                        help='database URL, defaults to DATABASE_URL')
+    parser.add_argument('--skip-derived', action='store_true',
+                        help='do not rebuild timelines, search and '
+                        'suggestions')
+    args = parser.parse_args(argv)
+    if args.database:
+        os.environ['DATABASE_URL'] = args.database
+
+    from app import create_app, db, hasher
+    from app.models import User, Post, followers
+    from app.recommend import rebuild as rebuild_suggestions
+    from app.search import reindex
+    from app.timeline import rebuild
+
+    rng = random.Random(args.seed)
+    with create_app().app_context():
+        db.create_all()
+        pwhash = hasher.hash(PASSWORD)
+        weights = power_law_weights(args.users, args.alpha, rng)
+        load(User.__table__, generate_users(args.users, pwhash),
+             args.chunk_size, 'users')
+        load(followers, generate_follows(args.users, args.follows, weights,
+                                         rng), args.chunk_size, 'follows')
+        load(Post.__table__, generate_posts(args.users, args.posts, weights,
+                                            args.days, rng),
+             args.chunk_size, 'posts')
+        if not args.skip_derived:
+            for done in rebuild():
+                print(f'\rtimelines: {done} users', end='', file=sys.stderr)
+            print(file=sys.stderr)
+            for done in reindex():
+                print(f'\rsearch: {done} posts', end='', file=sys.stderr)
+            print(file=sys.stderr)
+            for done in rebuild_suggestions():
+                print(f'\rsuggestions: {done} users', end='',
+                      file=sys.stderr)
+            print(file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
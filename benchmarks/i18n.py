@@ -0,0 +1,56 @@
+"""Measure the cost of rendering pages in each supported locale.
+
+    python -m benchmarks.i18n --requests 500
+
+For every ``Accept-Language`` below, the login and registration pages are
+requested through the test client, which covers locale negotiation,
+catalog lookups, the lazy form strings and template rendering.  The best
+mean time per request of ``--rounds`` rounds is reported.  Neither page
+touches the database.
+"""
+import argparse
+import sys
+import time
+
+LOCALES = {
+    'en': 'en-US,en;q=0.9',
+    'zh_Hans': 'zh-CN,zh;q=0.9,en;q=0.8',
+    'zh_Hant_TW': 'zh-TW,zh;q=0.9,en;q=0.8',
+}
+PAGES = ('/login', '/register')
+
+
+def measure(client, header, requests):
+    headers = {'Accept-Language': header}
+    start = time.perf_counter()
+    for i in range(requests):
+        response = client.get(PAGES[i % len(PAGES)], headers=headers)
+        assert response.status_code == 200
+    return (time.perf_counter() - start) / requests
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=500,
+                        help='requests per locale and round')
+    parser.add_argument('--rounds', type=int, default=5)
+    args = parser.parse_args(argv)
+
+    from app import create_app
+    from config import Config
+
+    class BenchConfig(Config):
+        SQLALCHEMY_DATABASE_URI = 'sqlite://'
+        MAIL_WORKERS = 0
+
+    client = create_app(BenchConfig).test_client()
+    for header in LOCALES.values():
+        measure(client, header, len(PAGES))
+    for locale, header in LOCALES.items():
+        mean = min(measure(client, header, args.requests)
+                   for i in range(args.rounds))
+        print(f'{locale:<12} {mean * 1000:>8.3f} ms/request', file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
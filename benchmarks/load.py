@@ -0,0 +1,327 @@
+"""Drive the main pages and report throughput and latency percentiles.
+
+    python -m benchmarks.load run --users 1000 --seconds 10 --threads 4 \\
+        --output current.json
+    python -m benchmarks.load run --url http://127.0.0.1:5000 --processes 4
+    python -m benchmarks.load compare baseline.json current.json
+
+Without ``--url`` the requests go through the Flask test client against
+``DATABASE_URL``, with rate limiting off; with it, real HTTP requests are
+sent to a running server, which should be started with
+``RATELIMIT_DISABLED=1`` for the login scenario to measure anything.
+Either way each of ``--processes`` processes runs ``--threads`` clients,
+every client logged in as a random user from ``benchmarks.datagen``.
+Scenarios run one after another for ``--seconds`` each; only the scenario's
+own request is timed, not the logins and logouts around it.
+
+``compare`` exits with status 1 when a scenario's throughput dropped, or its
+p95 latency grew, by more than ``--threshold`` relative to the baseline.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import random
+import re
+import sys
+import threading
+import time
+from datetime import datetime
+from http.cookiejar import CookieJar
+from urllib.error import HTTPError
+from urllib.parse import urlencode
+from urllib.request import build_opener, HTTPCookieProcessor, \
+    HTTPRedirectHandler
+from benchmarks.datagen import username, PASSWORD
+
+CSRF_RE = re.compile(rb'name="csrf_token"[^>]*value="([^"]*)"')
+
+
+_apps = []
+
+
+def _app():
+    """Return this process' app; its clients share one connection pool."""
+    if not _apps:
+        from app import create_app
+        from config import Config
+
+        class LoadConfig(Config):
+            RATELIMIT_ENABLED = False
+
+        _apps.append(create_app(LoadConfig))
+    return _apps[0]
+
+
+class ClientSession(object):
+    """Requests through the Flask test client, keeping its cookies."""
+
+    def __init__(self):
+        self.client = _app().test_client()
+        self.csrf_token = None
+
+    def get(self, path):
+        response = self.client.get(path)
+        return response.status_code, response.get_data()
+
+    def post(self, path, data):
+        response = self.client.post(path, data=data)
+        return response.status_code, response.get_data()
+
+
+class _NoRedirect(HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+class HTTPSession(object):
+    """Requests to a running server with a cookie jar of its own."""
+
+    def __init__(self, url):
+        self.url = url.rstrip('/')
+        self.opener = build_opener(HTTPCookieProcessor(CookieJar()),
+                                   _NoRedirect)
+        self.csrf_token = None
+
+    def get(self, path):
+        return self._open(path)
+
+    def post(self, path, data):
+        return self._open(path, urlencode(data).encode('utf-8'))
+
+    def _open(self, path, data=None):
+        try:
+            with self.opener.open(self.url + path, data) as response:
+                return response.status, response.read()
+        except HTTPError as e:
+            return e.code, e.read()
+
+
+def prepare(session, user):
+    """Log the session in as ``user`` and remember its CSRF token."""
+    status, body = session.get('/login')
+    match = CSRF_RE.search(body)
+    session.csrf_token = match.group(1).decode('ascii') if match else ''
+    login(session, user)
+
+
+def login(session, user):
+    return session.post('/login', {'csrf_token': session.csrf_token,
+                                   'username': username(user),
+                                   'password': PASSWORD})
+
+
+def scenario_index(session, rng, users):
+    return session.get('/index')
+
+
+def scenario_explore(session, rng, users):
+    return session.get('/explore')
+
+
+def scenario_user(session, rng, users):
+    return session.get('/user/' + username(rng.randint(1, users)))
+
+
+def scenario_login(session, rng, users):
+    session.get('/logout')
+    start = time.perf_counter()
+    status, body = login(session, rng.randint(1, users))
+    return status, body, time.perf_counter() - start
+
+
+def scenario_create_post(session, rng, users):
+    return session.post('/create_post', {
+        'csrf_token': session.csrf_token,
+        'title': 'Load test',
+        'body': 'Posted by benchmarks.load at {}'.format(time.time())})
+
+
+SCENARIOS = {
+    'index': scenario_index,
+    'explore': scenario_explore,
+    'user': scenario_user,
+    'login': scenario_login,
+    'create_post': scenario_create_post,
+}
+
+
+def drive(url, name, threads, seconds, users, seed):
+    """Run one scenario in ``threads`` clients; returns the raw samples."""
+    scenario = SCENARIOS[name]
+    if not url:
+        _app()
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    ready = threading.Barrier(threads + 1)
+
+    def client(number):
+        rng = random.Random(f'{seed}-{os.getpid()}-{number}')
+        session = HTTPSession(url) if url else ClientSession()
+        try:
+            prepare(session, rng.randint(1, users))
+        finally:
+            ready.wait()
+        mine = []
+        failed = 0
+        deadline = time.perf_counter() + seconds
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            try:
+                result = scenario(session, rng, users)
+            except Exception:
+                failed += 1
+                continue
+            elapsed = result[2] if len(result) > 2 \
+                else time.perf_counter() - start
+            if result[0] >= 400:
+                failed += 1
+            else:
+                mine.append(elapsed)
+        with lock:
+            latencies.extend(mine)
+            errors[0] += failed
+
+    workers = [threading.Thread(target=client, args=(i, ))
+               for i in range(threads)]
+    for worker in workers:
+        worker.start()
+    ready.wait()
+    start = time.perf_counter()
+    for worker in workers:
+        worker.join()
+    return {'latencies': latencies, 'errors': errors[0],
+            'elapsed': time.perf_counter() - start}
+
+
+def percentile(ordered, q):
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def summarize(samples):
+    ordered = sorted(latency for sample in samples
+                     for latency in sample['latencies'])
+    throughput = sum(len(sample['latencies']) / sample['elapsed']
+                     for sample in samples if sample['elapsed'])
+    return {
+        'requests': len(ordered),
+        'errors': sum(sample['errors'] for sample in samples),
+        'throughput': round(throughput, 2),
+        'mean_ms': round(sum(ordered) / len(ordered) * 1000, 3)
+        if ordered else 0.0,
+        'p50_ms': round(percentile(ordered, 0.5) * 1000, 3),
+        'p95_ms': round(percentile(ordered, 0.95) * 1000, 3),
+        'p99_ms': round(percentile(ordered, 0.99) * 1000, 3),
+        'max_ms': round(ordered[-1] * 1000, 3) if ordered else 0.0,
+    }
+
+
+def run(args):
+    if args.database:
+        os.environ['DATABASE_URL'] = args.database
+    results = {
+        'meta': {
+            'target': args.url or 'test-client',
+            'processes': args.processes,
+            'threads': args.threads,
+            'seconds': args.seconds,
+            'users': args.users,
+            'python': platform.python_version(),
+            'started': datetime.utcnow().isoformat(),
+        },
+        'scenarios': {},
+    }
+    # spawn, so every process sets up its own app and connections.
+    context = multiprocessing.get_context('spawn')
+    for name in args.scenarios or list(SCENARIOS):
+        params = (args.url, name, args.threads, args.seconds, args.users,
+                  args.seed)
+        if args.processes > 1:
+            with context.Pool(args.processes) as pool:
+                samples = pool.starmap(drive, [params] * args.processes)
+        else:
+            samples = [drive(*params)]
+        summary = results['scenarios'][name] = summarize(samples)
+        print('{:<12} {throughput:>10.1f} req/s  p50 {p50_ms:>8.2f} ms  '
+              'p95 {p95_ms:>8.2f} ms  p99 {p99_ms:>8.2f} ms  '
+              '{errors} errors'.format(name, **summary), file=sys.stderr)
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+    return 0
+
+
+def compare(baseline, current, threshold):
+    """Return a message for every regression beyond ``threshold``."""
+    regressions = []
+    for name, before in baseline['scenarios'].items():
+        after = current['scenarios'].get(name)
+        if after is None:
+            continue
+        if before['throughput'] and after['throughput'] < \
+                before['throughput'] * (1 - threshold):
+            regressions.append('{}: throughput {} -> {} req/s'.format(
+                name, before['throughput'], after['throughput']))
+        if before['p95_ms'] and after['p95_ms'] > \
+                before['p95_ms'] * (1 + threshold):
+            regressions.append('{}: p95 {} -> {} ms'.format(
+                name, before['p95_ms'], after['p95_ms']))
+    return regressions
+
+
+def run_compare(args):
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+    regressions = compare(baseline, current, args.threshold)
+    for message in regressions:
+        print('REGRESSION ' + message)
+    if not regressions:
+        print('No regressions beyond {:.0%}'.format(args.threshold))
+    return 1 if regressions else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+
+    run_parser = commands.add_parser('run', help='run the scenarios')
+    run_parser.add_argument('--scenario', action='append', dest='scenarios',
+                            choices=list(SCENARIOS),
+                            help='scenario to run, may be repeated')
+    run_parser.add_argument('--url',
+                            help='server to send HTTP requests to')
+    run_parser.add_argument('--database',
+                            help='database URL for the test client')
+    run_parser.add_argument('--users', type=int, default=1000,
+                            help='number of generated users to pick from')
+    run_parser.add_argument('--seconds', type=float, default=10.0)
+    run_parser.add_argument('--threads', type=int, default=4)
+    run_parser.add_argument('--processes', type=int, default=1)
+    run_parser.add_argument('--seed', type=int, default=0)
+    run_parser.add_argument('--output', help='write the results here')
+    run_parser.set_defaults(func=run)
+
+    compare_parser = commands.add_parser(
+        'compare', help='fail on regressions against a baseline')
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('current')
+    compare_parser.add_argument('--threshold', type=float, default=0.1,
+                                help='allowed relative regression')
+    compare_parser.set_defaults(func=run_compare)
+
+    args = parser.parse_args(argv)
+    sys.exit(args.func(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+"""Report password verifications (logins) per second per core.
+
+    python -m benchmarks.passwords --policy sha256:150000 --policy sha256:50000
+
+Each policy is ``<algorithm>:<iterations>`` as in ``PASSWORD_HASH_ALGORITHM``
+and ``PASSWORD_HASH_ITERATIONS``.  With ``--processes N`` the checks run in
+N processes and the aggregate rate is divided by N.
+"""
+import argparse
+import time
+from concurrent.futures import ProcessPoolExecutor
+from werkzeug.security import generate_password_hash, check_password_hash
+
+DEFAULT_POLICIES = ['sha256:150000', 'sha256:50000', 'sha512:150000']
+
+
+def verify_for(pwhash, password, seconds):
+    count = 0
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        check_password_hash(pwhash, password)
+        count += 1
+    return count
+
+
+def measure(policy, seconds, processes):
+    pwhash = generate_password_hash('correct horse', f'pbkdf2:{policy}')
+    if processes <= 1:
+        start = time.perf_counter()
+        count = verify_for(pwhash, 'correct horse', seconds)
+        return count / (time.perf_counter() - start)
+    with ProcessPoolExecutor(processes) as pool:
+        list(pool.map(abs, range(processes)))
+        start = time.perf_counter()
+        counts = pool.map(verify_for, [pwhash] * processes,
+                          ['correct horse'] * processes,
+                          [seconds] * processes)
+        total = sum(counts)
+        return total / (time.perf_counter() - start) / processes
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--policy', action='append', dest='policies',
+                        help='algorithm:iterations, may be repeated')
+    parser.add_argument('--seconds', type=float, default=2.0)
+    parser.add_argument('--processes', type=int, default=1)
+    args = parser.parse_args(argv)
+
+    print(f'{"policy":<20} {"logins/sec/core":>16}')
+    for policy in args.policies or DEFAULT_POLICIES:
+        rate = measure(policy, args.seconds, args.processes)
+        print(f'{policy:<20} {rate:>16.1f}')
+
+
+if __name__ == '__main__':
+    main()
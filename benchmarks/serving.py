@@ -0,0 +1,152 @@
+"""Compare how many connections each serving mode holds per MB of memory.
+
+    python -m benchmarks.serving --connections 200 500 1000
+
+Each mode is started as a server process:
+
+* ``wsgi`` -- Werkzeug's threaded server, as ``flask run`` uses, with
+  HTTP/1.1 keep-alive on, as threaded production servers have it.  It
+  takes a thread per connection.
+* ``asgi`` -- uvicorn with ``asgi:application``; it needs the ``uvicorn``
+  package.  Views still run on ``ASGI_THREADS`` threads, so this compares
+  connection handling, not async database access.
+
+For every count, that many keep-alive connections are opened at once, each
+sends one ``--path`` request and then stays open, as browsers keep theirs.
+The server's resident memory and thread count are read from ``/proc``
+once every response has arrived, and reported against an idle server.
+``--database``, or ``DATABASE_URL``, must point to a migrated database.
+"""
+import argparse
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+WSGI = '''
+import sys
+from werkzeug.serving import run_simple, WSGIRequestHandler
+from microblog import app
+WSGIRequestHandler.protocol_version = 'HTTP/1.1'
+run_simple('127.0.0.1', int(sys.argv[1]), app, threaded=True)
+'''
+MODES = {
+    'wsgi': lambda port: [sys.executable, '-c', WSGI, str(port)],
+    'asgi': lambda port: [sys.executable, '-m', 'uvicorn',
+                          'asgi:application', '--port', str(port),
+                          '--log-level', 'warning', '--no-access-log'],
+}
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def status(pid):
+    """Return the resident memory in MB and thread count of a process."""
+    values = {}
+    with open(f'/proc/{pid}/status') as f:
+        for line in f:
+            name, value = line.split(':', 1)
+            values[name] = value.split()[:1]
+    return int(values['VmRSS'][0]) / 1024, int(values['Threads'][0])
+
+
+async def request(port, path):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    writer.write(f'GET {path} HTTP/1.1\r\nHost: 127.0.0.1\r\n\r\n'.encode())
+    await writer.drain()
+    length = 0
+    while True:
+        line = await reader.readline()
+        if not line:
+            raise ConnectionError('Connection closed before the response')
+        if line.lower().startswith(b'content-length:'):
+            length = int(line.split(b':')[1])
+        if line == b'\r\n':
+            break
+    await reader.readexactly(length)
+    return writer
+
+
+async def hold(port, path, count):
+    """Open ``count`` connections, one request each; returns the writers."""
+    return await asyncio.gather(*(request(port, path) for i in range(count)))
+
+
+async def probe(port, path):
+    for writer in await hold(port, path, 1):
+        writer.close()
+
+
+def wait_ready(port, path, process, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError('Server exited during startup')
+        try:
+            asyncio.run(probe(port, path))
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError('Server did not start')
+
+
+def measure(mode, counts, path, env):
+    port = free_port()
+    process = subprocess.Popen(MODES[mode](port), cwd=ROOT, env=env,
+                               stdout=subprocess.DEVNULL,
+                               stderr=subprocess.DEVNULL)
+    try:
+        wait_ready(port, path, process)
+        idle_rss, idle_threads = status(process.pid)
+        print(f'{mode} idle  {idle_rss:>8.1f} MB  {idle_threads:>5} threads',
+              file=sys.stderr)
+        for count in counts:
+            async def run():
+                start = time.perf_counter()
+                writers = await hold(port, path, count)
+                elapsed = time.perf_counter() - start
+                # Let the server settle before reading its memory.
+                await asyncio.sleep(0.5)
+                rss, threads = status(process.pid)
+                for writer in writers:
+                    writer.close()
+                await asyncio.sleep(0.5)
+                return elapsed, rss, threads
+            elapsed, rss, threads = asyncio.run(run())
+            grown = max(rss - idle_rss, 0.01)
+            print(f'{mode} {count:>5}  {rss:>8.1f} MB  {threads:>5} threads  '
+                  f'{count / grown:>8.1f} connections/MB  '
+                  f'{count / elapsed:>7.1f} req/s', file=sys.stderr)
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--mode', action='append', dest='modes',
+                        choices=list(MODES),
+                        help='mode to run, may be repeated')
+    parser.add_argument('--connections', type=int, nargs='+',
+                        default=[100, 500])
+    parser.add_argument('--path', default='/login')
+    parser.add_argument('--database',
+                        help='DATABASE_URL of a migrated database')
+    args = parser.parse_args(argv)
+    env = dict(os.environ, RATELIMIT_DISABLED='1')
+    if args.database:
+        env['DATABASE_URL'] = args.database
+    for mode in args.modes or list(MODES):
+        measure(mode, args.connections, args.path, env)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+"""Measure cold start time of the application.
+
+    python -m benchmarks.startup --repeat 10
+    python -m benchmarks.startup --code /tmp/old-checkout --output old.json
+    python -m benchmarks.startup --importtime create_app
+
+Every sample is a fresh interpreter, so nothing is cached between runs
+except by the operating system.  The scenarios are:
+
+* ``import`` -- ``import app``, the cost paid before any code runs.
+* ``create_app`` -- building the application, as a WSGI worker does.
+* ``cli`` -- the same under the ``flask`` command, which also loads
+  Flask-Migrate.
+* ``first_request`` -- building the application and serving the login page,
+  which installs the page extensions.
+
+``--code`` runs the scenarios against another checkout, such as one from
+before the application factory, where the module level app is used instead.
+``--importtime`` prints the slowest imports of one scenario.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+BUILD = '''
+import app as package
+application = package.create_app() if hasattr(package, 'create_app') \\
+    else package.app
+'''
+
+SCENARIOS = {
+    'import': ('import app', {}),
+    'create_app': (BUILD, {}),
+    'cli': (BUILD, {'FLASK_RUN_FROM_CLI': 'true'}),
+    'first_request': (BUILD + '''
+assert application.test_client().get('/login').status_code == 200
+''', {}),
+}
+
+
+def environment(extra):
+    env = dict(os.environ, DATABASE_URL='sqlite://')
+    env.pop('FLASK_RUN_FROM_CLI', None)
+    env.update(extra)
+    return env
+
+
+def sample(code, name):
+    """Return the seconds one fresh interpreter takes to run a scenario."""
+    source, extra = SCENARIOS[name]
+    start = time.perf_counter()
+    subprocess.run([sys.executable, '-c', source], cwd=code,
+                   env=environment(extra), check=True,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return time.perf_counter() - start
+
+
+def baseline(code, repeat):
+    """Seconds taken by an interpreter that runs nothing."""
+    samples = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, '-c', 'pass'], cwd=code, check=True)
+        samples.append(time.perf_counter() - start)
+    return min(samples)
+
+
+def importtime(code, name, top):
+    """Print the ``top`` imports with the largest cumulative time."""
+    source, extra = SCENARIOS[name]
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', source],
+                            cwd=code, env=environment(extra), check=True,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                            universal_newlines=True)
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        self_us, cumulative, module = line[len('import time:'):].split('|')
+        rows.append((int(cumulative), module.rstrip()))
+    for cumulative, module in sorted(rows, reverse=True)[:top]:
+        print(f'{cumulative / 1000:>9.1f} ms {module}')
+
+
+def run(args):
+    code = os.path.abspath(args.code)
+    interpreter = baseline(code, args.repeat)
+    results = {'meta': {'code': code, 'repeat': args.repeat,
+                        'interpreter_ms': round(interpreter * 1000, 1)},
+               'scenarios': {}}
+    for name in args.scenarios or list(SCENARIOS):
+        samples = [sample(code, name) for i in range(args.repeat)]
+        summary = results['scenarios'][name] = {
+            'min_ms': round(min(samples) * 1000, 1),
+            'median_ms': round(statistics.median(samples) * 1000, 1),
+            'app_ms': round((min(samples) - interpreter) * 1000, 1),
+        }
+        print('{:<14} min {min_ms:>8.1f} ms  median {median_ms:>8.1f} ms  '
+              'without interpreter {app_ms:>8.1f} ms'.format(name, **summary),
+              file=sys.stderr)
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scenario', action='append', dest='scenarios',
+                        choices=list(SCENARIOS),
+                        help='scenario to run, may be repeated')
+    parser.add_argument('--code', default=ROOT,
+                        help='checkout to measure')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='fresh interpreters per scenario')
+    parser.add_argument('--importtime', choices=list(SCENARIOS),
+                        help='print the slowest imports of a scenario')
+    parser.add_argument('--top', type=int, default=15)
+    parser.add_argument('--output', help='write the results here')
+    args = parser.parse_args(argv)
+    if args.importtime:
+        importtime(os.path.abspath(args.code), args.importtime, args.top)
+        sys.exit(0)
+    sys.exit(run(args))
+
+
+if __name__ == '__main__':
+    main()
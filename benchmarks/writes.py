@@ -0,0 +1,101 @@
+"""Compare post writes/sec with and without group commit.
+
+    python -m benchmarks.writes --threads 1 8 32 --seconds 5
+    python -m benchmarks.writes --synchronous FULL
+
+Every thread stands for a request that creates a post through
+``group_commit.run(add_post, ...)``, the write of the create post views,
+as fast as it can.  Each mode runs against a fresh SQLite file in a
+temporary directory, with the application's pragmas; ``--synchronous``
+overrides their ``synchronous`` setting, since it decides whether every
+commit waits for an fsync.  Reports writes/sec and per-write latency.
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+MODES = {'commit': False, 'group': True}
+
+
+def build_app(path, synchronous):
+    from app import create_app
+    from config import Config
+
+    class WritesConfig(Config):
+        SQLALCHEMY_DATABASE_URI = 'sqlite:///' + path
+        SQLITE_PRAGMAS = dict(Config.SQLITE_PRAGMAS,
+                              **({'synchronous': synchronous}
+                                 if synchronous else {}))
+        DATABASE_POOL_SIZE = 64
+
+    return create_app(WritesConfig)
+
+
+def measure(mode, threads, seconds, synchronous):
+    from app import db, group_commit
+    from app.models import User
+    from app.writes import add_post
+
+    with tempfile.TemporaryDirectory() as directory:
+        app = build_app(os.path.join(directory, 'writes.db'), synchronous)
+        app.config['GROUP_COMMIT'] = MODES[mode]
+        with app.app_context():
+            db.create_all()
+            users = [User(username=f'writer{i}',
+                          email=f'writer{i}@example.com')
+                     for i in range(threads)]
+            db.session.add_all(users)
+            db.session.commit()
+            user_ids = [user.id for user in users]
+            db.session.remove()
+        latencies = [[] for i in range(threads)]
+        deadline = time.monotonic() + seconds
+
+        def client(index):
+            with app.app_context():
+                while time.monotonic() < deadline:
+                    start = time.perf_counter()
+                    group_commit.run(add_post, user_ids[index], 'title',
+                                     'body')
+                    latencies[index].append(time.perf_counter() - start)
+
+        workers = [threading.Thread(target=client, args=(i, ))
+                   for i in range(threads)]
+        start = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        elapsed = time.perf_counter() - start
+        with app.app_context():
+            group_commit.stop()
+            db.engine.dispose()
+    samples = sorted(sample for thread in latencies for sample in thread)
+    p95 = samples[int(len(samples) * 0.95)] if samples else 0
+    print(f'{mode:<6} {threads:>4} threads  '
+          f'{len(samples) / elapsed:>8.0f} writes/s  '
+          f'p50 {statistics.median(samples or [0]) * 1000:>6.1f} ms  '
+          f'p95 {p95 * 1000:>6.1f} ms', file=sys.stderr)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--mode', action='append', dest='modes',
+                        choices=list(MODES),
+                        help='mode to run, may be repeated')
+    parser.add_argument('--threads', type=int, nargs='+', default=[1, 8, 32])
+    parser.add_argument('--seconds', type=float, default=3)
+    parser.add_argument('--synchronous', choices=['OFF', 'NORMAL', 'FULL'],
+                        help='SQLite synchronous pragma')
+    args = parser.parse_args(argv)
+    for threads in args.threads:
+        for mode in args.modes or list(MODES):
+            measure(mode, threads, args.seconds, args.synchronous)
+
+
+if __name__ == '__main__':
+    main()
@@ -11,14 +11,91 @@ class Config(object):
         'sqlite:///' + os.path.join(basedir, 'app.db')
 
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    SQLITE_PRAGMAS = {
+        'journal_mode': os.environ.get('SQLITE_JOURNAL_MODE') or 'WAL',
+        'synchronous': 'NORMAL',
+        'busy_timeout': 5000,
+        'mmap_size': 256 * 1024 * 1024,
+        'cache_size': -64 * 1024,
+    }
+    DATABASE_POOL_SIZE = int(os.environ.get('DATABASE_POOL_SIZE') or 5)
+    DATABASE_MAX_OVERFLOW = int(os.environ.get('DATABASE_MAX_OVERFLOW') or 10)
+    DATABASE_POOL_RECYCLE = 1800
+    DATABASE_POOL_TIMEOUT = 30
+    DATABASE_REPLICA_URL = os.environ.get('DATABASE_REPLICA_URL')
 
     PP_KEY_TESTING = 'Just for testing.'
 
+    PASSWORD_HASH_ALGORITHM = os.environ.get('PASSWORD_HASH_ALGORITHM') or \
+        'sha256'
+    PASSWORD_HASH_ITERATIONS = int(
+        os.environ.get('PASSWORD_HASH_ITERATIONS') or 150000)
+    PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS') or 0)
+
     MAIL_SERVER = os.environ.get('MAIL_SERVER')
     MAIL_PORT = int(os.environ.get('MAIL_PORT') or 25)
     MAIL_USE_TLS = os.environ.get('MAIL_USE_TLS') is not None
     MAIL_USERNAME = os.environ.get('MAIL_USERNAME')
     MAIL_PASSWORD = os.environ.get('MAIL_PASSWORD')
     ADMINS = ['brad.lee.tw@qq.com']
+    MAIL_WORKERS = int(os.environ.get('MAIL_WORKERS') or 2)
+    MAIL_QUEUE_SIZE = 100
+    MAIL_BATCH_SIZE = 20
+    MAIL_MAX_ATTEMPTS = 5
+    MAIL_RETRY_BACKOFF = 30
+    MAIL_LEASE = 300
     POSTS_PER_PAGE = 4
+    API_POSTS_PER_PAGE = 20
+    API_MAX_PER_PAGE = 100
     LANGUAGES = ['zh_tw', 'en', 'zh_cn']
+    METRICS_ENABLED = os.environ.get('METRICS_ENABLED') is not None
+    METRICS_SLOW_QUERY_MS = int(os.environ.get('METRICS_SLOW_QUERY_MS') or 100)
+    METRICS_PROFILE_RATE = float(os.environ.get('METRICS_PROFILE_RATE') or 0)
+    METRICS_PROFILE_THRESHOLD_MS = 500
+    METRICS_PROFILE_DIR = os.path.join(basedir, 'profiles')
+    SEARCH_BACKEND = os.environ.get('SEARCH_BACKEND') or 'auto'
+    TIMELINE_FANOUT_LIMIT = int(os.environ.get('TIMELINE_FANOUT_LIMIT') or 1000)
+    TIMELINE_ASYNC = os.environ.get('TIMELINE_ASYNC') is not None
+    JOBS_THREADS = int(os.environ.get('JOBS_THREADS') or 4)
+    JOBS_LEASE = 300
+    JOBS_MAX_ATTEMPTS = 5
+    JOBS_RETRY_BACKOFF = 10
+    RECOMMEND_TOP_K = 5
+    RECOMMEND_ACTIVITY_DAYS = 30
+    # Follows queue a job that `flask worker` runs to refresh suggestions;
+    # tests refresh them in the request instead.
+    RECOMMEND_ASYNC = True
+    GROUP_COMMIT = os.environ.get('GROUP_COMMIT') is not None
+    GROUP_COMMIT_WINDOW = float(os.environ.get('GROUP_COMMIT_WINDOW') or 0.003)
+    LAST_SEEN_INTERVAL = int(os.environ.get('LAST_SEEN_INTERVAL') or 60)
+    USER_CACHE_TIMEOUT = int(os.environ.get('USER_CACHE_TIMEOUT') or 300)
+    ASGI_THREADS = int(os.environ.get('ASGI_THREADS') or 8)
+    MAX_CONTENT_LENGTH = int(os.environ.get('MAX_CONTENT_LENGTH') or
+                             1024 * 1024)
+    # kid:secret pairs; tokens are signed with the first key and verified
+    # with any of them.
+    TOKEN_KEYS = dict(
+        pair.split(':', 1) for pair in os.environ['TOKEN_KEYS'].split(',')
+    ) if os.environ.get('TOKEN_KEYS') else {'default': SECRET_KEY}
+    RATELIMIT_ENABLED = not os.environ.get('RATELIMIT_DISABLED')
+    RATELIMIT_STORAGE = os.environ.get('RATELIMIT_STORAGE') or 'memory'
+    RATELIMIT_REDIS_URL = os.environ.get('RATELIMIT_REDIS_URL') or \
+        'redis://localhost:6379/0'
+    # The memory backend only sees invalidations from its own process, so
+    # with several gunicorn workers the others would serve stale pages until
+    # the timeout.  Use it only for a single-process debug server.
+    CACHE_TYPE = os.environ.get('CACHE_TYPE') or 'file'
+    CACHE_DEFAULT_TIMEOUT = 300
+    CACHE_DIR = os.environ.get('CACHE_DIR') or \
+        os.path.join(basedir, 'cache')
+    CACHE_REDIS_URL = os.environ.get('CACHE_REDIS_URL') or \
+        'redis://localhost:6379/0'
+    ASSETS_BUNDLES = {
+        'site.css': ['assets/css/theme.css'],
+        'site.js': ['assets/plugins/jquery-3.4.1.min.js',
+                    'assets/plugins/popper.min.js',
+                    'assets/plugins/bootstrap/js/bootstrap.min.js'],
+    }
+    ASSETS_FILES = ('favicon.ico', 'frog.svg',
+                    'assets/fontawesome/js/all.min.js')
+    ASSETS_VENDOR = bool(os.environ.get('ASSETS_VENDOR'))
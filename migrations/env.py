@@ -78,11 +78,20 @@ def run_migrations_online():
         poolclass=pool.NullPool,
     )
 
+    # the monthly post archive tables are created by `flask posts archive`,
+    # the FTS5 search table and its shadow tables by the search index, and
+    # sqlite_sequence by SQLite itself
+    def include_object(object, name, type_, reflected, compare_to):
+        return not (type_ == 'table' and (
+            name.startswith('post_archive_') or name == 'post_fts' or
+            name.startswith('post_fts_') or name.startswith('sqlite_')))
+
     with connectable.connect() as connection:
         context.configure(
             connection=connection,
             target_metadata=target_metadata,
             process_revision_directives=process_revision_directives,
+            include_object=include_object,
             **current_app.extensions['migrate'].configure_args
         )
 
@@ -0,0 +1,38 @@
+"""post autoincrement
+
+Revision ID: f4b1d7c2e690
+Revises: a6c4e08b3d17
+Create Date: 2026-10-19 10:12:51.207733
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'f4b1d7c2e690'
+down_revision = 'a6c4e08b3d17'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Only SQLite reuses ids; rebuild post as an AUTOINCREMENT table and
+    # start its sequence above every id handed out so far, archived ones
+    # included.
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+    with op.batch_alter_table('post', recreate='always',
+                              table_kwargs={'sqlite_autoincrement': True}):
+        pass
+    op.execute("DELETE FROM sqlite_sequence WHERE name = 'post'")
+    op.execute("INSERT INTO sqlite_sequence (name, seq) SELECT 'post', "
+               "max(coalesce((SELECT max(id) FROM post), 0), "
+               "coalesce((SELECT max(max_id) FROM post_archive), 0))")
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+    with op.batch_alter_table('post', recreate='always',
+                              table_kwargs={'sqlite_autoincrement': False}):
+        pass
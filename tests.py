@@ -1,29 +1,279 @@
 from datetime import datetime, timedelta
+import random
+import re
+import smtplib
+import asyncio
+import gzip
+import io
+import os
+import socketserver
+import subprocess
+import sys
+import tempfile
+import threading
 import unittest
-from app import app, db
-from app.models import User, Post
+from concurrent.futures import Future
+from unittest import mock
+from sqlalchemy import event
+from sqlalchemy.exc import IntegrityError
+from app import create_app, db, last_seen, cache, limiter, user_cache, \
+    group_commit, hasher
+from app.asgi import WsgiBridge
+from app.assets import Assets, minify_css
+from app.cache import MemoryCache, RedisCache
+from app.ratelimit import MemoryStore, parse_rate
+from app.usercache import SessionUser
+from app.metrics import Metrics, Summary
+from flask import Flask, render_template_string, url_for
+from app.models import User, Post, Outbox, Job, DeadJob, UsedToken, \
+    timeline, email_digest
+from app.jobs import jobs
+from app.tokens import tokens
+from app.email import dispatcher, send_email
+from app.pagination import KeysetPagination, PageSnapshot
+from app.search import SearchPage, reindex
+from app.writes import add_post, add_follow
+from app import recommend
+from app import archive
+from app.archive import archive_posts
+from app import cli, transfer
+from app.database import REPLICA
+from app.i18n import negotiate, lazy_gettext
+from benchmarks.datagen import generate_follows, power_law_weights
+from benchmarks.load import compare
+from config import Config
 
 
-class UserModelCase(unittest.TestCase):
+class TestConfig(Config):
+    TESTING = True
+    SQLALCHEMY_DATABASE_URI = 'sqlite://'
+    WTF_CSRF_ENABLED = False
+    MAIL_WORKERS = 0
+    RECOMMEND_ASYNC = False
+    CACHE_TYPE = 'memory'
+
+
+class AppCase(unittest.TestCase):
+    """Runs each test in an app context over freshly created tables."""
+    config = TestConfig
+
     def setUp(self):
-        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+        self.app = create_app(self.config)
+        self.app_context = self.app.app_context()
+        self.app_context.push()
         db.create_all()
 
     def tearDown(self):
+        last_seen.flush()
         db.session.remove()
         db.drop_all()
+        self.app_context.pop()
+
+
+class AppFactoryCase(unittest.TestCase):
+    def test_apps_are_isolated(self):
+        class OtherConfig(TestConfig):
+            POSTS_PER_PAGE = 3
+
+        first, second = create_app(TestConfig), create_app(OtherConfig)
+        self.assertNotEqual(first.config['POSTS_PER_PAGE'], 3)
+        self.assertIsNot(first.extensions['limiter'],
+                         second.extensions['limiter'])
+
+    def test_extension_state_is_per_app(self):
+        class NullCacheConfig(TestConfig):
+            CACHE_TYPE = 'null'
+            USER_CACHE_SIZE = 1
+
+        first = create_app(TestConfig)
+        second = create_app(NullCacheConfig)
+        with first.app_context():
+            self.assertIsInstance(cache.backend, MemoryCache)
+            self.assertEqual(user_cache.backend.threshold, 10000)
+            self.assertIs(last_seen.buffer.app, first)
+            self.assertIs(dispatcher.queue.app, first)
+        with second.app_context():
+            self.assertIsNone(cache.version)
+            self.assertEqual(user_cache.backend.threshold, 1)
+            self.assertIs(last_seen.buffer.app, second)
+        for name in ('cache', 'user_cache', 'tokens', 'hasher', 'metrics',
+                     'last_seen', 'mail_queue', 'group_commit'):
+            self.assertIsNot(first.extensions[name], second.extensions[name])
+
+    def test_page_extensions_load_on_first_request(self):
+        test_app = create_app(TestConfig)
+        self.assertNotIn('migrate', test_app.extensions)
+        self.assertNotIn('bootstrap', test_app.extensions)
+        self.assertEqual(test_app.test_client().get('/login').status_code,
+                         200)
+        self.assertIn('bootstrap', test_app.extensions)
+        self.assertIn('moment', test_app.extensions)
+
+    def test_cli_modules_load_on_use(self):
+        # A fresh interpreter, since this file imports app.transfer itself.
+        code = ('import sys, microblog; '
+                'print("app.transfer" in sys.modules)')
+        output = subprocess.run(
+            [sys.executable, '-c', code], check=True, stdout=subprocess.PIPE,
+            cwd=os.path.dirname(os.path.abspath(__file__))).stdout
+        self.assertEqual(output.strip().splitlines()[-1], b'False')
+        self.assertEqual(cli.TRANSFER_FORMATS, transfer.FORMATS)
+
+
+class AsgiCase(unittest.TestCase):
+    def request(self, bridge, method, path, body=b'', headers=()):
+        messages = [{'type': 'http.request', 'body': body[:3],
+                     'more_body': True},
+                    {'type': 'http.request', 'body': body[3:]}]
+        sent = []
+
+        async def receive():
+            return messages.pop(0)
+
+        async def send(message):
+            sent.append(message)
+
+        scope = {'type': 'http', 'http_version': '1.1', 'method': method,
+                 'path': path, 'query_string': b'', 'root_path': '',
+                 'headers': [(name.encode(), value.encode())
+                             for name, value in headers]}
+        asyncio.run(bridge(scope, receive, send))
+        self.assertFalse(sent[-1].get('more_body', False))
+        return sent[0]['status'], dict(sent[0]['headers']), \
+            b''.join(message['body'] for message in sent[1:])
+
+    def test_bridge_runs_views(self):
+        test_app = create_app(TestConfig)
+        with test_app.app_context():
+            db.create_all()
+        bridge = WsgiBridge(test_app, threads=2)
+        status, headers, body = self.request(bridge, 'GET', '/login')
+        self.assertEqual(status, 200)
+        self.assertEqual(headers[b'content-type'],
+                         b'text/html; charset=utf-8')
+        self.assertIn(b'name="username"', body)
+
+        status, headers, body = self.request(
+            bridge, 'POST', '/login', b'username=john&password=cat',
+            [('Content-Type', 'application/x-www-form-urlencoded'),
+             ('Content-Length', '26')])
+        self.assertEqual(status, 302)
+        self.assertTrue(headers[b'location'].endswith(b'/login'))
+
+        test_app.config['MAX_CONTENT_LENGTH'] = 10
+        status, headers, body = self.request(
+            bridge, 'POST', '/login', b'username=john&password=cat')
+        self.assertEqual(status, 413)
+        status, headers, body = self.request(
+            bridge, 'POST', '/login', b'', [('Content-Length', '26')])
+        self.assertEqual(status, 413)
+        bridge.executor.shutdown()
+        with test_app.app_context():
+            last_seen.flush()
+            db.drop_all()
 
+    def test_bridge_streams_responses(self):
+        def app(environ, start_response):
+            start_response('200 OK', [('Content-Type', 'text/plain')])
+            yield b'one'
+            yield b'two'
+
+        app.config = {'MAX_CONTENT_LENGTH': None}
+        bridge = WsgiBridge(app, threads=1)
+        sent = []
+
+        async def receive():
+            return {'type': 'http.request', 'body': b''}
+
+        async def send(message):
+            sent.append(message)
+
+        asyncio.run(bridge({'type': 'http', 'http_version': '1.1',
+                            'method': 'GET', 'path': '/', 'query_string': b'',
+                            'headers': []}, receive, send))
+        bridge.executor.shutdown()
+        self.assertEqual([(message.get('body'), message.get('more_body'))
+                          for message in sent[1:]],
+                         [(b'one', True), (b'two', True), (b'', None)])
+
+
+class I18nCase(unittest.TestCase):
+    def setUp(self):
+        self.app = create_app(TestConfig)
+
+    def test_negotiate(self):
+        languages = tuple(self.app.config['LANGUAGES'])
+        self.assertEqual(str(negotiate('zh-CN,zh;q=0.9', languages)),
+                         'zh_Hans')
+        self.assertEqual(str(negotiate('zh-tw', languages)), 'zh_Hant_TW')
+        self.assertEqual(str(negotiate('fr-FR,fr;q=0.9', languages)), 'en')
+        self.assertEqual(str(negotiate('', languages)), 'en')
+        self.assertIs(negotiate('zh-tw', languages),
+                      negotiate('zh-tw', languages))
+
+    def test_catalogs_loaded_once(self):
+        client = self.app.test_client()
+        with mock.patch('babel.support.Translations.load') as load:
+            response = client.get('/login',
+                                  headers={'Accept-Language': 'zh-TW'})
+        self.assertFalse(load.called)
+        self.assertIn('密碼', response.get_data(as_text=True))
+
+    def test_lazy_string_per_locale(self):
+        password = lazy_gettext('Password')
+        for header, text in (('zh-CN', '密码'), ('zh-TW', '密碼'),
+                             ('en', 'Password'), ('zh-CN', '密码')):
+            with self.app.test_request_context(
+                    headers={'Accept-Language': header}):
+                self.app.preprocess_request()
+                self.assertEqual(str(password), text)
+        self.assertEqual(len(password._translated), 3)
+        self.assertEqual(str(password), 'Password')
+
+
+class UserModelCase(AppCase):
     def test_password_hashing(self):
         u = User(username='susan')
         u.set_password('cat')
         self.assertFalse(u.check_password('dog'))
         self.assertTrue(u.check_password('cat'))
+        self.assertFalse(u.password_needs_rehash())
+
+    def test_password_rehash_policy(self):
+        u = User(username='susan')
+        iterations = self.app.config['PASSWORD_HASH_ITERATIONS']
+        try:
+            self.app.config['PASSWORD_HASH_ITERATIONS'] = 1000
+            u.set_password('cat')
+        finally:
+            self.app.config['PASSWORD_HASH_ITERATIONS'] = iterations
+        self.assertTrue(u.password_hash.startswith('pbkdf2:sha256:1000$'))
+        self.assertTrue(u.check_password('cat'))
+        self.assertTrue(u.password_needs_rehash())
+
+    def test_password_policy_must_fit_column(self):
+        class Sha512Config(TestConfig):
+            PASSWORD_HASH_ALGORITHM = 'sha512'
+
+        class LongSaltConfig(Sha512Config):
+            PASSWORD_SALT_LENGTH = 120
+
+        class UnknownConfig(TestConfig):
+            PASSWORD_HASH_ALGORITHM = 'rot13'
+
+        with create_app(Sha512Config).app_context():
+            self.assertEqual(len(hasher.hash('cat')), 158)
+        self.assertRaises(ValueError, create_app, LongSaltConfig)
+        self.assertRaises(ValueError, create_app, UnknownConfig)
 
     def test_avatar(self):
         u = User(username='john', email='john@example.com')
         self.assertEqual(u.avatar(128), ('https://www.gravatar.com/avatar/'
                                          'd4c74594d841139328695756648b6bd6'
                                          '?d=identicon&s=128'))
+        self.assertEqual(u.avatar_hash, 'd4c74594d841139328695756648b6bd6')
+        u.email = 'susan@example.com'
+        self.assertNotEqual(u.avatar_hash, 'd4c74594d841139328695756648b6bd6')
 
     def test_follow(self):
         u1 = User(username='john', email='john@example.com')
@@ -41,12 +291,20 @@ class UserModelCase(unittest.TestCase):
         self.assertEqual(u1.followed.first().username, 'susan')
         self.assertEqual(u2.followers.count(), 1)
         self.assertEqual(u2.followers.first().username, 'john')
+        self.assertEqual(u1.following_count, 1)
+        self.assertEqual(u1.followers_count, 0)
+        self.assertEqual(u2.followers_count, 1)
+        u1.follow(u2)
+        db.session.commit()
+        self.assertEqual(u1.following_count, 1)
 
         u1.unfollow(u2)
         db.session.commit()
         self.assertFalse(u1.is_following(u2))
         self.assertEqual(u1.followed.count(), 0)
         self.assertEqual(u2.followers.count(), 0)
+        self.assertEqual(u1.following_count, 0)
+        self.assertEqual(u2.followers_count, 0)
 
     def test_follow_posts(self):
         # create four users
@@ -90,6 +348,1210 @@ class UserModelCase(unittest.TestCase):
         self.assertEqual(f3, [p3, p4])
         self.assertEqual(f4, [p4])
 
+    def test_timeline_unfollow_and_delete(self):
+        u1 = User(username='john', email='john@example.com')
+        u2 = User(username='susan', email='susan@example.com')
+        p1 = Post(body="post from susan", author=u2)
+        db.session.add_all([u1, u2, p1])
+        db.session.commit()
+
+        u1.follow(u2)
+        db.session.commit()
+        self.assertEqual(u1.followed_posts().all(), [p1])
+
+        p2 = Post(body="another post from susan", author=u2)
+        db.session.add(p2)
+        db.session.commit()
+        self.assertEqual(len(u1.followed_posts().all()), 2)
+
+        db.session.delete(p2)
+        db.session.commit()
+        self.assertEqual(u1.followed_posts().all(), [p1])
+
+        u1.unfollow(u2)
+        db.session.commit()
+        self.assertEqual(u1.followed_posts().all(), [])
+        self.assertEqual(u2.followed_posts().all(), [p1])
+
+    def test_timeline_follow_copies_every_post(self):
+        u1 = User(username='john', email='john@example.com')
+        u2 = User(username='susan', email='susan@example.com')
+        now = datetime.utcnow()
+        posts = [Post(body=f'post {i} from susan', author=u2,
+                      timestamp=now - timedelta(days=i)) for i in range(6)]
+        db.session.add_all([u1, u2] + posts)
+        db.session.commit()
+
+        u1.follow(u2)
+        db.session.commit()
+        self.assertEqual(u1.followed_posts().all(), posts)
+
+    def test_timeline_celebrity_pulled_at_read(self):
+        limit = self.app.config['TIMELINE_FANOUT_LIMIT']
+        self.app.config['TIMELINE_FANOUT_LIMIT'] = 1
+        try:
+            u1 = User(username='john', email='john@example.com')
+            u2 = User(username='susan', email='susan@example.com')
+            u3 = User(username='mary', email='mary@example.com')
+            db.session.add_all([u1, u2, u3])
+            db.session.commit()
+            u1.follow(u3)
+            u2.follow(u3)
+            db.session.commit()
+
+            p = Post(body="post from mary", author=u3)
+            db.session.add(p)
+            db.session.commit()
+            self.assertTrue(u3.celebrity)
+            rows = db.session.execute(timeline.select()).fetchall()
+            self.assertEqual([(r.user_id, r.post_id) for r in rows],
+                             [(u3.id, p.id)])
+            self.assertEqual(u1.followed_posts().all(), [p])
+            self.assertEqual(u2.followed_posts().all(), [p])
+        finally:
+            self.app.config['TIMELINE_FANOUT_LIMIT'] = limit
+
+    def test_timeline_pages_limit_each_branch(self):
+        u1 = User(username='john', email='john@example.com')
+        u2 = User(username='susan', email='susan@example.com')
+        u3 = User(username='mary', email='mary@example.com', celebrity=True)
+        db.session.add_all([u1, u2, u3])
+        db.session.commit()
+        u1.follow(u2)
+        u1.follow(u3)
+        db.session.commit()
+        now = datetime.utcnow()
+        db.session.add_all([Post(title=f'post {i}', author=(u2, u3)[i % 2],
+                                 timestamp=now + timedelta(seconds=i))
+                            for i in range(6)])
+        db.session.commit()
+
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(db.engine, 'before_cursor_execute',
+                     before_cursor_execute)
+        try:
+            first = KeysetPagination(u1.followed_posts(), 2)
+            second = KeysetPagination(u1.followed_posts(), 2,
+                                      before=first.next_args['before'])
+            back = KeysetPagination(u1.followed_posts(), 2,
+                                    after=second.prev_args['after'])
+        finally:
+            event.remove(db.engine, 'before_cursor_execute',
+                         before_cursor_execute)
+        self.assertEqual([p.title for p in first.items], ['post 5', 'post 4'])
+        self.assertEqual([p.title for p in second.items],
+                         ['post 3', 'post 2'])
+        self.assertEqual(back.items, first.items)
+        self.assertFalse(back.has_prev)
+        # Both branches of the UNION and the UNION itself read one page.
+        pages = [statement for statement in statements
+                 if 'UNION' in statement]
+        self.assertEqual(len(pages), 3)
+        for statement in pages:
+            self.assertEqual(statement.count('LIMIT'), 3)
+        self.assertIn('ORDER BY timeline.timestamp DESC', pages[0])
+
+    def test_last_seen_is_coalesced(self):
+        u = User(username='john', email='john@example.com')
+        db.session.add(u)
+        db.session.commit()
+        then = datetime(2019, 7, 1)
+        self.assertTrue(last_seen.touch(u.id, then))
+        self.assertFalse(last_seen.touch(u.id, then + timedelta(seconds=1)))
+        self.assertEqual(last_seen.flush(), 1)
+        self.assertEqual(last_seen.flush(), 0)
+        db.session.expire(u)
+        self.assertEqual(u.last_seen, then)
+
+    def test_keyset_pagination(self):
+        u = User(username='john', email='john@example.com')
+        now = datetime.utcnow()
+        posts = [Post(body=f'post {i}', author=u,
+                      timestamp=now + timedelta(seconds=i // 2))
+                 for i in range(5)]
+        db.session.add_all([u] + posts)
+        db.session.commit()
+        newest_first = sorted(posts, key=lambda p: (p.timestamp, p.id),
+                              reverse=True)
+
+        page1 = KeysetPagination(Post.query, 2)
+        self.assertEqual(page1.items, newest_first[:2])
+        self.assertFalse(page1.has_prev)
+        self.assertTrue(page1.has_next)
+
+        page2 = KeysetPagination(Post.query, 2,
+                                 before=page1.next_args['before'])
+        self.assertEqual(page2.items, newest_first[2:4])
+        self.assertTrue(page2.has_prev)
+        self.assertTrue(page2.has_next)
+
+        page3 = KeysetPagination(Post.query, 2,
+                                 before=page2.next_args['before'])
+        self.assertEqual(page3.items, newest_first[4:])
+        self.assertFalse(page3.has_next)
+
+        back = KeysetPagination(Post.query, 2,
+                                after=page3.prev_args['after'])
+        self.assertEqual(back.items, page2.items)
+        self.assertTrue(back.has_prev)
+
+        bogus = KeysetPagination(Post.query, 2, before='not-a-cursor')
+        self.assertEqual(bogus.items, page1.items)
+
+
+class RenderCase(AppCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        limiter.reset()
+        self.client = self.app.test_client()
+
+    def login(self, username, password):
+        return self.client.post('/login', data={'username': username,
+                                                'password': password})
+
+    def count_queries(self, url):
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(db.engine, 'before_cursor_execute',
+                     before_cursor_execute)
+        try:
+            self.assertEqual(self.client.get(url).status_code, 200)
+        finally:
+            event.remove(db.engine, 'before_cursor_execute',
+                         before_cursor_execute)
+        return len(statements)
+
+    def test_post_list_query_count_is_constant(self):
+        u = User(username='john', email='john@example.com')
+        u.set_password('cat')
+        authors = [User(username=f'author{i}', email=f'author{i}@example.com')
+                   for i in range(8)]
+        posts = [Post(title=f'post {i}', body='body', author=author)
+                 for i, author in enumerate(authors)]
+        db.session.add_all([u] + authors + posts)
+        db.session.commit()
+        self.login('john', 'cat')
+
+        per_page = self.app.config['POSTS_PER_PAGE']
+        try:
+            self.app.config['POSTS_PER_PAGE'] = 2
+            few = self.count_queries('/explore')
+            # The last page also looks up the archive, so stop short of it.
+            self.app.config['POSTS_PER_PAGE'] = 7
+            many = self.count_queries('/explore')
+        finally:
+            self.app.config['POSTS_PER_PAGE'] = per_page
+        self.assertEqual(few, many)
+
+    def test_login_upgrades_outdated_hash(self):
+        u = User(username='john', email='john@example.com')
+        iterations = self.app.config['PASSWORD_HASH_ITERATIONS']
+        try:
+            self.app.config['PASSWORD_HASH_ITERATIONS'] = 1000
+            u.set_password('cat')
+        finally:
+            self.app.config['PASSWORD_HASH_ITERATIONS'] = iterations
+        db.session.add(u)
+        db.session.commit()
+
+        self.login('john', 'dog')
+        self.assertTrue(User.query.one().password_needs_rehash())
+        self.login('john', 'cat')
+        u = User.query.one()
+        self.assertFalse(u.password_needs_rehash())
+        self.assertTrue(u.check_password('cat'))
+
+    def test_login_rate_limited_per_account(self):
+        for i in range(5):
+            self.assertEqual(self.login('john', 'dog').status_code, 302)
+        response = self.login('John ', 'dog')
+        self.assertEqual(response.status_code, 429)
+        self.assertGreater(int(response.headers['Retry-After']), 0)
+        self.assertEqual(self.login('susan', 'dog').status_code, 302)
+
+    def test_session_user_cached(self):
+        u = User(username='john', email='john@example.com', about_me='hi')
+        u.set_password('cat')
+        db.session.add(u)
+        db.session.commit()
+        self.login('john', 'cat')
+        self.client.get('/edit_profile')
+
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(db.engine, 'before_cursor_execute',
+                     before_cursor_execute)
+        try:
+            response = self.client.get('/edit_profile')
+        finally:
+            event.remove(db.engine, 'before_cursor_execute',
+                         before_cursor_execute)
+        self.assertIn(b'value="john"', response.data)
+        self.assertEqual(statements, [])
+
+        self.client.post('/edit_profile', data={'username': 'johnny',
+                                                'about_me': 'hello'})
+        response = self.client.get('/edit_profile')
+        self.assertIn(b'value="johnny"', response.data)
+        self.assertIn(b'hello', response.data)
+
+        snapshot = user_cache.get(u.id)
+        self.assertIsInstance(snapshot, SessionUser)
+        self.assertEqual(snapshot.avatar(36), u.avatar(36))
+        self.assertIs(snapshot.load(), u)
+        u.set_password('dog')
+        db.session.commit()
+        self.assertIsNone(user_cache.backend.get(u.id))
+
+    def test_cached_pages_invalidated_on_write(self):
+        u = User(username='john', email='john@example.com')
+        u.set_password('cat')
+        db.session.add_all([u, Post(title='first post', author=u)])
+        db.session.commit()
+        self.login('john', 'cat')
+
+        self.assertIn(b'first post', self.client.get('/explore').data)
+        warm = self.count_queries('/explore')
+        cache.clear()
+        self.assertLess(warm, self.count_queries('/explore'))
+
+        db.session.add(Post(title='second post', author=u))
+        db.session.commit()
+        for url in ('/explore', '/user/john'):
+            self.assertIn(b'second post', self.client.get(url).data)
+
+
+class ApiCase(AppCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        limiter.reset()
+        self.john = User(username='john', email='john@example.com')
+        self.susan = User(username='susan', email='susan@example.com')
+        for u in (self.john, self.susan):
+            u.set_password('cat')
+        now = datetime.utcnow()
+        self.posts = [Post(title=f'post {i}', body='body', author=self.susan,
+                           timestamp=now + timedelta(seconds=i))
+                      for i in range(5)]
+        db.session.add_all([self.john, self.susan] + self.posts)
+        db.session.commit()
+        self.john.follow(self.susan)
+        db.session.commit()
+        self.susan_post = '/api/v1/posts/{}'.format(self.posts[0].id)
+        self.client = self.app.test_client()
+        self.client.post('/login', data={'username': 'john',
+                                         'password': 'cat'})
+
+    def test_timeline_pages(self):
+        titles = []
+        url = '/api/v1/timeline?limit=2'
+        while url:
+            data = self.client.get(url).get_json()
+            titles.extend(post['title'] for post in data['items'])
+            url = data['next']
+        self.assertEqual(titles, [f'post {i}' for i in reversed(range(5))])
+        self.assertEqual(
+            self.client.get('/api/v1/posts?limit=1').get_json()['items'][0]
+            ['author']['username'], 'susan')
+
+    def test_profile_and_followers(self):
+        profile = self.client.get('/api/v1/users/susan').get_json()
+        self.assertEqual(profile['followers_count'], 1)
+        followers = self.client.get(profile['followers']).get_json()
+        self.assertEqual([u['username'] for u in followers['items']],
+                         ['john'])
+        following = self.client.get('/api/v1/users/susan/following')
+        self.assertEqual(following.get_json()['items'], [])
+        self.assertEqual(self.client.get('/api/v1/users/bob').status_code,
+                         404)
+
+    def test_conditional_get(self):
+        response = self.client.get('/api/v1/users/susan/posts')
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNotNone(response.last_modified)
+        etag = response.headers['ETag']
+
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(db.engine, 'before_cursor_execute',
+                     before_cursor_execute)
+        try:
+            response = self.client.get('/api/v1/users/susan/posts',
+                                       headers={'If-None-Match': etag})
+        finally:
+            event.remove(db.engine, 'before_cursor_execute',
+                         before_cursor_execute)
+        self.assertEqual(response.status_code, 304)
+        self.assertFalse([s for s in statements if 'post' in s])
+
+        db.session.add(Post(title='new', author=self.susan,
+                            timestamp=datetime.utcnow() + timedelta(1)))
+        db.session.commit()
+        response = self.client.get('/api/v1/users/susan/posts',
+                                   headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()['items'][0]['title'], 'new')
+
+    def test_post_crud(self):
+        response = self.client.post('/api/v1/posts',
+                                    json={'title': 'hello', 'body': 'world'})
+        self.assertEqual(response.status_code, 201)
+        location = response.headers['Location']
+        self.assertEqual(self.client.get(location).get_json()['title'],
+                         'hello')
+
+        response = self.client.put(location, json={'title': ''})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('title', response.get_json()['messages'])
+        response = self.client.put(location, json={'title': 'hi'})
+        self.assertEqual(response.get_json()['title'], 'hi')
+        self.assertEqual(self.client.post('/api/v1/posts', data={
+            'title': 'form'}).status_code, 415)
+        self.assertEqual(self.client.delete(self.susan_post).status_code,
+                         403)
+
+        self.assertEqual(self.client.delete(location).status_code, 204)
+        self.assertEqual(self.client.get(location).status_code, 404)
+        self.client.get('/logout')
+        response = self.client.get('/api/v1/timeline')
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response.get_json()['error'], 'Unauthorized')
+
+    def test_archived_posts(self):
+        self.assertEqual(list(archive_posts(self.posts[3].timestamp, 2)),
+                         [2, 3])
+        self.assertEqual(Post.query.count(), 2)
+        for url in ('/api/v1/timeline?limit=2', '/api/v1/posts?limit=2',
+                    '/api/v1/users/susan/posts?limit=2'):
+            titles = []
+            while url:
+                data = self.client.get(url).get_json()
+                titles.extend(post['title'] for post in data['items'])
+                url = data['next']
+            self.assertEqual(titles,
+                             [f'post {i}' for i in reversed(range(5))])
+        self.assertEqual(self.client.get(self.susan_post).get_json()
+                         ['author']['username'], 'susan')
+        self.assertEqual(self.client.put(self.susan_post, json={
+            'title': 'edited'}).status_code, 404)
+
+        page = KeysetPagination(Post.query, 3, scope=archive.everyone)
+        self.assertEqual([post.title for post in page.items],
+                         ['post 4', 'post 3', 'post 2'])
+        self.assertEqual([post.archived for post in page.items],
+                         [False, False, True])
+        self.assertTrue(page.has_next)
+        older = KeysetPagination(Post.query, 3, scope=archive.everyone,
+                                 before=page.next_args['before'])
+        self.assertEqual([post.title for post in older.items],
+                         ['post 1', 'post 0'])
+        self.assertFalse(older.has_next)
+        newer = KeysetPagination(Post.query, 3, scope=archive.everyone,
+                                 after=older.prev_args['after'])
+        self.assertEqual([post.title for post in newer.items],
+                         ['post 4', 'post 3', 'post 2'])
+        self.assertFalse(newer.has_prev)
+        response = self.client.get('/user/susan')
+        self.assertIn(b'post 1', response.data)
+        before = re.search(r'before=([\w-]+)',
+                           response.get_data(as_text=True)).group(1)
+        response = self.client.get('/user/susan?before=' + before)
+        self.assertIn(b'post 0', response.data)
+
+    def test_archive_from_another_process(self):
+        self.client.get('/api/v1/posts?limit=2')
+        with self.app.test_request_context('/explore'):
+            snapshot = PageSnapshot(KeysetPagination(Post.query, 5))
+        # The archive command's cache invalidation stays in its process.
+        with mock.patch.object(cache, 'invalidate'):
+            list(archive_posts(self.posts[3].timestamp))
+        self.assertEqual(self.client.get(self.susan_post).get_json()
+                         ['title'], 'post 0')
+        self.assertEqual([post.title for post in snapshot.load()],
+                         [f'post {i}' for i in reversed(range(5))])
+        page = KeysetPagination(Post.query, 3, scope=archive.everyone,
+                                before=KeysetPagination(
+                                    Post.query, 2).next_args['before'])
+        self.assertEqual([post.title for post in page.items],
+                         ['post 2', 'post 1', 'post 0'])
+
+    def test_archived_ids_are_not_reused(self):
+        list(archive_posts(self.posts[4].timestamp))
+        db.session.delete(Post.query.get(self.posts[4].id))
+        db.session.commit()
+        self.assertEqual(Post.query.count(), 0)
+        response = self.client.post('/api/v1/posts',
+                                    json={'title': 'new', 'body': ''})
+        new_id = response.get_json()['id']
+        self.assertGreater(new_id, self.posts[4].id)
+        self.assertEqual(archive.find([new_id]), [])
+        self.assertEqual(self.client.get(f'/api/v1/posts/{new_id}')
+                         .get_json()['title'], 'new')
+        self.assertEqual(self.client.get(self.susan_post)
+                         .get_json()['title'], 'post 0')
+
+
+class TokenCase(AppCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User(username='john', email='john@example.com')
+        self.user.set_password('cat')
+        db.session.add(self.user)
+        db.session.commit()
+
+    def test_key_rotation(self):
+        keys = self.app.config['TOKEN_KEYS']
+        self.app.config['TOKEN_KEYS'] = {'old': 'secret1'}
+        old = self.user.get_reset_password_token()
+        self.app.config['TOKEN_KEYS'] = {'new': 'secret2', 'old': 'secret1'}
+        new = self.user.get_reset_password_token()
+        tokens.verified.clear()
+        try:
+            self.assertEqual(User.verify_reset_password_token(old),
+                             self.user)
+            self.assertEqual(User.verify_reset_password_token(new),
+                             self.user)
+            # Dropping a key revokes its tokens even while they are cached.
+            self.app.config['TOKEN_KEYS'] = {'new': 'secret2'}
+            self.assertIsNone(User.verify_reset_password_token(old))
+            self.assertEqual(User.verify_reset_password_token(new),
+                             self.user)
+            self.app.config['TOKEN_KEYS'] = {'new': 'secret3'}
+            self.assertIsNone(User.verify_reset_password_token(new))
+        finally:
+            self.app.config['TOKEN_KEYS'] = keys
+
+    def test_rejects_bad_tokens(self):
+        token = self.user.get_reset_password_token()
+        expired = self.user.get_reset_password_token(expires_in=-1)
+        header, payload, signature = token.split('.')
+        forged = '.'.join([header, payload, signature[::-1]])
+        for bad in (expired, forged, token[:-1] + '*', token + '.x',
+                    'a' * 2000, '', None):
+            self.assertIsNone(tokens.verify(bad, 'reset_password'))
+        self.assertIsNone(tokens.verify(token, 'confirm_email'))
+
+    def test_malformed_tokens_skip_crypto(self):
+        with mock.patch('jwt.decode') as decode:
+            for bad in ('not a token', 'a.b', 'a.b.c.d', 'a' * 2000):
+                self.assertIsNone(tokens.verify(bad, 'reset_password'))
+            self.assertIsNone(tokens.verify(
+                'eyJ0eXAiOiJKV1QiLCJhbGciOiJIUzI1NiIsImtpZCI6Im5vbmUifQ.e30.x',
+                'reset_password'))
+        decode.assert_not_called()
+
+    def test_verified_tokens_cached(self):
+        token = self.user.get_reset_password_token()
+        self.assertEqual(tokens.verify(token, 'reset_password'),
+                         self.user.id)
+        with mock.patch('jwt.decode') as decode:
+            self.assertEqual(tokens.verify(token, 'reset_password'),
+                             self.user.id)
+        decode.assert_not_called()
+
+    def test_reset_token_single_use(self):
+        client = self.app.test_client()
+        token = self.user.get_reset_password_token()
+        url = f'/reset_password/{token}'
+        self.assertEqual(client.get(url).status_code, 200)
+        response = client.post(url, data={'password': 'dog',
+                                          'password2': 'dog'})
+        self.assertTrue(response.location.endswith('/login'))
+        self.assertTrue(User.query.get(self.user.id).check_password('dog'))
+        self.assertEqual(UsedToken.query.count(), 1)
+        for response in (client.get(url),
+                         client.post(url, data={'password': 'eel',
+                                                'password2': 'eel'})):
+            self.assertTrue(response.location.endswith('/index'))
+        self.assertTrue(User.query.get(self.user.id).check_password('dog'))
+
+        # Rows of expired tokens go when the next token is used.
+        UsedToken.query.update({'expires_at': datetime(2000, 1, 1)})
+        tokens.consume(self.user.get_reset_password_token())
+        db.session.commit()
+        self.assertEqual(UsedToken.query.count(), 1)
+
+
+class SearchCase(AppCase):
+    def setUp(self):
+        super().setUp()
+        u = User(username='john', email='john@example.com')
+        self.posts = [
+            Post(title='python tips', body='use a virtualenv', author=u),
+            Post(title='gardening', body='python snakes in the garden',
+                 author=u),
+            Post(title='cooking', body='nothing to see here', author=u),
+        ]
+        db.session.add_all([u] + self.posts)
+        db.session.commit()
+
+    def check_backend(self):
+        python, garden, cooking = self.posts
+        page = SearchPage('Python', 10)
+        self.assertEqual(page.items, [python, garden])
+        self.assertEqual(SearchPage('python garden', 10).items, [garden])
+        self.assertEqual(SearchPage('missing', 10).items, [])
+
+        first = SearchPage('python', 1)
+        self.assertTrue(first.has_next)
+        second = SearchPage('python', 1, first.next_args['cursor'])
+        self.assertEqual(first.items + second.items, [python, garden])
+        self.assertFalse(second.has_next)
+
+        cooking.body = 'python for dinner'
+        db.session.delete(garden)
+        db.session.commit()
+        self.assertEqual(set(SearchPage('python', 10).items),
+                         {python, cooking})
+
+    def test_default_backend(self):
+        self.check_backend()
+
+    def test_postings_backend(self):
+        self.app.config['SEARCH_BACKEND'] = 'postings'
+        self.assertEqual(list(reindex(2)), [2, 3])
+        # As on servers, deleting a post must not leave postings behind.
+        db.session.commit()
+        db.engine.execute('PRAGMA foreign_keys = ON')
+        self.check_backend()
+
+
+class DatabaseCase(AppCase):
+    def test_sqlite_pragmas(self):
+        self.assertEqual(
+            db.session.execute('PRAGMA busy_timeout').scalar(),
+            self.app.config['SQLITE_PRAGMAS']['busy_timeout'])
+
+    def test_replica_reads(self):
+        view = db.replica(lambda: [p.title for p in Post.query])
+        u = User(username='john', email='john@example.com')
+        db.session.add(Post(title='primary', author=u))
+        db.session.commit()
+        with self.app.test_request_context('/explore'):
+            self.assertEqual(view(), ['primary'])
+
+        self.app.config['SQLALCHEMY_BINDS'] = {REPLICA: 'sqlite://'}
+        replica = db.get_engine(self.app, REPLICA)
+        db.Model.metadata.create_all(replica)
+        replica.execute(Post.__table__.insert(), title='replica')
+        with self.app.test_request_context('/explore'):
+            self.assertEqual(view(), ['replica'])
+            db.session.info['use_replica'] = True
+            db.session.add(Post(title='written', author=u))
+            db.session.commit()
+            db.session.info.pop('use_replica')
+        with self.app.test_request_context('/explore', method='POST'):
+            self.assertEqual(view(), ['primary', 'written'])
+
+
+class TransferCase(AppCase):
+    def setUp(self):
+        super().setUp()
+        u1 = User(username='john', email='john@example.com', about_me='')
+        u2 = User(username='susan', email='susan@example.com')
+        db.session.add_all([u1, u2, Post(title='hi', body='', author=u2)])
+        db.session.commit()
+        u1.follow(u2)
+        db.session.commit()
+
+    def round_trip(self, fmt):
+        files = {}
+        months = [row.month for row in archive.months()]
+        with db.engine.connect() as connection:
+            for name, table, columns in transfer.tables(months):
+                files[name] = io.StringIO()
+                list(transfer.export_table(connection, table, columns,
+                                           files[name], fmt, 1))
+        db.session.remove()
+        db.drop_all()
+        archive.metadata.drop_all(db.engine)
+        db.create_all()
+        for name, table, columns in transfer.tables(months):
+            rows = list(transfer.read_rows(
+                io.StringIO(files[name].getvalue()), fmt, table, columns))
+            self.assertEqual(list(transfer.import_table(name, table, rows,
+                                                        1)),
+                             list(range(1, len(rows) + 1)))
+            # Importing again skips the rows that are already there.
+            list(transfer.import_table(name, table, rows, 1))
+        transfer.register_archive(months)
+        john = User.query.filter_by(username='john').one()
+        susan = User.query.filter_by(username='susan').one()
+        self.assertEqual(john.avatar_hash, email_digest('john@example.com'))
+        self.assertTrue(john.is_following(susan))
+        self.assertEqual([p.title for p in susan.posts], ['hi'])
+        self.assertEqual(Post.query.count(), 1)
+        # Empty strings and NULLs both survive.
+        self.assertEqual(john.about_me, '')
+        self.assertIsNone(susan.about_me)
+        self.assertEqual(susan.posts.one().body, '')
+
+    def test_ndjson(self):
+        self.round_trip('ndjson')
+
+    def test_csv(self):
+        self.round_trip('csv')
+
+    def test_archived_posts(self):
+        susan = User.query.filter_by(username='susan').one()
+        old = [Post(title=f'old {i}', body='', author=susan,
+                    timestamp=datetime(2020, 1 + i, 1)) for i in range(2)]
+        db.session.add_all(old)
+        db.session.commit()
+        ids = [post.id for post in old]
+        list(archive_posts(datetime(2021, 1, 1)))
+        self.round_trip('ndjson')
+        self.assertEqual([(row.month, row.min_id, row.max_id)
+                          for row in archive.months()],
+                         [('202001', ids[0], ids[0]),
+                          ('202002', ids[1], ids[1])])
+        self.assertEqual(sorted(post.title for post in archive.load(
+            archive.find(ids))), ['old 0', 'old 1'])
+        susan = User.query.filter_by(username='susan').one()
+        db.session.delete(Post.query.filter_by(title='hi').one())
+        post = Post(title='new', body='', author=susan)
+        db.session.add(post)
+        db.session.commit()
+        self.assertGreater(post.id, max(ids))
+
+    def test_exported_months(self):
+        with tempfile.TemporaryDirectory() as directory:
+            for name in ('post.csv', 'post_archive_202001.csv',
+                         'post_archive_201912.csv', 'post_archive_201911'
+                         '.ndjson', 'post_archive.csv'):
+                open(os.path.join(directory, name), 'w').close()
+            self.assertEqual(transfer.exported_months(directory, 'csv'),
+                             ['201912', '202001'])
+
+    def test_resume(self):
+        table = User.__table__
+        rows = [dict(id=i, username=f'user{i}', email=f'{i}@example.com',
+                     password_hash=None, about_me=None, last_seen=None)
+                for i in range(3, 8)]
+        self.assertEqual(list(transfer.import_table('user', table,
+                                                    iter(rows), 2, 3)),
+                         [5])
+        self.assertEqual(User.query.count(), 4)
+
+
+handled = []
+
+
+@jobs.subscribe('test.event')
+def record_event(value):
+    handled.append(value)
+    if value == 'fail':
+        raise ValueError('failed on purpose')
+
+
+class JobCase(AppCase):
+    def setUp(self):
+        super().setUp()
+        del handled[:]
+
+    def test_emit_is_transactional_and_idempotent(self):
+        jobs.emit('test.event', key='1', value='a')
+        db.session.rollback()
+        self.assertEqual(Job.query.count(), 0)
+        jobs.emit('test.event', key='1', value='a')
+        db.session.commit()
+        jobs.emit('test.event', key='1', value='a')
+        jobs.emit('missing.event', value='a')
+        db.session.commit()
+        self.assertEqual(Job.query.count(), 1)
+        self.assertEqual(jobs.run_pending(), 1)
+        self.assertEqual(jobs.run_pending(), 0)
+        self.assertEqual(handled, ['a'])
+
+    def test_expired_lease_is_delivered_again(self):
+        jobs.emit('test.event', value='a')
+        db.session.commit()
+        self.assertEqual(len(jobs.claim('dead-worker', 10)), 1)
+        self.assertEqual(jobs.run_pending(), 0)
+        job = Job.query.one()
+        job.locked_until = datetime.utcnow() - timedelta(seconds=1)
+        db.session.commit()
+        self.assertEqual(jobs.run_pending(), 1)
+        self.assertEqual(Job.query.one().attempts, 2)
+
+    def test_failures_back_off_then_dead_letter(self):
+        self.app.config['JOBS_MAX_ATTEMPTS'] = 2
+        jobs.emit('test.event', value='fail')
+        db.session.commit()
+        self.assertEqual(jobs.run_pending(), 0)
+        job = Job.query.one()
+        self.assertGreater(job.run_at, datetime.utcnow())
+        job.run_at = datetime.utcnow()
+        db.session.commit()
+        self.assertEqual(jobs.run_pending(), 0)
+        self.assertEqual(Job.query.count(), 0)
+        dead = DeadJob.query.one()
+        self.assertEqual(dead.attempts, 2)
+        self.assertIn('failed on purpose', dead.last_error)
+
+        jobs.retry(dead)
+        db.session.commit()
+        self.assertEqual(DeadJob.query.count(), 0)
+        self.assertEqual(Job.query.one().attempts, 0)
+
+    def test_async_timeline(self):
+        self.app.config['TIMELINE_ASYNC'] = True
+        john = User(username='john', email='john@example.com')
+        susan = User(username='susan', email='susan@example.com')
+        db.session.add_all([john, susan])
+        db.session.commit()
+        john.follow(susan)
+        jobs.emit('user.followed', follower_id=john.id, followed_id=susan.id)
+        post = Post(title='hello', author=susan)
+        db.session.add(post)
+        db.session.flush()
+        jobs.emit('post.created', key=str(post.id), post_id=post.id)
+        db.session.commit()
+        self.assertEqual(john.followed_posts().all(), [])
+        version = cache.version
+        jobs.work(threads=1, once=True)
+        self.assertEqual(john.followed_posts().all(), [post])
+        # The timeline rows are written with Core, so the jobs bump the
+        # cache generation themselves.
+        self.assertNotEqual(cache.version, version)
+        self.assertEqual(jobs.run_pending(), 0)
+
+    def test_views_emit_events(self):
+        self.app.config['TIMELINE_ASYNC'] = True
+        john = User(username='john', email='john@example.com')
+        john.set_password('cat')
+        db.session.add_all([john, User(username='susan',
+                                       email='susan@example.com')])
+        db.session.commit()
+        client = self.app.test_client()
+        client.post('/login', data={'username': 'john', 'password': 'cat'})
+        client.get('/follow/susan')
+        client.post('/create_post', data={'title': 'hello', 'body': ''})
+        self.assertEqual(
+            sorted(name.rsplit('.', 1)[1] for name, in
+                   db.session.query(Job.name)),
+            ['backfill_author', 'fan_out_post'])
+        self.assertEqual(jobs.run_pending(), 2)
+
+
+class RecommendCase(AppCase):
+    def setUp(self):
+        super().setUp()
+        self.users = [User(username=name, email=f'{name}@example.com')
+                      for name in ('ann', 'bob', 'cat', 'dan', 'eve')]
+        self.users[0].set_password('cat')
+        db.session.add_all(self.users)
+        db.session.commit()
+        ann, bob, cat, dan, eve = self.users
+        for follower, followed in ((ann, bob), (ann, cat), (bob, dan),
+                                   (bob, eve), (cat, dan), (cat, eve),
+                                   (dan, ann)):
+            follower.follow(followed)
+        db.session.add(Post(title='hi', body='', author=dan))
+        db.session.commit()
+
+    def suggested(self, user):
+        return [u.username for u in recommend.suggestions_for(user.id)]
+
+    def test_graph_and_rebuild(self):
+        ann, bob, cat, dan, eve = self.users
+        graph = recommend.FollowGraph.load(db.session.connection())
+        self.assertEqual(list(graph.following(bob.id)), [dan.id, eve.id])
+        self.assertEqual(list(graph.following(eve.id)), [])
+        self.assertEqual(graph.nbytes, (5 + 2 + 7) * 4)
+        self.assertEqual(list(recommend.rebuild(batch_size=2)), [2, 4, 5])
+        # Both followed by two of ann's follows; dan has posted recently.
+        self.assertEqual(self.suggested(ann), ['dan', 'eve'])
+        self.assertEqual(self.suggested(dan), ['bob', 'cat'])
+        self.assertEqual(self.suggested(eve), [])
+
+    def test_follow_refreshes_and_pages_show_suggestions(self):
+        ann = self.users[0]
+        client = self.app.test_client()
+        client.post('/login', data={'username': 'ann', 'password': 'cat'})
+        self.assertEqual(self.suggested(ann), [])
+        client.get('/follow/dan')
+        self.assertEqual(self.suggested(ann), ['eve'])
+        self.assertIn(b'Who to follow', client.get('/index').data)
+        self.assertIn(b'/follow/eve', client.get('/user/ann').data)
+        self.assertNotIn(b'Who to follow', client.get('/user/bob').data)
+        client.get('/unfollow/dan')
+        self.assertEqual(self.suggested(ann), ['dan', 'eve'])
+
+    def test_follow_queues_refresh(self):
+        self.app.config['RECOMMEND_ASYNC'] = True
+        ann = self.users[0]
+        client = self.app.test_client()
+        client.post('/login', data={'username': 'ann', 'password': 'cat'})
+        client.get('/follow/dan')
+        self.assertEqual(self.suggested(ann), [])
+        self.assertEqual(jobs.run_pending(), 1)
+        self.assertEqual(self.suggested(ann), ['eve'])
+
+
+class GroupConfig(TestConfig):
+    GROUP_COMMIT = True
+
+
+class GroupCommitCase(AppCase):
+    config = GroupConfig
+
+    def setUp(self):
+        super().setUp()
+        self.john = User(username='john', email='john@example.com')
+        self.susan = User(username='susan', email='susan@example.com')
+        self.john.set_password('cat')
+        db.session.add_all([self.john, self.susan])
+        db.session.commit()
+
+    def tearDown(self):
+        group_commit.stop()
+        super().tearDown()
+
+    def test_views_commit_through_committer(self):
+        client = self.app.test_client()
+        client.post('/login', data={'username': 'john', 'password': 'cat'})
+        client.post('/create_post', data={'title': 'hello', 'body': 'world'})
+        client.get('/follow/susan')
+        self.assertEqual(Post.query.one().title, 'hello')
+        self.assertTrue(User.query.get(self.john.id).is_following(
+            User.query.get(self.susan.id)))
+        self.assertEqual(group_commit.committer._thread.name,
+                         'group-commit')
+
+    def test_failed_write_only_fails_its_caller(self):
+        def fail():
+            db.session.add(User(username='john'))
+
+        group = [(Future(), add_post, (self.john.id, 'first', '')),
+                 (Future(), fail, ()),
+                 (Future(), add_post, (self.susan.id, 'second', ''))]
+        group_commit.commit(group)
+        self.assertEqual(Post.query.get(group[0][0].result()).title, 'first')
+        self.assertIsInstance(group[1][0].exception(), IntegrityError)
+        self.assertEqual(Post.query.get(group[2][0].result()).title,
+                         'second')
+        with self.assertRaises(IntegrityError):
+            group_commit.run(fail)
+        self.assertEqual(group_commit.run(add_follow, self.john.id,
+                                          self.susan.id), None)
+        self.assertEqual(User.query.get(self.susan.id).followers_count, 1)
+
+
+class SMTPSinkHandler(socketserver.StreamRequestHandler):
+    def reply(self, line):
+        self.wfile.write(line.encode('ascii') + b'\r\n')
+
+    def handle(self):
+        self.server.connections += 1
+        self.reply('220 localhost SMTP sink')
+        for line in self.rfile:
+            command = line.decode('ascii').strip().upper()
+            if command == 'DATA':
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                data = []
+                for line in self.rfile:
+                    if line == b'.\r\n':
+                        break
+                    data.append(line)
+                self.server.messages.append(b''.join(data))
+                self.reply('250 OK')
+            elif command == 'QUIT':
+                self.reply('221 Bye')
+                return
+            else:
+                self.reply('250 OK')
+
+
+class SMTPSink(socketserver.ThreadingTCPServer):
+    """Local debugging SMTP server that records what it receives."""
+    daemon_threads = True
+
+    def __init__(self):
+        super(SMTPSink, self).__init__(('localhost', 0), SMTPSinkHandler)
+        self.connections = 0
+        self.messages = []
+
+
+class MailCase(AppCase):
+    def setUp(self):
+        super().setUp()
+        self.sink = SMTPSink()
+        threading.Thread(target=self.sink.serve_forever, daemon=True).start()
+        self.state = self.app.extensions['mail']
+        self.saved = (self.state.server, self.state.port,
+                      self.state.suppress)
+        self.state.server, self.state.port = self.sink.server_address
+        self.state.suppress = False
+
+    def tearDown(self):
+        self.state.server, self.state.port, self.state.suppress = self.saved
+        self.sink.shutdown()
+        self.sink.server_close()
+        super().tearDown()
+
+    def test_batch_shares_one_connection(self):
+        for i in range(3):
+            send_email(f'subject {i}', 'admin@example.com',
+                       ['john@example.com'], 'text', '<p>html</p>')
+        self.assertEqual(dispatcher.send_pending(), 3)
+        self.assertEqual(self.sink.connections, 1)
+        self.assertEqual(len(self.sink.messages), 3)
+        self.assertEqual(Outbox.query.filter(
+            Outbox.sent_at.is_(None)).count(), 0)
+        self.assertEqual(dispatcher.sweep(), 0)
+
+    def test_failed_send_is_retried_later(self):
+        self.state.port = 1
+        send_email('subject', 'admin@example.com', ['john@example.com'],
+                   'text', '<p>html</p>')
+        self.assertEqual(dispatcher.send_pending(), 0)
+        msg = Outbox.query.one()
+        self.assertEqual(msg.attempts, 1)
+        self.assertIsNone(msg.sent_at)
+        self.assertGreater(msg.next_attempt_at, datetime.utcnow())
+        self.assertEqual(dispatcher.sweep(), 0)
+
+        msg.next_attempt_at = datetime.utcnow()
+        db.session.commit()
+        self.state.port = self.sink.server_address[1]
+        self.assertEqual(dispatcher.sweep(), 1)
+        self.assertEqual(dispatcher.send_pending(), 1)
+        self.assertEqual(len(self.sink.messages), 1)
+
+    def test_dropped_connection_counts_one_attempt(self):
+        for i in range(2):
+            send_email(f'subject {i}', 'admin@example.com',
+                       ['john@example.com'], 'text', '<p>html</p>')
+        connection = mock.MagicMock()
+        connection.__enter__.return_value.send.side_effect = \
+            smtplib.SMTPServerDisconnected('gone')
+        connection.__exit__.side_effect = \
+            smtplib.SMTPServerDisconnected('gone')
+        with mock.patch('app.email.mail.connect', return_value=connection):
+            self.assertEqual(dispatcher.send_pending(), 0)
+        self.assertEqual([msg.attempts for msg in Outbox.query], [1, 1])
+
+    def test_leased_rows_are_sent_once(self):
+        send_email('subject', 'admin@example.com', ['john@example.com'],
+                   'text', '<p>html</p>')
+        msg = Outbox.query.one()
+        # Another process's sender has leased the row.
+        self.assertEqual(dispatcher.claim([msg.id], 'other'), [msg.id])
+        self.assertEqual(dispatcher.claim([msg.id], 'again'), [])
+        self.assertEqual(dispatcher.send_pending(), 0)
+        self.assertEqual(dispatcher.sweep(), 0)
+        self.assertEqual(len(self.sink.messages), 0)
+
+        msg.locked_until = datetime.utcnow() - timedelta(seconds=1)
+        db.session.commit()
+        self.assertEqual(dispatcher.sweep(), 1)
+        self.assertEqual(dispatcher.send_pending(), 1)
+        self.assertEqual(len(self.sink.messages), 1)
+        self.assertIsNone(Outbox.query.one().locked_until)
+        self.assertEqual(dispatcher.deliver([msg.id]), 0)
+        self.assertEqual(len(self.sink.messages), 1)
+
+
+class MetricsCase(unittest.TestCase):
+    def test_summary_quantiles(self):
+        summary = Summary(window=100)
+        for value in range(1, 101):
+            summary.observe(value)
+        self.assertEqual(summary.count, 100)
+        self.assertEqual(summary.quantile(0.5), 51)
+        self.assertEqual(summary.quantile(0.99), 100)
+
+    def test_metrics_endpoint(self):
+        test_app = Flask(__name__)
+        test_app.config['METRICS_ENABLED'] = True
+        test_app.config['METRICS_PROFILE_RATE'] = 1.0
+        test_app.config['METRICS_PROFILE_THRESHOLD_MS'] = 10 ** 6
+        Metrics(test_app)
+        test_app.add_url_rule('/ping', 'ping', lambda: 'pong')
+        client = test_app.test_client()
+        for i in range(3):
+            self.assertEqual(client.get('/ping').data, b'pong')
+        text = client.get('/metrics').get_data(as_text=True)
+        self.assertIn('# TYPE microblog_request_seconds summary', text)
+        self.assertIn('microblog_request_seconds_count'
+                      '{endpoint="ping",method="GET"} 3', text)
+        self.assertIn('microblog_request_queries{endpoint="ping",'
+                      'quantile="0.99"} 0', text)
+
+
+class AssetsCase(unittest.TestCase):
+    def setUp(self):
+        self.static = tempfile.TemporaryDirectory()
+        for name, content in (('a.css', '/* a */\nbody {\n  margin: 0;\n}'),
+                              ('b.css', 'p { color : red ; }'),
+                              ('logo.svg', '<svg/>')):
+            with open(os.path.join(self.static.name, name), 'w') as f:
+                f.write(content)
+        self.app = Flask(__name__, static_folder=self.static.name,
+                         static_url_path='/static')
+        self.app.config['ASSETS_BUNDLES'] = {'site.css': ['a.css', 'b.css']}
+        self.app.config['ASSETS_FILES'] = ('logo.svg',)
+        self.assets = Assets(self.app)
+
+    def tearDown(self):
+        self.static.cleanup()
+
+    def test_minify_css(self):
+        self.assertEqual(minify_css('/*! MIT */\n/* x */ a , b {\n'
+                                    '  top : 0 ;\n}\n'),
+                         '/*! MIT */ a,b{top:0}')
+
+    def test_sources_without_manifest(self):
+        with self.app.test_request_context():
+            self.assertEqual(render_template_string(
+                "{{ asset_urls('site.css')|join(' ') }} "
+                "{{ url_for('static', filename='logo.svg') }}"),
+                '/static/a.css /static/b.css /static/logo.svg')
+
+    def test_build_and_serve(self):
+        manifest = self.assets.build(self.app)
+        self.assertRegex(manifest['site.css'],
+                         r'^dist/site\.[0-9a-f]{12}\.css$')
+        with self.app.test_request_context():
+            self.assertEqual(url_for('static', filename='logo.svg'),
+                             '/static/' + manifest['logo.svg'])
+            self.assertEqual(render_template_string(
+                "{{ asset_urls('site.css')|join(' ') }}"),
+                '/static/' + manifest['site.css'])
+
+        client = self.app.test_client()
+        url = '/static/' + manifest['site.css']
+        response = client.get(url, headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(response.mimetype, 'text/css')
+        self.assertEqual(gzip.decompress(response.data),
+                         b'body{margin:0}p{color:red}')
+        self.assertIn('immutable', response.headers['Cache-Control'])
+        self.assertIn('Accept-Encoding', response.headers['Vary'])
+        response.close()
+        response = client.get(url)
+        self.assertIsNone(response.content_encoding)
+        self.assertEqual(response.data, b'body{margin:0}p{color:red}')
+        response.close()
+
+        # A new application reads the manifest written by the build.
+        other = Flask(__name__, static_folder=self.static.name)
+        Assets(other)
+        self.assertEqual(other.extensions['assets'], manifest)
+
+
+class MemoryCacheCase(unittest.TestCase):
+    def test_lru_eviction(self):
+        c = MemoryCache(threshold=2)
+        c.set('a', 1)
+        c.set('b', 2)
+        self.assertEqual(c.get('a'), 1)
+        c.set('c', 3)
+        self.assertIsNone(c.get('b'))
+        self.assertEqual(c.get('a'), 1)
+        self.assertEqual(c.get('c'), 3)
+
+    def test_expiry(self):
+        c = MemoryCache()
+        c.set('a', 1, timeout=-1)
+        self.assertIsNone(c.get('a'))
+        c.set('b', 2, timeout=0)
+        self.assertEqual(c.get('b'), 2)
+
+    def test_counters_survive_eviction(self):
+        c = MemoryCache(threshold=1)
+        self.assertEqual(c.incr('generation'), 1)
+        c.set('a', 1)
+        c.set('b', 2)
+        self.assertEqual(c.counter('generation'), 1)
+
+    def test_redis_clear_keeps_other_keys(self):
+        client = mock.Mock()
+        client.scan_iter.return_value = ['microblog:cache:1:page']
+        RedisCache(client, prefix='microblog:cache:').clear()
+        client.scan_iter.assert_called_once_with(match='microblog:cache:*')
+        client.delete.assert_called_once_with('microblog:cache:1:page')
+        client.flushdb.assert_not_called()
+
+    def test_memory_backend_warns_in_production(self):
+        class ProductionConfig(TestConfig):
+            TESTING = False
+
+        with self.assertLogs('app', 'WARNING') as logs:
+            create_app(ProductionConfig)
+        self.assertIn('CACHE_TYPE memory', logs.output[0])
+        self.assertEqual(Config.CACHE_TYPE, 'file')
+
+
+class BenchmarkCase(unittest.TestCase):
+    def test_generated_follows(self):
+        rng = random.Random(0)
+        weights = power_law_weights(50, 1.2, rng)
+        edges = [(row['follower_id'], row['followed_id'])
+                 for row in generate_follows(50, 5, weights, rng)]
+        self.assertEqual(len(edges), len(set(edges)))
+        self.assertFalse([edge for edge in edges if edge[0] == edge[1]])
+
+    def test_compare(self):
+        baseline = {'scenarios': {'index': {'throughput': 100.0,
+                                            'p95_ms': 20.0}}}
+        same = {'scenarios': {'index': {'throughput': 95.0,
+                                        'p95_ms': 21.0}}}
+        slower = {'scenarios': {'index': {'throughput': 80.0,
+                                          'p95_ms': 30.0}}}
+        self.assertEqual(compare(baseline, same, 0.1), [])
+        self.assertEqual(len(compare(baseline, slower, 0.1)), 2)
+
+
+class RateLimitCase(unittest.TestCase):
+    def test_parse_rate(self):
+        self.assertEqual(parse_rate('5/minute'), (5, 60))
+        self.assertEqual(parse_rate('10 per 2 hours'), (10, 7200))
+        self.assertRaises(ValueError, parse_rate, '5 a minute')
+
+    def test_token_bucket(self):
+        store = MemoryStore()
+        # 3 per 30 seconds: a burst of 3, then one every 10 seconds.
+        for i in range(3):
+            self.assertEqual(store.hit('k', 100.0, 10.0, 30.0), 0)
+        self.assertAlmostEqual(store.hit('k', 100.0, 10.0, 30.0), 10.0)
+        self.assertAlmostEqual(store.hit('k', 104.0, 10.0, 30.0), 6.0)
+        self.assertEqual(store.hit('k', 110.0, 10.0, 30.0), 0)
+        self.assertGreater(store.hit('k', 110.0, 10.0, 30.0), 0)
+        self.assertEqual(store.hit('other', 110.0, 10.0, 30.0), 0)
+
+    def test_prune(self):
+        store = MemoryStore(threshold=2)
+        store.hit('a', 0.0, 1.0, 10.0)
+        store.hit('b', 0.0, 1.0, 10.0)
+        store.hit('c', 5.0, 1.0, 10.0)
+        self.assertEqual(set(store._tats), {'c'})
+
+    def test_size_is_bounded(self):
+        store = MemoryStore(threshold=2)
+        store.hit('a', 0.0, 10.0, 30.0)
+        store.hit('b', 0.0, 10.0, 30.0)
+        store.hit('a', 1.0, 10.0, 30.0)
+        store.hit('c', 2.0, 10.0, 30.0)
+        # 'b' is the least recently used live key.
+        self.assertEqual(list(store._tats), ['a', 'c'])
+
 
 if __name__ == '__main__':
-    unittest.main(verbosity=2)
\ No newline at end of file
+    unittest.main(verbosity=2)